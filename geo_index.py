@@ -0,0 +1,145 @@
+"""
+File: geo_index.py
+
+Desc: A spatial index over lat-lng coordinates, used to quickly find the
+filming locations that may fall within some region of the map.
+
+The index is a uniform grid: the world is split into square cells of a
+fixed size (in degrees), and each cell stores the ids of the entries that
+have a coordinate inside it, or whose bounding box overlaps it.  Finding the
+entries near a location then only requires looking in the few cells which
+overlap the region of interest.
+"""
+
+import heapq
+from math import floor
+
+
+class GridIndex(object):
+    """
+    Desc: A uniform grid over lat-lng coordinates.
+    Entries are identified by an integer id (eg an index into lat_data),
+    and an entry can be inserted at any number of coordinates.
+    """
+    def __init__(self, cell_size):
+        """
+        Input: the width and height of a grid cell, in degrees.
+        """
+        self.cell_size = cell_size
+        self.cells = dict()  # Maps (row, col) => list of entry ids.
+
+
+    def cell_of(self, lat, lng):
+        """
+        Input: a lat-lng coordinate.
+        Output: the (row, col) of the grid cell containing that coordinate.
+        """
+        return (int(floor(lat / self.cell_size)), int(floor(lng / self.cell_size)))
+
+
+    def insert(self, entry_id, latlngs):
+        """
+        Input:
+        o entry_id: the id of the entry to insert.
+        o latlngs: a flat list of coordinates for this entry, [lat1, lng1, lat2, lng2, ...].
+        The entry is added once to each cell that contains one of its coordinates.
+        """
+        cells = set()
+        for i in range(0, len(latlngs)-1, 2):
+            cells.add(self.cell_of(latlngs[i], latlngs[i+1]))
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(entry_id)
+
+
+    def insert_box(self, entry_id, min_lat, max_lat, min_lng, max_lng):
+        """
+        Input:
+        o entry_id: the id of the entry to insert.
+        o min_lat, max_lat, min_lng, max_lng: the bounding box of the entry.
+        The entry is added to every cell that overlaps its bounding box, so
+        that it can be found by a query on any part of it, eg the middle of a
+        long line segment.
+        """
+        row_start, col_start = self.cell_of(min_lat, min_lng)
+        row_stop, col_stop = self.cell_of(max_lat, max_lng)
+        for row in range(row_start, row_stop+1):
+            for col in range(col_start, col_stop+1):
+                self.cells.setdefault((row, col), []).append(entry_id)
+
+
+    def query(self, min_lat, max_lat, min_lng, max_lng):
+        """
+        Input: the corners of a lat-lng bounding box.
+        Output: a sorted list of the ids of all entries in the grid cells which
+                overlap this box.  These are candidates, and may have coordinates
+                that are outside of the box.
+        """
+        row_start, col_start = self.cell_of(min_lat, min_lng)
+        row_stop, col_stop = self.cell_of(max_lat, max_lng)
+        ids = set()
+        num_cells = (row_stop - row_start + 1) * (col_stop - col_start + 1)
+        if num_cells > len(self.cells):
+            # The box covers more cells than are in use, so it is faster
+            # to go through the ones in use:
+            for (row, col), cell_ids in self.cells.items():
+                if (row_start <= row <= row_stop) and (col_start <= col <= col_stop):
+                    ids.update(cell_ids)
+        else:
+            for row in range(row_start, row_stop+1):
+                for col in range(col_start, col_stop+1):
+                    cell_ids = self.cells.get((row, col))
+                    if cell_ids:
+                        ids.update(cell_ids)
+        return sorted(ids)
+
+
+    def cell_box(self, cell):
+        """
+        Input: the (row, col) of a grid cell.
+        Output: the corners of the cell, (min_lat, max_lat, min_lng, max_lng).
+        """
+        row, col = cell
+        return (row*self.cell_size, (row+1)*self.cell_size,
+                col*self.cell_size, (col+1)*self.cell_size)
+
+
+    def cells_by_distance(self, lat, lng, bound):
+        """
+        Desc: A best-first search of the grid cells, from the cell containing
+              a lat-lng outwards.
+        Input: a lat-lng; and a function, bound(min_lat, max_lat, min_lng, max_lng),
+               giving the shortest distance from the lat-lng to any point in a box.
+        Output: a generator of (distance, list of entry ids) for each cell in use,
+                in order of the distance to the cell.  The caller can stop once
+                the distance is more than it needs.
+        """
+        def push(cell):
+            seen.add(cell)
+            heapq.heappush(heap, (bound(*self.cell_box(cell)), cell))
+        #
+        heap = []
+        seen = set()
+        push(self.cell_of(lat, lng))
+        num_found = 0
+        pushed_all = False
+        while heap and (num_found < len(self.cells)):
+            dist, cell = heapq.heappop(heap)
+            cell_ids = self.cells.get(cell)
+            if cell_ids:
+                num_found += 1
+                yield dist, cell_ids
+            if pushed_all:
+                continue
+            if len(seen) > 4*len(self.cells) + 9:
+                # Far from the entries, most cells are empty, so rather than
+                # spreading out any further, add all of the cells in use:
+                for cell in self.cells:
+                    if not cell in seen:
+                        push(cell)
+                pushed_all = True
+                continue
+            row, col = cell
+            for neighbor in [(row-1, col-1), (row-1, col), (row-1, col+1), (row, col-1),
+                             (row, col+1), (row+1, col-1), (row+1, col), (row+1, col+1)]:
+                if not neighbor in seen:
+                    push(neighbor)
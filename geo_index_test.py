@@ -0,0 +1,78 @@
+"""
+File: geo_index_test.py
+Desc: Unit tests for geo_index.py
+"""
+
+import unittest
+import geo_index
+
+
+class GridIndexTest(unittest.TestCase):
+    def test_cell_of(self):
+        grid = geo_index.GridIndex(0.5)
+        self.assertEqual(grid.cell_of(0.0, 0.0), (0, 0))
+        self.assertEqual(grid.cell_of(37.75, -122.25), (75, -245))
+        self.assertEqual(grid.cell_of(-0.1, 0.49), (-1, 0))
+
+
+    def test_insert(self):
+        grid = geo_index.GridIndex(1.0)
+        grid.insert(0, [37.5, -122.5])
+        # Both end-points in the same cell only adds the entry once:
+        grid.insert(1, [37.5, -122.5, 37.6, -122.4])
+        # End-points in different cells adds the entry to both:
+        grid.insert(2, [37.5, -122.5, 38.5, -122.5])
+        self.assertEqual(grid.cells, {(37, -123): [0, 1, 2], (38, -123): [2]})
+
+
+    def test_insert_box(self):
+        grid = geo_index.GridIndex(1.0)
+        grid.insert_box(0, 37.5, 37.5, -122.5, -122.5)
+        # A box covering several cells is added to all of them:
+        grid.insert_box(1, 37.5, 38.5, -122.5, -120.5)
+        self.assertEqual(grid.cells, {(37, -123): [0, 1], (37, -122): [1], (37, -121): [1],
+                                      (38, -123): [1], (38, -122): [1], (38, -121): [1]})
+
+
+    def test_query(self):
+        grid = geo_index.GridIndex(1.0)
+        grid.insert(3, [37.5, -122.5])
+        grid.insert(1, [37.5, -121.5])
+        grid.insert(2, [10.5, 10.5, 37.2, -122.2])
+        grid.insert(0, [-30.5, 100.5])
+
+        # Test on an empty box:
+        self.assertEqual(grid.query(0.1, 0.2, 0.1, 0.2), [])
+
+        # Test on boxes covering some of the cells:
+        self.assertEqual(grid.query(37.1, 37.2, -122.9, -122.8), [2, 3])
+        self.assertEqual(grid.query(37.1, 37.2, -122.9, -121.8), [1, 2, 3])
+        self.assertEqual(grid.query(10.0, 10.1, 10.0, 10.1), [2])
+
+        # Test on a box covering more cells than are in use:
+        self.assertEqual(grid.query(-90.0, 90.0, -180.0, 180.0), [0, 1, 2, 3])
+
+
+    def test_cells_by_distance(self):
+        grid = geo_index.GridIndex(1.0)
+        grid.insert(0, [0.5, 0.5])
+        grid.insert(1, [0.5, 3.5])
+        grid.insert(2, [-2.5, 0.5])
+        grid.insert(3, [0.5, 3.2])
+        grid.insert(4, [40.5, 40.5])
+        def bound(min_lat, max_lat, min_lng, max_lng):
+            # Flat distance from (0.5, 0.5) to the box:
+            dlat = max(min_lat - 0.5, 0.0, 0.5 - max_lat)
+            dlng = max(min_lng - 0.5, 0.0, 0.5 - max_lng)
+            return (dlat**2 + dlng**2) ** 0.5
+        res = list(grid.cells_by_distance(0.5, 0.5, bound))
+        self.assertEqual([ids for dist, ids in res], [[0], [2], [1, 3], [4]])
+        self.assertEqual([dist for dist, ids in res], [0.0, 2.5, 2.5, bound(40, 41, 40, 41)])
+        # Starting far from all of the cells:
+        res = list(grid.cells_by_distance(-60.5, -60.5, lambda *box: abs(box[0])))
+        self.assertEqual(sorted(i for dist, ids in res for i in ids), [0, 1, 2, 3, 4])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,314 @@
+"""
+File: geocode.py
+
+Desc: A pipeline for finding the lat-lng values of many location strings
+using online geocoding services.
+
+Location strings are geocoded concurrently by a pool of worker threads.
+Each geocoding service (provider) has its own rate limit, and requests which
+fail are retried with an increasing delay before the next provider is tried.
+Results are saved as they arrive, either to a checkpoint file or to a
+persistent cache, so if a run stops part way through (eg a crash or running
+out of free queries), the next run only geocodes the strings that are not
+yet saved.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket(object):
+    """
+    Desc: A token-bucket rate limiter, which is safe to share between threads.
+    Tokens are added at 'rate' per second, up to 'capacity', and each call
+    to acquire() takes one token, waiting until one is available.
+    """
+    def __init__(self, rate, capacity=1, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.last = clock()
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        """
+        Desc: Takes a token, waiting for one if the bucket is empty.
+        """
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last)*self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+
+class Provider(object):
+    """
+    Desc: A geocoding service, along with the rate at which it can be queried.
+    o name: the name of the provider, recorded with each of its results.
+    o geocoder: an object with a geocode(query) method, such as a GeoPy geocoder.
+      This returns None if the query is not found, and otherwise a result
+      whose second item is a (lat, lng) pair.
+    o rate: the maximum number of queries per second.
+    """
+    def __init__(self, name, geocoder, rate, sleep=time.sleep):
+        self.name = name
+        self.geocoder = geocoder
+        self.bucket = TokenBucket(rate, sleep=sleep)
+
+
+    def geocode(self, query):
+        """
+        Output: the (lat, lng) of the query, or None if it was not found.
+        """
+        self.bucket.acquire()
+        res = self.geocoder.geocode(query)
+        if not res:
+            return None
+        return (res[1][0], res[1][1])
+
+
+
+class Checkpoint(object):
+    """
+    Desc: An append-only file of geocoding results, with one JSON object per line:
+      {"addr": location string, "latlng": [lat, lng], "provider": provider name,
+       "confidence": confidence score of the location string}
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+
+    def load(self):
+        """
+        Output: a dictionary mapping each location string in the file to its
+                (lat, lng).  Lines which can not be read, such as a line that
+                was only partly written when a run stopped, are skipped.
+        """
+        results = {}
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        results[entry['addr']] = tuple(entry['latlng'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except IOError:
+            pass  # No checkpoint yet.
+        return results
+
+
+    def lookup(self, addrs):
+        """
+        Input: a list of location strings.
+        Output: a dictionary mapping each of these which is in the file to its (lat, lng).
+        """
+        results = self.load()
+        return dict((a, results[a]) for a in addrs if a in results)
+
+
+    def append(self, addr, latlng, provider, confidence=None):
+        """
+        Desc: Adds a result to the end of the file.
+        """
+        line = json.dumps({'addr':addr, 'latlng':list(latlng), 'provider':provider,
+                           'confidence':confidence})
+        with self._lock:
+            with open(self.filename, 'a', encoding='utf-8') as file:
+                file.write(line + '\n')
+
+
+
+def normalize_addr(addr):
+    """
+    Input: a parsed location string.
+    Output: the string lower-cased and with runs of whitespace replaced by
+            single spaces, so that eg 'Pier 39' and 'pier  39 ' are the same.
+    """
+    return ' '.join(addr.lower().split())
+
+
+
+class GeocodeCache(object):
+    """
+    Desc: A persistent cache of geocoding results, stored in an SQLite database.
+    Entries are keyed on the normalized location string (see normalize_addr()),
+    and record the lat-lng, the provider that found it, the time it was found
+    and the confidence score of the location string.  Entries older than 'ttl'
+    seconds are expired, and are geocoded again.
+    The counts of hits, misses and expired entries are kept for reporting.
+    """
+    def __init__(self, filename, ttl=None, clock=time.time):
+        self.filename = filename
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        conn = sqlite3.connect(self.filename)
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS geocodes ('
+                         ' addr TEXT PRIMARY KEY, lat REAL, lng REAL, provider TEXT,'
+                         ' timestamp REAL, confidence INTEGER)')
+        conn.close()
+
+
+    def lookup(self, addrs):
+        """
+        Input: a list of location strings.
+        Output: a dictionary mapping each of these which has an unexpired entry
+                in the cache to its (lat, lng).
+        """
+        results = {}
+        now = self.clock()
+        with self._lock:
+            conn = sqlite3.connect(self.filename)
+            for addr in sorted(set(addrs)):
+                row = conn.execute('SELECT lat, lng, timestamp FROM geocodes WHERE addr = ?',
+                                   (normalize_addr(addr),)).fetchone()
+                if row is None:
+                    self.misses += 1
+                elif (self.ttl is not None) and (now - row[2] > self.ttl):
+                    self.expired += 1
+                else:
+                    self.hits += 1
+                    results[addr] = (row[0], row[1])
+            conn.close()
+        return results
+
+
+    def append(self, addr, latlng, provider, confidence=None, timestamp=None):
+        """
+        Desc: Adds a result to the cache, replacing any existing entry.
+        """
+        if timestamp is None:
+            timestamp = self.clock()
+        with self._lock:
+            conn = sqlite3.connect(self.filename)
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?)',
+                             (normalize_addr(addr), latlng[0], latlng[1], provider,
+                              timestamp, confidence))
+            conn.close()
+
+
+    def entry(self, addr):
+        """
+        Output: the cache entry for a location string, as a dictionary with the
+                keys 'latlng', 'provider', 'timestamp' and 'confidence'; or None
+                if it is not in the cache.
+        """
+        with self._lock:
+            conn = sqlite3.connect(self.filename)
+            row = conn.execute('SELECT lat, lng, provider, timestamp, confidence'
+                               ' FROM geocodes WHERE addr = ?',
+                               (normalize_addr(addr),)).fetchone()
+            conn.close()
+        if row is None:
+            return None
+        return {'latlng':(row[0], row[1]), 'provider':row[2],
+                'timestamp':row[3], 'confidence':row[4]}
+
+
+    def report(self):
+        """
+        Output: a string describing the hits, misses and expired entries so far.
+        """
+        total = self.hits + self.misses + self.expired
+        rate = 0.0
+        if total > 0:
+            rate = 100.0 * self.hits / total
+        return 'geocode cache: {} hits, {} misses, {} expired ({:.1f}% hit rate)'.format(
+            self.hits, self.misses, self.expired, rate)
+
+
+
+def geocode_one(query, providers, retries=2, backoff=1.0, sleep=time.sleep):
+    """
+    Desc: Geocodes one query, trying each provider in turn.  A request that
+          raises an exception is retried up to 'retries' times, waiting
+          backoff, 2*backoff, 4*backoff, ... seconds before each retry.
+    Input: the query string; and a list of Providers.
+    Output: a pair consisting of:
+      o the (lat, lng) and the name of the provider, if one found the query;
+      o None and the name of the last provider, if the providers were all able
+        to answer but none found the query;
+      o None and None, if a provider failed to answer, so the query should be
+        tried again on a later run.
+    """
+    answered = True
+    provider_name = None
+    for provider in providers:
+        for attempt in range(retries+1):
+            try:
+                latlng = provider.geocode(query)
+                if latlng:
+                    return latlng, provider.name
+                provider_name = provider.name
+                break
+            except Exception as e:
+                print('geocode_one({}) - {}: {}'.format(query, provider.name, e))
+                if attempt == retries:
+                    answered = False
+                else:
+                    sleep(backoff * 2**attempt)
+    if not answered:
+        return None, None
+    return None, provider_name
+
+
+
+def geocode_all(addrs, providers, checkpoint=None, default=None, suffix='',
+                workers=4, retries=2, backoff=1.0, sleep=time.sleep, confidences=None):
+    """
+    Desc: Geocodes a list of location strings using a pool of worker threads.
+    Input:
+    o addrs: the location strings to geocode.
+    o providers: a list of Providers, tried in order for each location.
+    o checkpoint: an optional Checkpoint or GeocodeCache.  Locations which are
+      already in it are not geocoded again, and new results are appended to it
+      as they arrive.
+    o default: the lat-lng to use for locations that no provider can find.
+    o suffix: text added to each location to make the query, eg ', San Francisco, CA'.
+    o workers, retries, backoff: the number of worker threads, and the retry
+      settings for geocode_one().
+    o confidences: an optional dictionary of the confidence score of each
+      location string, which is saved along with its result.
+    Output: A dictionary mapping from location string => lat-lng values.
+            Locations which could not be geocoded because of errors are
+            not included, so that they are tried again on the next run.
+    """
+    results = {}
+    if checkpoint:
+        results = checkpoint.lookup(addrs)
+    if confidences is None:
+        confidences = {}
+    todo = [a for a in sorted(set(addrs)) if not a in results]
+    #
+    def work(addr):
+        latlng, provider_name = geocode_one(addr + suffix, providers, retries, backoff, sleep)
+        if (latlng is None) and (provider_name is not None):
+            latlng = default  # All providers answered, but none found it.
+        if (latlng is not None) and checkpoint:
+            checkpoint.append(addr, latlng, provider_name, confidences.get(addr))
+        return addr, latlng
+    #
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for addr, latlng in pool.map(work, todo):
+            if latlng is not None:
+                results[addr] = latlng
+    return dict((a, results[a]) for a in addrs if a in results)
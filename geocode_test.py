@@ -0,0 +1,191 @@
+"""
+File: geocode_test.py
+Desc: Unit tests for geocode.py
+Note: these tests use a stub geocoder rather than the online geocoding services.
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+import geocode
+
+
+class StubGeocoder(object):
+    """
+    Desc: A local stand-in for a GeoPy geocoder.
+    o latlngs: a dictionary mapping queries to the (lat, lng) to return.
+    o failures: a dictionary mapping queries to the number of times to raise
+      an exception before answering.
+    """
+    def __init__(self, latlngs, failures=None):
+        self.latlngs = latlngs
+        self.failures = dict(failures or {})
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def geocode(self, query):
+        with self._lock:
+            self.queries.append(query)
+            if self.failures.get(query, 0) > 0:
+                self.failures[query] -= 1
+                raise IOError('Service unavailable')
+        if query in self.latlngs:
+            # GeoPy results are (address, (lat, lng)):
+            return (query, self.latlngs[query])
+        return None
+
+
+def no_sleep(seconds):
+    return None
+
+
+
+class GeocodeTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        os.remove(self.filename)
+
+    def tearDown(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+    def test_token_bucket(self):
+        # Use a fake clock, which only moves when the bucket sleeps:
+        now = [0.0]
+        sleeps = []
+        def clock():
+            return now[0]
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+        bucket = geocode.TokenBucket(2.0, capacity=1, clock=clock, sleep=sleep)
+        for i in range(5):
+            bucket.acquire()
+        # The first token is available at once, then one every half second:
+        self.assertEqual(sleeps, [0.5, 0.5, 0.5, 0.5])
+        self.assertEqual(now[0], 2.0)
+
+
+    def test_checkpoint(self):
+        checkpoint = geocode.Checkpoint(self.filename)
+        self.assertEqual(checkpoint.load(), {})
+        checkpoint.append('Pier 39', (37.80, -122.41), 'stub')
+        checkpoint.append('Café Trieste', (37.79, -122.40), 'stub')
+        # A partly written line is skipped:
+        with open(self.filename, 'a') as file:
+            file.write('{"addr": "Coit To')
+        self.assertEqual(checkpoint.load(), {'Pier 39': (37.80, -122.41),
+                                             'Café Trieste': (37.79, -122.40)})
+
+
+    def test_geocode_one(self):
+        stub1 = StubGeocoder({'a': (1.0, 2.0)}, failures={'b': 100})
+        stub2 = StubGeocoder({'b': (3.0, 4.0)}, failures={'c': 1})
+        providers = [geocode.Provider('one', stub1, 1000.0, sleep=no_sleep),
+                     geocode.Provider('two', stub2, 1000.0, sleep=no_sleep)]
+        # Found by the first provider:
+        self.assertEqual(geocode.geocode_one('a', providers, sleep=no_sleep), ((1.0, 2.0), 'one'))
+        # The first provider keeps failing, so the second is used:
+        sleeps = []
+        self.assertEqual(geocode.geocode_one('b', providers, retries=2, backoff=1.0,
+                                             sleep=sleeps.append), ((3.0, 4.0), 'two'))
+        self.assertEqual(sleeps, [1.0, 2.0])
+        self.assertEqual(stub1.queries.count('b'), 3)
+        # Not found by either provider; the second one fails once, then answers:
+        self.assertEqual(geocode.geocode_one('c', providers, sleep=no_sleep), (None, 'two'))
+        # A provider which fails on every try means the query should be retried later:
+        self.assertEqual(geocode.geocode_one('b', providers[:1], sleep=no_sleep), (None, None))
+
+
+    def test_geocode_all(self):
+        latlngs = dict(('addr {}, SF'.format(i), (37.0 + i/100.0, -122.0)) for i in range(20))
+        stub = StubGeocoder(latlngs, failures={'addr 5, SF': 10})
+        providers = [geocode.Provider('stub', stub, 1000.0, sleep=no_sleep)]
+        checkpoint = geocode.Checkpoint(self.filename)
+        addrs = ['addr {}'.format(i) for i in range(20)] + ['unknown']
+
+        # The first run: 'addr 5' keeps failing, and 'unknown' is not found:
+        res = geocode.geocode_all(addrs, providers, checkpoint, default=(0.0, 0.0), suffix=', SF',
+                                  workers=4, retries=1, sleep=no_sleep)
+        self.assertEqual(len(res), 20)
+        self.assertFalse('addr 5' in res)
+        self.assertEqual(res['addr 7'], (37.07, -122.0))
+        self.assertEqual(res['unknown'], (0.0, 0.0))
+        self.assertEqual(len(checkpoint.load()), 20)
+
+        # The second run resumes from the checkpoint, and only queries 'addr 5':
+        stub.queries = []
+        stub.failures = {}
+        res = geocode.geocode_all(addrs, providers, checkpoint, default=(0.0, 0.0), suffix=', SF',
+                                  workers=4, sleep=no_sleep)
+        self.assertEqual(stub.queries, ['addr 5, SF'])
+        self.assertEqual(len(res), 21)
+        self.assertEqual(res['addr 5'], (37.05, -122.0))
+        self.assertEqual(len(checkpoint.load()), 21)
+
+        # Test without a checkpoint:
+        res = geocode.geocode_all(['addr 1', 'addr 1'], providers, suffix=', SF', sleep=no_sleep)
+        self.assertEqual(res, {'addr 1': (37.01, -122.0)})
+
+
+
+    def test_normalize_addr(self):
+        self.assertEqual(geocode.normalize_addr(' Pier  39 '), 'pier 39')
+        self.assertEqual(geocode.normalize_addr('Market and 2nd Streets'), 'market and 2nd streets')
+
+
+    def test_geocode_cache(self):
+        now = [1000.0]
+        def clock():
+            return now[0]
+        cache = geocode.GeocodeCache(self.filename, ttl=100, clock=clock)
+        self.assertEqual(cache.lookup(['Pier 39']), {})
+        cache.append('Pier 39', (37.80, -122.41), 'stub', 1)
+        self.assertEqual(cache.entry('pier  39'), {'latlng': (37.80, -122.41), 'provider': 'stub',
+                                                   'timestamp': 1000.0, 'confidence': 1})
+        self.assertEqual(cache.entry('Coit Tower'), None)
+
+        # Lookups are on the normalized location string:
+        self.assertEqual(cache.lookup(['PIER 39', 'Coit Tower']), {'PIER 39': (37.80, -122.41)})
+
+        # The cache is persistent:
+        cache = geocode.GeocodeCache(self.filename, ttl=100, clock=clock)
+        now[0] = 1050.0
+        self.assertEqual(cache.lookup(['Pier 39']), {'Pier 39': (37.80, -122.41)})
+
+        # Entries expire after the ttl:
+        now[0] = 1101.0
+        self.assertEqual(cache.lookup(['Pier 39', 'Coit Tower']), {})
+        self.assertEqual((cache.hits, cache.misses, cache.expired), (1, 1, 1))
+        self.assertEqual(cache.report(),
+                         'geocode cache: 1 hits, 1 misses, 1 expired (33.3% hit rate)')
+
+
+    def test_geocode_all_cache(self):
+        now = [1000.0]
+        def clock():
+            return now[0]
+        stub = StubGeocoder({'Pier 39, SF': (37.80, -122.41), 'Coit Tower, SF': (37.80, -122.40)})
+        providers = [geocode.Provider('stub', stub, 1000.0, sleep=no_sleep)]
+        cache = geocode.GeocodeCache(self.filename, ttl=100, clock=clock)
+        cache.append('Coit Tower', (37.0, -122.0), 'old', 100, timestamp=850.0)
+        cache.append('Pier 39', (37.80, -122.41), 'old', 1, timestamp=950.0)
+
+        # Only the expired entry and the miss are geocoded:
+        addrs = ['Pier 39', 'Coit Tower', 'Nowhere']
+        res = geocode.geocode_all(addrs, providers, cache, default=(0.0, 0.0), suffix=', SF',
+                                  sleep=no_sleep, confidences={'Coit Tower': 100, 'Nowhere': 2})
+        self.assertEqual(sorted(stub.queries), ['Coit Tower, SF', 'Nowhere, SF'])
+        self.assertEqual(res, {'Pier 39': (37.80, -122.41), 'Coit Tower': (37.80, -122.40),
+                               'Nowhere': (0.0, 0.0)})
+        self.assertEqual(cache.entry('Coit Tower'), {'latlng': (37.80, -122.40), 'provider': 'stub',
+                                                     'timestamp': 1000.0, 'confidence': 100})
+        self.assertEqual(cache.entry('Nowhere')['confidence'], 2)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+"""
+File: lat_data_file.py
+
+Desc: A compact, binary file format for lat_data, the list of movie
+locations sorted on latitude.
+
+Each entry of lat_data is a list: [lat, latlngs, movie-key, location description, fun fact],
+where latlngs is either [lat1, lng1] or [lat1, lng1, lat2, lng2].  Rather than
+pickling these lists, the file stores them in columns:
+o a header: the file's magic string, the format version, the number of
+  entries and the number of strings;
+o the coordinates, as arrays of 64-bit floats (lat1, lng1, lat2, lng2),
+  where lat2 and lng2 are the same as lat1 and lng1 for a point;
+o an array of bytes which are 1 for entries that are line segments;
+o the movie keys, descriptions and fun facts, as arrays of 32-bit ids into
+  a table of strings, in which each distinct string is stored once;
+o the string table: an array of 32-bit offsets followed by the UTF-8 text.
+All values are little-endian, and each array starts on an 8-byte boundary.
+
+The file is read with mmap, so the arrays are used in place, and all of the
+processes reading the file share one copy of it in the OS page cache.
+Since running processes may have the file mapped, it is never rewritten in
+place: a new file is written next to it and then renamed over it.
+"""
+
+import contextlib
+import mmap
+import os
+import struct
+import tempfile
+import numpy as np
+
+
+Magic = b'SFMLAT\x00\x00'
+Format_Version = 1
+
+# Magic, format version, number of entries, number of strings:
+Header_Format = '<8sIII'
+Header_Size = 24  # struct.calcsize(Header_Format), padded to 8 bytes.
+
+
+def align8(n):
+    """
+    Output: n rounded up to a multiple of 8.
+    """
+    return (n + 7) // 8 * 8
+
+
+
+def array_offsets(num_entries, num_strings):
+    """
+    Input: the number of entries and of strings in the file.
+    Output: a dictionary of the offsets of the arrays in the file,
+            along with the offset of the start of the UTF-8 text.
+    """
+    offsets = {}
+    offset = Header_Size
+    for name, size in [('lat1', 8*num_entries), ('lng1', 8*num_entries),
+                       ('lat2', 8*num_entries), ('lng2', 8*num_entries),
+                       ('has_segment', num_entries),
+                       ('key_ids', 4*num_entries), ('desc_ids', 4*num_entries),
+                       ('funfact_ids', 4*num_entries),
+                       ('string_offsets', 4*(num_strings+1))]:
+        offsets[name] = offset
+        offset = align8(offset + size)
+    offsets['text'] = offset
+    return offsets
+
+
+
+@contextlib.contextmanager
+def open_for_replace(filename):
+    """
+    Input: the name of the file to write.
+    Output: a context manager giving a binary file to write the new contents
+            to.  This is a temporary file in the same directory, which replaces
+            the file (with os.replace()) once it is closed without an error.
+    Desc: Processes which have the old file open, or memory-mapped, keep
+          reading the old contents, rather than a truncated or half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filename),
+                                         suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            # mkstemp() makes the file readable only by its owner, so give it the
+            # mode of the file it replaces, or the usual mode for a new file:
+            if os.path.exists(filename):
+                mode = os.stat(filename).st_mode & 0o777
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                mode = 0o666 & ~umask
+            os.chmod(temp_filename, mode)
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
+    except:
+        os.remove(temp_filename)
+        raise
+
+
+
+def write_lat_data(lat_data, filename):
+    """
+    Input: lat_data, as created by sort_loc_by_lats() in preprocess_data.py;
+           and the name of the file to write.
+    Output: It writes lat_data to the file in the binary format.
+            The file is replaced, not rewritten in place (see open_for_replace()).
+    """
+    n = len(lat_data)
+    columns = dict((name, np.zeros(n, dtype='<f8')) for name in ['lat1', 'lng1', 'lat2', 'lng2'])
+    has_segment = np.zeros(n, dtype='u1')
+    string_ids = {}
+    strings = []
+    ids = dict((name, np.zeros(n, dtype='<i4')) for name in ['key_ids', 'desc_ids', 'funfact_ids'])
+    for i, loc in enumerate(lat_data):
+        latlngs = loc[1]
+        columns['lat1'][i], columns['lng1'][i] = latlngs[0], latlngs[1]
+        if len(latlngs) == 4:
+            columns['lat2'][i], columns['lng2'][i] = latlngs[2], latlngs[3]
+            has_segment[i] = 1
+        else:
+            columns['lat2'][i], columns['lng2'][i] = latlngs[0], latlngs[1]
+        for name, s in [('key_ids', loc[2]), ('desc_ids', loc[3]), ('funfact_ids', loc[4])]:
+            if not s in string_ids:
+                string_ids[s] = len(strings)
+                strings.append(s)
+            ids[name][i] = string_ids[s]
+    #
+    text = [s.encode('utf-8') for s in strings]
+    string_offsets = np.zeros(len(text)+1, dtype='<i4')
+    string_offsets[1:] = np.cumsum([len(t) for t in text])
+    #
+    arrays = dict(columns)
+    arrays.update(ids)
+    arrays['has_segment'] = has_segment
+    arrays['string_offsets'] = string_offsets
+    offsets = array_offsets(n, len(strings))
+    with open_for_replace(filename) as file:
+        file.write(struct.pack(Header_Format, Magic, Format_Version, n, len(strings)))
+        for name in sorted(arrays.keys(), key=lambda name: offsets[name]):
+            file.write(b'\0' * (offsets[name] - file.tell()))
+            file.write(arrays[name].tobytes())
+        file.write(b'\0' * (offsets['text'] - file.tell()))
+        file.write(b''.join(text))
+
+
+
+class MappedLatData(object):
+    """
+    Desc: lat_data, read from a file in the binary format using mmap.
+    The coordinate columns (lat1, lng1, lat2, lng2, has_segment) are arrays
+    over the mapped file.  Indexing returns an entry in the same format as
+    the lat_data lists: [lat, latlngs, movie-key, location description, fun fact].
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buffer) < Header_Size:
+            raise ValueError('{} is not a lat_data file'.format(filename))
+        magic, version, n, num_strings = struct.unpack_from(Header_Format, self.buffer, 0)
+        if magic != Magic:
+            raise ValueError('{} is not a lat_data file'.format(filename))
+        if version != Format_Version:
+            raise ValueError('{} has unsupported format version {}'.format(filename, version))
+        self.num_entries = n
+        #
+        offsets = array_offsets(n, num_strings)
+        def array(name, dtype, count):
+            return np.frombuffer(self.buffer, dtype=dtype, count=count, offset=offsets[name])
+        self.lat1 = array('lat1', '<f8', n)
+        self.lng1 = array('lng1', '<f8', n)
+        self.lat2 = array('lat2', '<f8', n)
+        self.lng2 = array('lng2', '<f8', n)
+        self.has_segment = array('has_segment', '?', n)
+        self.key_ids = array('key_ids', '<i4', n)
+        self.desc_ids = array('desc_ids', '<i4', n)
+        self.funfact_ids = array('funfact_ids', '<i4', n)
+        self.string_offsets = array('string_offsets', '<i4', num_strings+1)
+        self.text_offset = offsets['text']
+
+
+    def string(self, string_id):
+        """
+        Output: the string with this id from the string table.
+        """
+        start = self.text_offset + int(self.string_offsets[string_id])
+        stop = self.text_offset + int(self.string_offsets[string_id+1])
+        return self.buffer[start:stop].decode('utf-8')
+
+
+    def __len__(self):
+        return self.num_entries
+
+
+    def __getitem__(self, i):
+        if (i < 0) or (i >= self.num_entries):
+            raise IndexError('lat_data index out of range')
+        latlngs = [float(self.lat1[i]), float(self.lng1[i])]
+        if self.has_segment[i]:
+            latlngs += [float(self.lat2[i]), float(self.lng2[i])]
+        return [latlngs[0], latlngs, self.string(self.key_ids[i]),
+                self.string(self.desc_ids[i]), self.string(self.funfact_ids[i])]
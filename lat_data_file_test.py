@@ -0,0 +1,105 @@
+"""
+File: lat_data_file_test.py
+Desc: Unit tests for lat_data_file.py
+"""
+
+import os
+import pickle
+import tempfile
+import unittest
+import lat_data_file as ldf
+
+
+class LatDataFileTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.bin')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+
+    def test_align8(self):
+        self.assertEqual(ldf.align8(0), 0)
+        self.assertEqual(ldf.align8(1), 8)
+        self.assertEqual(ldf.align8(20), 24)
+        self.assertEqual(ldf.align8(24), 24)
+
+
+    def test_write_and_map(self):
+        lat_data = [[37.7, [37.7, -122.4], 'A Movie (2001)', 'Pier 39', ''],
+                    [37.8, [37.8, -122.5, 37.9, -122.45], 'Café (2012)', 'Market from 6th to 4th',
+                     'A fun fact.'],
+                    [37.85, [37.85, -122.41], 'A Movie (2001)', 'Pier 39', '']]
+        ldf.write_lat_data(lat_data, self.filename)
+        mapped = ldf.MappedLatData(self.filename)
+        self.assertEqual(len(mapped), 3)
+        self.assertEqual(list(mapped), lat_data)
+        self.assertEqual(mapped[1], lat_data[1])
+        self.assertRaises(IndexError, mapped.__getitem__, 3)
+        self.assertRaises(IndexError, mapped.__getitem__, -1)
+
+        # Test the columns:
+        self.assertEqual(mapped.lat1.tolist(), [37.7, 37.8, 37.85])
+        self.assertEqual(mapped.lng2.tolist(), [-122.4, -122.45, -122.41])
+        self.assertEqual(mapped.has_segment.tolist(), [False, True, False])
+
+        # Test that repeated strings are only stored once:
+        self.assertEqual(mapped.key_ids.tolist(), [0, 3, 0])
+        self.assertEqual(len(mapped.string_offsets), 6 + 1)
+
+
+    def test_rewrite_while_mapped(self):
+        # Writing the file again, while it is mapped, replaces the file rather
+        # than truncating it, so the mapping keeps the old rows:
+        lat_data = [[37.7 + i/1000.0, [37.7 + i/1000.0, -122.4], 'A Movie (2001)',
+                     'Location {}'.format(i), ''] for i in range(100)]
+        ldf.write_lat_data(lat_data, self.filename)
+        mapped = ldf.MappedLatData(self.filename)
+        new_lat_data = [[37.6, [37.6, -122.3], 'Another Movie (2010)', 'Pier 39', '']]
+        ldf.write_lat_data(new_lat_data, self.filename)
+        self.assertEqual(list(mapped), lat_data)
+        self.assertEqual(list(ldf.MappedLatData(self.filename)), new_lat_data)
+        # The new file keeps the mode of the old one:
+        os.chmod(self.filename, 0o644)
+        ldf.write_lat_data(new_lat_data, self.filename)
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777, 0o644)
+        # No temporary files are left behind:
+        directory = os.path.dirname(self.filename)
+        self.assertEqual([name for name in os.listdir(directory)
+                          if name.startswith('.' + os.path.basename(self.filename))], [])
+
+        # If writing fails, the old file is kept:
+        def write_and_fail():
+            with ldf.open_for_replace(self.filename) as file:
+                file.write(b'Half of a file')
+                raise IOError('Disk full')
+        self.assertRaises(IOError, write_and_fail)
+        self.assertEqual(list(ldf.MappedLatData(self.filename)), new_lat_data)
+        self.assertEqual([name for name in os.listdir(directory)
+                          if name.startswith('.' + os.path.basename(self.filename))], [])
+
+
+    def test_write_and_map_empty(self):
+        ldf.write_lat_data([], self.filename)
+        mapped = ldf.MappedLatData(self.filename)
+        self.assertEqual(len(mapped), 0)
+        self.assertEqual(list(mapped), [])
+
+
+    def test_shipped_data(self):
+        # Test that the shipped binary file matches the shipped pickle file:
+        with open('data/lat_data.p', 'rb') as file:
+            lat_data = pickle.load(file)
+        self.assertEqual(list(ldf.MappedLatData('data/lat_data.bin')), lat_data)
+
+
+    def test_bad_file(self):
+        with open(self.filename, 'wb') as file:
+            file.write(b'Not a lat_data file at all.')
+        self.assertRaises(ValueError, ldf.MappedLatData, self.filename)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,395 @@
+"""
+File: location_parser.py
+
+Desc: Functions for parsing the location descriptions in the DataSF data,
+which were written for humans, into strings that geocoders can understand.
+
+The regular expressions are compiled once, when the module is loaded, and
+tests which can be done with one expression are combined (eg the text that
+clean_location() drops from the start of a location is one alternation).
+The same raw descriptions are parsed several times while preprocessing
+(to find the locations to geocode, their confidences, and then their
+lat-lngs), so the results of parse_location_base() and
+parse_location_single_rated() are memoized on the raw string.
+
+Large files can be parsed by a pool of worker processes (see
+parse_distinct()), whose results are kept, without a size limit, until
+clear_cache() is called.
+"""
+
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+
+# The maximum number of raw descriptions whose parses are memoized:
+Parse_Cache_Size = 1 << 16
+
+# The number of distinct descriptions given to a worker process at a time:
+Parse_Chunk_Size = 2000
+
+# The memoized parses, mapping raw descriptions to the results of
+# parse_location_base() and parse_location_single_rated():
+Base_Cache = {}
+Rated_Cache = {}
+
+# The parses made by parse_distinct(), mapping raw descriptions in the same
+# way.  These are not limited to Parse_Cache_Size, since the caller is about
+# to look up every one of them, and emptying them part way through would
+# mean parsing the descriptions again in this process:
+Seeded_Base = {}
+Seeded_Rated = {}
+
+# Text which is dropped from the start of a location by clean_location(),
+# in the order that it is dropped:
+Clean_Prefixes = ['and', 'at', 'near', 'off of', 'off', 'Intersection of', 'corner of']
+
+# Clean_Prefix_Res[i] matches any of the prefixes from Clean_Prefixes[i] on,
+# with group j+1 matching Clean_Prefixes[i+j], and the last group matching
+# the text which is kept:
+Clean_Prefix_Res = [re.compile('^(?:' + '|'.join('({})'.format(p) for p in Clean_Prefixes[i:]) +
+                               ') ([\\w .&\']+)', re.IGNORECASE)
+                    for i in range(len(Clean_Prefixes))]
+
+Pier_Re = re.compile('(Piers? [\\d /]+)')
+Street_At_Re = re.compile('-*([\\d]+) ([\\da-zA-Z\\ .\']+) at')
+Street_Re = re.compile('-*([\\d]+) ([\\da-zA-Z\\ .\']+)')
+
+Intersection_Res = [re.compile('([\\da-zA-Z\\ .\']+ & [\\da-zA-Z\\ .\']+)'),
+                    re.compile('([\\da-zA-Z\\ .\']+ at [\\da-zA-Z\\ .\']+)'),
+                    re.compile('([\\da-zA-Z\\ .\']+ and [\\da-zA-Z\\ .\']+)')]
+
+Parens_Re = re.compile('(.+)\\((.+)\\)')
+
+# Every range described in parse_location_range() contains one of these
+# words, so descriptions without them are not tried against each pattern:
+Range_Word_Re = re.compile(' (?:between|from|at) ', re.IGNORECASE)
+Range_Res = [re.compile('([\\da-zA-Z\\ .\']+)' + middle + '([\\da-zA-Z\\ .\']+)' + sep +
+                        '([\\da-zA-Z\\ .\']+)', re.IGNORECASE)
+             for middle, sep in [(',? between ', ' and '), (',? between ', ' & '),
+                                 (' from ', ' and '), (' from ', ' & '), (' from ', ' to '),
+                                 (' at ', ' and '), (' at ', ' & ')]]
+
+
+
+def clean_location(loc):
+    """
+    Input: a location description string that has been parsed.
+    Output: this same string cleaned up in a couple of ways:
+     - whitespace is trimmed
+     - '&' is replaced by 'and'
+     - text such as, 'near', "off of', is dropped
+    """
+    if not loc:
+        return loc
+    #
+    loc = loc.strip()
+    # Each prefix is dropped at most once, in the order of Clean_Prefixes,
+    # so after dropping one only the prefixes after it are looked for:
+    start = 0
+    while start < len(Clean_Prefixes):
+        res = Clean_Prefix_Res[start].match(loc)
+        if not res:
+            break
+        groups = res.groups()
+        loc = groups[-1]
+        start += 1 + next(i for i, g in enumerate(groups[:-1]) if g is not None)
+    #
+    loc = loc.replace('&', 'and')
+    return loc
+
+
+
+def parse_simple_street(loc):
+    """
+    Input: A string containing a description of a location, eg '123 Pine St',
+           after some preprocessing has been done to split out text enclosed
+           in parentheses.
+    Output:
+      o The substring 'Pier[s]', followed by a number, if it is in the input string.
+      o The substring consisting of a number followed by text but not containing commas
+        (eg, '123 Central St') if it is in the input string.  Also, if the number is
+        hyphenated (100-201 Broadway), then the first part of the number and hyphen
+        are not included.
+      o Otherwise returns None.
+    """
+    # Handle Piers first:
+    res = Pier_Re.search(loc)
+    if res:
+        return clean_location(res.group(0))
+    # Next, search for '124 X St at Y St', we only want '124 X St':
+    res = Street_At_Re.search(loc)
+    if not res:
+        # Next, search for '124 X St':
+        res = Street_Re.search(loc)
+    if res:
+        addr = res.group(1) + ' ' + res.group(2).strip()
+        return clean_location(addr)
+    #
+    return None
+
+
+
+def parse_intersection(loc):
+    """
+    Input: A string containing a description of a location, eg '123 Pine St'.
+           This is after some preprocessing has been done to split out
+           text enclosed in parentheses.
+    Output:
+      o If this string specifies an intersection of two streets, then
+        return the substring that best specifies this.
+        eg "Pine [at|&] Kearny" is an intersection.
+      o returns None if no intersection is in the string description.
+    Note: this does not handle descriptions which specify a range,
+          such as "X from Y and Z"
+    """
+    for pattern in Intersection_Res:
+        res = pattern.search(loc)
+        if res:
+            return clean_location(res.group(0))
+    return None  # No success.
+
+
+
+def parse_location(loc):
+    """
+    Input: A string containing a description of a location, eg '123 Pine St'.
+           This is after some preprocessing has been done to split out
+           text enclosed in parentheses.
+    Output: A pair consisting of: 1. a parsed location; 2. a rating on how
+            much information/accuracy is in this parsed location.
+    """
+    res = parse_simple_street(loc)
+    if res:
+        return (res, 1)
+    res = parse_intersection(loc)
+    if res:
+        return (res, 2)
+    # Assume something like landmark name or neighborhood so use entire
+    # description, but assign a low accuracy/confidence score:
+    return (loc, 100)
+
+
+
+def split_on_parens(loc):
+    """
+    Input: A location description string.
+    Output: It searches the string for a substring in which there is some
+            text followed by more text in parentheses, eg 'aba daba (daba doo)'.
+            and returns ['aba daba', 'daba doo'] in these cases.
+            Otherwise it returns the entire string in a list: 'aba daba' => ['aba daba']
+    Assumes that there is at most one set of ()s.
+    """
+    if not '(' in loc:
+        return [loc]
+    res = Parens_Re.search(loc)
+    if not res:
+        # This location does not contain ()s, return None
+        return [loc]
+    #
+    return [res.group(1).strip(), res.group(2).strip()]
+
+
+
+def parse_location_single(loc):
+    """
+    This function parses a description string to identify a single-point
+    location, as opposed to a location specified by two points.
+    Input: A location description string.
+    Ouput: A parsed string that best specifies the location.
+    """
+    if loc == '':
+        return ''
+    return parse_location_single_rated(loc)[0]
+
+
+
+def remember(cache, loc, res):
+    """
+    Desc: Adds a parse to one of the memoized caches, emptying the cache first
+          if it is full.
+    """
+    if len(cache) >= Parse_Cache_Size:
+        cache.clear()
+    cache[loc] = res
+
+
+
+def parse_location_single_rated(loc):
+    """
+    Input: A location description string, which is not empty.
+    Ouput: A pair consisting of: 1. the parsed string that best specifies the
+           location; 2. the rating of that parse (see parse_location()).
+    """
+    res = Seeded_Rated.get(loc)
+    if res is None:
+        res = Rated_Cache.get(loc)
+    if res is None:
+        res = parse_location_single_rated_uncached(loc)
+        remember(Rated_Cache, loc, res)
+    return res
+
+
+
+def parse_location_single_rated_uncached(loc):
+    """
+    Desc: parse_location_single_rated(), without the memoization.
+    """
+    addresses = []
+    locs = split_on_parens(loc)
+    for l in locs:
+        res = parse_location(l)
+        if res:
+            addresses.append(res)
+    return min(addresses, key = lambda t: t[1])
+
+
+
+def parse_location_range(loc):
+    """
+    This function looks for and parses descriptions which specify a range.
+    Examples of location ranges which are looked for:
+      o X between Y and Z
+      o X, between Y and Z
+      o .*[,]X between Y and Z
+      o X from Y and Z
+      o X from Y & Z
+      o X from Y to Z
+    Input: A location description string.
+    Output:
+      o A pair or two location strings, if this is in the input,
+          eg: ('X and Y', 'X and Z').
+      o None, if a location range is not described.
+    Note that in the SF-movie-locations dataset the X, Y and Z values tend to be
+    very simple and need no further processing.
+    """
+    if not Range_Word_Re.search(loc):
+        return None
+    res = None
+    for pattern in Range_Res:
+        res = pattern.search(loc)
+        if res:
+            break
+    #
+    if not res:
+        return None
+    #
+    loc1 = clean_location(res.group(1))
+    loc2 = clean_location(res.group(2))
+    loc3 = clean_location(res.group(3))
+    #
+    return ('{} and {}'.format(loc1, loc2),
+            '{} and {}'.format(loc1, loc3))
+
+
+
+def parse_location_base(loc):
+    """
+    Desc: Takes a raw location descriptions and returns a parsed location.
+    Input: A raw location description, as read from the data source.
+    Output: A parsed locations suitable for sending to a geocoder.
+            This may be a single parsed-location (indicating a specific
+            location), or a pair of parsed-locations (indicating a range).
+    """
+    res = Seeded_Base.get(loc)
+    if res is None:
+        res = Base_Cache.get(loc)
+    if res is None:
+        res = parse_location_base_uncached(loc)
+        remember(Base_Cache, loc, res)
+    return res
+
+
+
+def parse_location_base_uncached(loc):
+    """
+    Desc: parse_location_base(), without the memoization.
+    """
+    # First test that loc contains text:
+    if loc == '':
+        return ''  # If no location text => return an empty string.
+    # Next, check if loc parses to a street range:
+    res = parse_location_range(loc)
+    if res:
+        return res
+    # Default case, parse loc as a specific/single spot:
+    return parse_location_single(loc)
+
+
+
+def parse_locations(locations, workers=1):
+    """
+    Desc: Takes a list of raw location descriptions and returns a list
+          of parsed locations.
+    Input: A list of location descriptions, as read from the data source;
+           and the number of worker processes to parse them with.
+    Output: A list of parsed locations suitable for sending to a geocoder.
+            Each item may be a single parsed-location (indicating a specific
+            location), or a pair of parsed-locations (indicating a range).
+    """
+    if workers > 1:
+        parse_distinct(locations, workers)
+    return [parse_location_base(loc) for loc in locations]
+
+
+
+def parse_chunk(locations):
+    """
+    Desc: Parses a chunk of distinct location descriptions, in a worker process.
+    Input: A list of raw location descriptions.
+    Output: A list of (description, parse_location_base() result,
+            parse_location_single_rated() result) for each of them, where the
+            last is None for ranges and empty descriptions.
+    """
+    results = []
+    for loc in locations:
+        base = parse_location_base(loc)
+        rated = None
+        if (loc != '') and (type(base) != tuple):
+            rated = parse_location_single_rated(loc)
+        results.append((loc, base, rated))
+    return results
+
+
+
+def parse_distinct(locations, workers=1, chunk_size=None):
+    """
+    Desc: Parses the distinct descriptions in a list, splitting them into chunks
+          which are parsed by a pool of worker processes.  The parses are kept
+          in Seeded_Base and Seeded_Rated, which have no size limit, so that
+          later calls to parse_location_base() and parse_location_single_rated()
+          for these descriptions do no parsing, however many there are.
+    Input: A list of raw location descriptions; the number of worker processes;
+           and the number of descriptions in each chunk (default: Parse_Chunk_Size).
+    Output: A dictionary mapping each distinct description to its parse_location_base().
+    Note: The chunks are made from the sorted descriptions, and their results are
+          merged in that order, so the output does not depend on the number of workers.
+    """
+    if chunk_size is None:
+        chunk_size = Parse_Chunk_Size
+    distinct = sorted(set(locations))
+    chunks = [distinct[i:i+chunk_size] for i in range(0, len(distinct), chunk_size)]
+    if (workers > 1) and (len(chunks) > 1):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parse_chunk, chunks))
+    else:
+        results = [parse_chunk(chunk) for chunk in chunks]
+    #
+    parses = {}
+    for chunk_results in results:
+        for loc, base, rated in chunk_results:
+            parses[loc] = base
+            Seeded_Base[loc] = base
+            if rated is not None:
+                Seeded_Rated[loc] = rated
+    return parses
+
+
+
+def clear_cache():
+    """
+    Desc: Empties the memoized parses, eg before timing the parser.
+    """
+    Base_Cache.clear()
+    Rated_Cache.clear()
+    Seeded_Base.clear()
+    Seeded_Rated.clear()
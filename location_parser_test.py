@@ -0,0 +1,122 @@
+"""
+File: location_parser_test.py
+Desc: Unit tests for location_parser.py
+"""
+
+import unittest
+import location_parser as lp
+import parser_benchmark
+import preprocess_data
+
+
+class LocationParserTest(unittest.TestCase):
+    def test_clean_location_prefixes(self):
+        # Prefixes are dropped in the order of Clean_Prefixes, each at most once:
+        test_pairs = [('near Pier 39', 'Pier 39'),
+                      ('at near Pier 39', 'Pier 39'),
+                      ('near at Pier 39', 'at Pier 39'),
+                      ('off of off Main St', 'Main St'),
+                      ('off of off of Main St', 'of Main St'),
+                      ('off off of Main St', 'off of Main St'),
+                      ('off of', 'of'),
+                      ('Corner of Van Ness & Mission', 'Van Ness and Mission'),
+                      ('corner of Intersection of A & B', 'Intersection of A and B'),
+                      ('and near Main St, SF', 'Main St'),
+                      ('Nearby Cafe', 'Nearby Cafe'),
+                      ('', '')]
+        for input, output in test_pairs:
+            self.assertEqual(lp.clean_location(input), output)
+            self.assertEqual(lp.clean_location(input),
+                             parser_benchmark.legacy_clean_location(input))
+
+
+    def test_parse_location_range_words(self):
+        # Ranges need ' between ', ' from ' or ' at ', in any case:
+        self.assertEqual(lp.parse_location_range('Market St FROM 1st to 2nd'),
+                         ('Market St and 1st', 'Market St and 2nd'))
+        self.assertEqual(lp.parse_location_range('Market St, between 1st & 2nd'),
+                         ('Market St and 1st', 'Market St and 2nd'))
+        self.assertEqual(lp.parse_location_range('Market St and 1st'), None)
+        self.assertEqual(lp.parse_location_range('Fromage Shop and 1st'), None)
+
+
+    def test_same_as_legacy_parser(self):
+        # The parser gives the same output as the one it replaced, for every
+        # location description in the data:
+        descs = [row[2] for row in preprocess_data.load_csv(preprocess_data.Raw_Movie_Data)]
+        descs += ['near at Pier 39 (off of Embarcadero)', 'Market St. FROM 1st To 2nd',
+                  '100-201 Broadway at Front', 'Piers 1 1/2 at off Embarcadero']
+        lp.clear_cache()
+        for desc in descs:
+            self.assertEqual(lp.parse_location_base(desc),
+                             parser_benchmark.legacy_parse_location_base(desc))
+            if desc != '':
+                self.assertEqual(lp.parse_location_single_rated(desc),
+                                 parser_benchmark.legacy_parse_location_single_rated(desc))
+
+
+    def test_memoized(self):
+        lp.clear_cache()
+        self.assertEqual(lp.parse_location_base('Pier 39'), 'Pier 39')
+        self.assertEqual(lp.Base_Cache, {'Pier 39':'Pier 39'})
+        lp.Base_Cache['Pier 39'] = 'memoized'
+        self.assertEqual(lp.parse_location_base('Pier 39'), 'memoized')
+        lp.clear_cache()
+        self.assertEqual(lp.parse_location_base('Pier 39'), 'Pier 39')
+
+
+    def test_parse_distinct(self):
+        descs = [row[2] for row in preprocess_data.load_csv(preprocess_data.Raw_Movie_Data)]
+        lp.clear_cache()
+        serial = lp.parse_locations(descs)
+        rated = dict((d, lp.parse_location_single_rated(d)) for d in descs
+                     if (d != '') and (type(lp.parse_location_base(d)) != tuple))
+        # In worker processes, with several chunks:
+        lp.clear_cache()
+        parses = lp.parse_distinct(descs + descs[:10], workers=2, chunk_size=100)
+        self.assertEqual(sorted(parses.keys()), sorted(set(descs)))
+        self.assertEqual([parses[d] for d in descs], serial)
+        # The parses from the workers are kept in this process:
+        self.assertEqual(lp.Seeded_Base, parses)
+        self.assertEqual(lp.Seeded_Rated, rated)
+        lp.clear_cache()
+        self.assertEqual(lp.parse_locations(descs, workers=2), serial)
+
+
+    def test_parse_distinct_over_cache_size(self):
+        # With more distinct descriptions than the memoized parses can hold,
+        # every parse from the workers is still used, without parsing again:
+        descs = ['{} Market St'.format(i) for i in range(300)]
+        descs += ['Market St between {} and {}'.format(i, i+1) for i in range(100)]
+        cache_size = lp.Parse_Cache_Size
+        base_uncached = lp.parse_location_base_uncached
+        rated_uncached = lp.parse_location_single_rated_uncached
+        try:
+            lp.Parse_Cache_Size = 50
+            lp.clear_cache()
+            parses = lp.parse_distinct(descs, workers=2, chunk_size=64)
+            def no_parsing(loc):
+                raise AssertionError('parsed again: {}'.format(loc))
+            lp.parse_location_base_uncached = no_parsing
+            lp.parse_location_single_rated_uncached = no_parsing
+            self.assertEqual([lp.parse_location_base(d) for d in descs],
+                             [parses[d] for d in descs])
+            self.assertEqual(lp.parse_location_single_rated(descs[0]), ('0 Market St', 1))
+            self.assertEqual(lp.parse_locations(descs), [parses[d] for d in descs])
+        finally:
+            lp.Parse_Cache_Size = cache_size
+            lp.parse_location_base_uncached = base_uncached
+            lp.parse_location_single_rated_uncached = rated_uncached
+            lp.clear_cache()
+        self.assertEqual(lp.Seeded_Base, {})
+
+
+    def test_benchmark(self):
+        res = parser_benchmark.run('data/test_data.csv', repeats=1)
+        self.assertEqual(res['descriptions'], 5)
+        self.assertTrue(res['identical'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,19 +7,1004 @@ the DataSF website:
 
 This data has been downloaded and preprocessed (see ./preprocessed)
 and is pickled and stored into different data files in ./static.
+These files are loaded once per process, by a MovieStore, and then
+kept in memory to answer all lookups.
 """
 
-import bisect
+import hashlib
+import heapq
+import os
 import pickle
-from math import degrees, radians, cos, sin, asin, sqrt
+import threading
+from collections import OrderedDict
+from math import degrees, radians, cos, sin, asin, sqrt, pi, ceil
+import numpy as np
+from geo_index import GridIndex
+from lat_data_file import MappedLatData
+from search_index import InvertedIndex, PrefixIndex
 
 
 Movie_Data_Filename = 'data/movie_data.p'
 Loc_Data_Filename = 'data/loc_data.p'
 Lat_Data_Filename = 'data/lat_data.p'
+Search_Index_Filename = 'data/search_index.p'  # Built when loading the data, if it does not exist.
+Marker_Groups_Filename = 'data/marker_groups.p'  # Built when loading the data, if it does not exist.
 
 Earth_Radius_Ft = 20925524.9  # Radius of the Earth in feet.
 
+Grid_Cell_Ft = 1000.0  # Size of the cells in the spatial index of lat_data.
+
+# Radius queries compare most distances with vectorized math, which can differ
+# from calc_great_circle_dist() and calc_segment_dist() in the last few bits.
+# Locations within this distance (in feet) of the edge of the circle are
+# checked with those functions instead, so they are kept exactly as by them:
+Boundary_Ft = 0.001
+
+# The relative slack in LatColumns.distance_bounds(), which covers the
+# difference between chords and arcs, and between the flat map on which the
+# closest point of a line segment is found and the sphere:
+Bound_Slack = 1e-3
+
+# Settings for the cache of radius queries.  Queries are snapped to a grid
+# of Radius_Cache_Grid_Ft, and radii rounded up to Radius_Cache_Step_Ft, so
+# that nearby queries share the same cached candidates, which are then
+# checked against the exact query:
+Radius_Cache_Enabled = True
+Radius_Cache_Size = 1024  # Maximum number of cached results.
+Radius_Cache_Grid_Ft = 10.0
+Radius_Cache_Step_Ft = 50.0
+
+# Locations whose coordinates are within this distance (in feet) of the first
+# location of a group are put into that group by MarkerGroups, so that they can
+# be shown as one map marker.  0 only groups identical coordinates:
+Group_Tolerance_Ft = 10.0
+
+# The name facets of LatFacets, and the fields of movie_data they come from:
+Facet_Fields = [('director', ['director']), ('actor', ['actor1', 'actor2', 'actor3']),
+                ('prod_co', ['prod_co'])]
+
+# The maximum number of names listed in each facet of LatFacets.counts():
+Max_Facet_Names = 20
+
+
+
+class LatColumns(object):
+    """
+    Desc: A columnar copy of the coordinates in lat_data, stored in arrays
+    so that distances to many locations can be computed in one call.
+    For the i-th entry of lat_data:
+    o lat1[i], lng1[i]: the point, or the first end-point of a line segment.
+    o lat2[i], lng2[i]: the second end-point of a line segment; for a point
+      these are the same as lat1[i], lng1[i].
+    o has_segment[i]: True if the entry is a line segment.
+    o min_lat[i], max_lat[i], min_lng[i], max_lng[i]: the bounding box of
+      the point or line segment.
+    o x[i], y[i], z[i]: the point (or first end-point) as a vector on the
+      unit sphere, so that radius checks need no trigonometry per row.
+    o x2[i], y2[i], z2[i]: the second end-point as a vector on the unit sphere.
+    o seg_ft[i]: the length of the line segment in feet (0 for a point).
+    """
+    def __init__(self, lat_data):
+        if isinstance(lat_data, MappedLatData):
+            # The file already stores lat_data in columns:
+            self.lat1, self.lng1 = lat_data.lat1, lat_data.lng1
+            self.lat2, self.lng2 = lat_data.lat2, lat_data.lng2
+            self.has_segment = lat_data.has_segment
+            self.set_bounding_boxes()
+            return
+        n = len(lat_data)
+        self.lat1 = np.empty(n)
+        self.lng1 = np.empty(n)
+        self.lat2 = np.empty(n)
+        self.lng2 = np.empty(n)
+        self.has_segment = np.zeros(n, dtype=bool)
+        for i, loc in enumerate(lat_data):
+            latlngs = loc[1]
+            self.lat1[i], self.lng1[i] = latlngs[0], latlngs[1]
+            if len(latlngs) == 4:
+                self.lat2[i], self.lng2[i] = latlngs[2], latlngs[3]
+                self.has_segment[i] = True
+            else:
+                self.lat2[i], self.lng2[i] = latlngs[0], latlngs[1]
+        self.set_bounding_boxes()
+
+
+    def set_bounding_boxes(self):
+        """
+        Desc: Computes the bounding box of each point and line segment,
+              the unit vectors of their end-points and their lengths.
+        """
+        self.min_lat = np.minimum(self.lat1, self.lat2)
+        self.max_lat = np.maximum(self.lat1, self.lat2)
+        self.min_lng = np.minimum(self.lng1, self.lng2)
+        self.max_lng = np.maximum(self.lng1, self.lng2)
+        self.x, self.y, self.z = unit_vectors(self.lat1, self.lng1)
+        self.x2, self.y2, self.z2 = unit_vectors(self.lat2, self.lng2)
+        dx, dy, dz = self.x2 - self.x, self.y2 - self.y, self.z2 - self.z
+        chord = np.minimum(np.sqrt(dx*dx + dy*dy + dz*dz), 2.0)
+        self.seg_ft = np.where(self.has_segment, 2 * Earth_Radius_Ft * np.arcsin(chord / 2), 0.0)
+
+
+    def distance_bounds(self, vector, indexes, chord_sq=None):
+        """
+        Input: the unit vector of a location (see unit_vectors()), an array of
+               indexes into the columns, and optionally the squared chords from
+               the location to their first end-points (see filter_by_radius()).
+        Output: a pair of arrays of the lower and upper bounds on the distance,
+                in feet, from the location to each of these points or line
+                segments (as given by calc_segment_dist()).
+        Desc: The bounds come from the chords to the end-points, so they need
+              no trigonometry per row: every point of a line segment is within
+              half of its length of an end-point, and the closest end-point is
+              no closer than the closest point.  A chord is a little shorter
+              than its arc, so there is no upper bound for far away rows.
+        """
+        x, y, z = vector
+        if chord_sq is None:
+            dx, dy, dz = self.x[indexes] - x, self.y[indexes] - y, self.z[indexes] - z
+            chord_sq = dx*dx + dy*dy + dz*dz
+        dx, dy, dz = self.x2[indexes] - x, self.y2[indexes] - y, self.z2[indexes] - z
+        chord_sq = np.minimum(chord_sq, dx*dx + dy*dy + dz*dz)
+        end_ft = Earth_Radius_Ft * np.sqrt(chord_sq)
+        seg_ft = self.seg_ft[indexes]
+        slack = Bound_Slack * (end_ft + seg_ft) + Boundary_Ft
+        lower = end_ft - seg_ft/2 - slack
+        upper = np.where(chord_sq < 0.01, end_ft + slack, np.inf)
+        return lower, upper
+
+
+    def filter_by_radius(self, lat, lng, radius, indexes):
+        """
+        Input:
+        o lat, lng, radius: the center and radius (in feet) of a search circle.
+        o indexes: an array of candidate indexes into the columns.
+        Output: the array of those indexes for which the point, or some part
+                of the line segment, is within the radius.
+        """
+        # First drop the candidates whose bounding box is outside of the
+        # bounding box of the circle (with a margin, for locations on its edge):
+        min_lat, max_lat = find_lat_range_ft(lat, radius + Boundary_Ft)
+        min_lng, max_lng = find_lng_range_ft(lat, lng, radius + Boundary_Ft)
+        in_box = ((self.max_lat[indexes] >= min_lat) & (self.min_lat[indexes] <= max_lat) &
+                  (self.max_lng[indexes] >= min_lng) & (self.min_lng[indexes] <= max_lng))
+        indexes = indexes[in_box]
+        segments = self.has_segment[indexes]
+        x, y, z = unit_vectors(lat, lng)
+        dx, dy, dz = self.x[indexes] - x, self.y[indexes] - y, self.z[indexes] - z
+        chord_sq = dx*dx + dy*dy + dz*dz
+        #
+        # A point is within the radius if the chord between it and the center,
+        # through the sphere, is shorter than the chord of the radius:
+        keep = chord_sq < calc_chord_sq(max(radius - Boundary_Ft, 0.0))
+        edge = (~keep) & (~segments) & (chord_sq <= calc_chord_sq(radius + Boundary_Ft))
+        for n in np.nonzero(edge)[0].tolist():
+            i = indexes[n]
+            keep[n] = calc_great_circle_dist(lat, lng, self.lat1[i], self.lng1[i]) <= radius
+        if not segments.any():
+            return indexes[keep]
+        #
+        # Line segments are checked by the distance to their closest point,
+        # which is only computed for those which the bounds of the distance
+        # do not decide:
+        lines = indexes[segments]
+        lower, upper = self.distance_bounds((x, y, z), lines, chord_sq[segments])
+        line_keep = upper < radius
+        near = np.nonzero((~line_keep) & (lower <= radius))[0]
+        if len(near) > 0:
+            near_lines = lines[near]
+            dists = calc_segment_dists(lat, lng, self.lat1[near_lines], self.lng1[near_lines],
+                                       self.lat2[near_lines], self.lng2[near_lines])
+            line_keep[near] = dists < radius - Boundary_Ft
+            edge = abs(dists - radius) <= Boundary_Ft
+            for n, i in zip(near[edge].tolist(), near_lines[edge].tolist()):
+                line_keep[n] = calc_segment_dist(lat, lng, self.lat1[i], self.lng1[i],
+                                                 self.lat2[i], self.lng2[i]) <= radius
+        keep[segments] = line_keep
+        return indexes[keep]
+
+
+    def filter_by_bbox(self, min_lat, max_lat, min_lng, max_lng, indexes):
+        """
+        Input:
+        o min_lat, max_lat, min_lng, max_lng: the corners of a lat-lng box.
+        o indexes: an array of candidate indexes into the columns.
+        Output: the array of those indexes for which the point, or some part
+                of the line segment, is inside the box.
+        """
+        in_box = ((self.max_lat[indexes] >= min_lat) & (self.min_lat[indexes] <= max_lat) &
+                  (self.max_lng[indexes] >= min_lng) & (self.min_lng[indexes] <= max_lng))
+        indexes = indexes[in_box]
+        #
+        # Clip each line segment, lat1 + t*(lat2-lat1) for t in [0, 1], to the
+        # sides of the box (Liang-Barsky); it is in the box if some t is left.
+        # A point has no direction, and its bounding box is already in the box.
+        x1, y1 = self.lng1[indexes], self.lat1[indexes]
+        dx, dy = self.lng2[indexes] - x1, self.lat2[indexes] - y1
+        t0 = np.zeros(len(indexes))
+        t1 = np.ones(len(indexes))
+        for p, q in [(-dx, x1 - min_lng), (dx, max_lng - x1),
+                     (-dy, y1 - min_lat), (dy, max_lat - y1)]:
+            ratio = q / np.where(p != 0, p, 1.0)
+            t0 = np.where(p < 0, np.maximum(t0, ratio), t0)
+            t1 = np.where(p > 0, np.minimum(t1, ratio), t1)
+        return indexes[t0 <= t1]
+
+
+    def cluster(self, indexes, cell_size):
+        """
+        Input: an array of indexes into the columns, and the size of the
+               clusters' grid cells, in degrees.
+        Output: a list of clusters, one for each grid cell containing some of
+                these entries, as dictionaries of:
+          o 'lat', 'lng': the mean position of the entries in the cluster,
+            where a line segment is at its middle.
+          o 'count': the number of entries in the cluster.
+          o 'index': the lowest index in the cluster, eg to show a
+            cluster with one entry as a marker.
+        The clusters are in the order of their grid cells.
+        """
+        if not cell_size > 0:
+            raise ValueError('The cell size must be positive: {}'.format(cell_size))
+        indexes = np.asarray(indexes, dtype=int)
+        if len(indexes) == 0:
+            return []
+        lats = (self.lat1[indexes] + self.lat2[indexes]) / 2
+        lngs = (self.lng1[indexes] + self.lng2[indexes]) / 2
+        rows = np.floor(lats / cell_size).astype(np.int64)
+        cols = np.floor(lngs / cell_size).astype(np.int64)
+        # Number the cells in row order, then find the distinct cells:
+        cells = (rows - rows.min()) * (cols.max() - cols.min() + 1) + (cols - cols.min())
+        cells, cluster_ids = np.unique(cells, return_inverse=True)
+        counts = np.bincount(cluster_ids)
+        sum_lats = np.bincount(cluster_ids, weights=lats)
+        sum_lngs = np.bincount(cluster_ids, weights=lngs)
+        first = np.full(len(cells), np.iinfo(np.int64).max)
+        np.minimum.at(first, cluster_ids, indexes)
+        return [{'lat':float(sum_lats[c] / counts[c]), 'lng':float(sum_lngs[c] / counts[c]),
+                 'count':int(counts[c]), 'index':int(first[c])} for c in range(len(cells))]
+
+
+
+def normalize_name(name):
+    """
+    Output: the name with its whitespace collapsed to single spaces, and
+            stripped from its ends.
+    """
+    return ' '.join(name.split())
+
+
+
+class LatFacets(object):
+    """
+    Desc: The movie information of each entry of lat_data, stored as compact
+    arrays so that the results of a location query can be filtered on it, and
+    counted, without looking up each movie.
+    o year[i]: the year of the movie, as an int16 (0 if it is not known).
+    o director[i], prod_co[i]: the id of the movie's director, and of its
+      production company, as an int32 (-1 if there is none).
+    o actor[i]: a row of the ids of the movie's three actors.
+    The ids are positions in the sorted lists of distinct names, names[facet].
+    Names have their whitespace collapsed (see normalize_name()), both here
+    and in the filters, so 'Chris  Columbus' is the same as 'Chris Columbus'.
+    """
+    def __init__(self, movie_data, lat_data):
+        keys = sorted(movie_data.keys())
+        key_ids = dict((key, i) for i, key in enumerate(keys))
+        # Each row's movie, where rows with an unknown movie key use an extra
+        # movie, at the end, which has no information:
+        missing = len(keys)
+        movie_ids = np.array([key_ids.get(lat_data[i][2], missing)
+                              for i in range(len(lat_data))], dtype=np.int32)
+        #
+        movie_years = np.zeros(len(keys)+1, dtype=np.int16)
+        for i, key in enumerate(keys):
+            year = movie_data[key].get('year', '')
+            if year.isdigit():
+                movie_years[i] = int(year)
+        self.year = movie_years[movie_ids]
+        #
+        self.names = {}
+        self.name_ids = {}  # Maps field => {lower-cased name: id}.
+        for facet, fields in Facet_Fields:
+            names = sorted(set(normalize_name(movie_data[key].get(field, ''))
+                               for key in keys for field in fields) - set(['']))
+            self.names[facet] = names
+            self.name_ids[facet] = dict((name.lower(), i) for i, name in enumerate(names))
+            ids = np.full((len(keys)+1, len(fields)), -1, dtype=np.int32)
+            for i, key in enumerate(keys):
+                for j, field in enumerate(fields):
+                    name = normalize_name(movie_data[key].get(field, ''))
+                    if name:
+                        ids[i, j] = self.name_ids[facet][name.lower()]
+            ids = ids[movie_ids]
+            setattr(self, facet, ids if len(fields) > 1 else ids[:, 0])
+
+
+    def filter(self, indexes, filters):
+        """
+        Input:
+        o indexes: an array of indexes into lat_data.
+        o filters: a dictionary with any of the keys:
+          - 'min_year', 'max_year': the range of years of the movies to keep.
+          - 'director', 'actor', 'prod_co': the name that the movie's director,
+            one of its actors, or its production company must have.  Names are
+            matched in any case.
+        Output: the array of those indexes whose movies pass all of the filters.
+        """
+        indexes = np.asarray(indexes, dtype=int)
+        keep = np.ones(len(indexes), dtype=bool)
+        if filters.get('min_year') is not None:
+            keep &= (self.year[indexes] >= filters['min_year'])
+        if filters.get('max_year') is not None:
+            keep &= (self.year[indexes] <= filters['max_year'])
+        for facet, fields in Facet_Fields:
+            name = filters.get(facet)
+            if not name:
+                continue
+            name_id = self.name_ids[facet].get(normalize_name(name).lower(), -2)
+            ids = getattr(self, facet)[indexes]
+            if len(fields) > 1:
+                keep &= (ids == name_id).any(axis=1)
+            else:
+                keep &= (ids == name_id)
+        return indexes[keep]
+
+
+    def counts(self, indexes, max_names=Max_Facet_Names):
+        """
+        Input: an array of indexes into lat_data, and the maximum number of
+               names to list for each facet.
+        Output: a dictionary of the number of these locations with each value:
+          o 'year': a list of [year, count], in order of year.
+          o 'director', 'actor', 'prod_co': a list of [name, count] for up to
+            max_names of the most common names, most common first.
+        """
+        indexes = np.asarray(indexes, dtype=int)
+        years = self.year[indexes]
+        years = years[years > 0].astype(int)
+        facets = {'year': []}
+        if len(years) > 0:
+            first = years.min()
+            year_counts = np.bincount(years - first)
+            facets['year'] = [[int(first + y), int(c)] for y, c in enumerate(year_counts) if c > 0]
+        for facet, fields in Facet_Fields:
+            ids = getattr(self, facet)[indexes]
+            if len(fields) > 1:
+                # A location counts once for each of its movie's distinct actors:
+                ids = ids.copy()
+                for j in range(1, len(fields)):
+                    ids[(ids[:, j:j+1] == ids[:, :j]).any(axis=1), j] = -1
+            ids = ids.ravel()
+            name_counts = np.bincount(ids[ids >= 0], minlength=len(self.names[facet]))
+            # Most common first, then in alphabetical order:
+            order = np.lexsort((np.arange(len(name_counts)), -name_counts))
+            facets[facet] = [[self.names[facet][i], int(name_counts[i])]
+                             for i in order[:max_names] if name_counts[i] > 0]
+        return facets
+
+
+
+class MarkerGroups(object):
+    """
+    Desc: The groups of co-located movie locations in lat_data, eg the many
+    films shot at Union Square, which the map would show as a stack of markers.
+    Each group starts with a location (its leader), and a later location joins
+    the first group whose leader is within tolerance_ft of it: both are points,
+    or both are line segments with each end-point within tolerance_ft.
+    The group table is stored as arrays:
+    o row_groups[i]: the group of the i-th entry of lat_data.
+    o leaders[g]: the index into lat_data of the first entry of group g.
+    o rows[starts[g]:starts[g+1]]: the indexes of the entries in group g, in order.
+    The groups are made while preprocessing the data, and saved with pickle.
+    """
+    def __init__(self, columns, tolerance_ft=Group_Tolerance_Ft):
+        """
+        Input: the LatColumns of lat_data, and the distance in feet within
+               which locations are grouped.
+        """
+        self.tolerance_ft = tolerance_ft
+        self.num_rows = len(columns.lat1)
+        self.coords_hash = hash_columns(columns)
+        n = self.num_rows
+        row_groups = np.zeros(n, dtype=np.int32)
+        leaders = []
+        if tolerance_ft <= 0:
+            # Only group identical coordinates:
+            group_ids = {}
+            for i in range(n):
+                coords = (columns.lat1[i], columns.lng1[i], columns.lat2[i], columns.lng2[i],
+                          columns.has_segment[i])
+                if not coords in group_ids:
+                    group_ids[coords] = len(leaders)
+                    leaders.append(i)
+                row_groups[i] = group_ids[coords]
+        else:
+            # The leaders are kept in a grid, so only the leaders near each
+            # location need to be checked:
+            lat_range = degrees(tolerance_ft / Earth_Radius_Ft)
+            grid = GridIndex(lat_range)
+            for i in range(n):
+                lat, lng = columns.lat1[i], columns.lng1[i]
+                lng_range = lat_range / max(cos(radians(lat)), 1e-6)
+                group = None
+                for g in grid.query(lat - lat_range, lat + lat_range,
+                                    lng - lng_range, lng + lng_range):
+                    j = leaders[g]
+                    if (columns.has_segment[j] == columns.has_segment[i]) and \
+                       (calc_great_circle_dist(lat, lng, columns.lat1[j], columns.lng1[j])
+                        <= tolerance_ft) and \
+                       (calc_great_circle_dist(columns.lat2[i], columns.lng2[i],
+                                               columns.lat2[j], columns.lng2[j])
+                        <= tolerance_ft):
+                        group = g
+                        break
+                if group is None:
+                    group = len(leaders)
+                    leaders.append(i)
+                    grid.insert(group, [lat, lng])
+                row_groups[i] = group
+        #
+        self.row_groups = row_groups
+        self.leaders = np.array(leaders, dtype=np.int32)
+        self.rows = np.argsort(row_groups, kind='mergesort').astype(np.int32)
+        self.starts = np.searchsorted(row_groups[self.rows],
+                                      np.arange(len(leaders)+1)).astype(np.int32)
+
+
+    def matches(self, columns):
+        """
+        Output: whether these groups were made from the coordinates in columns.
+        """
+        return (self.num_rows == len(columns.lat1)) and \
+               (self.coords_hash == hash_columns(columns))
+
+
+    def members(self, group):
+        """
+        Output: the array of the indexes into lat_data of the entries in a group.
+        """
+        return self.rows[self.starts[group]:self.starts[group+1]]
+
+
+    def group(self, indexes):
+        """
+        Input: a list of indexes into lat_data, eg the results of a query.
+        Output: a list of (group, list of the indexes in that group), for each
+                group with some of the indexes, in the order of the groups' first
+                index in the list.  Only the given indexes are in the lists.
+        """
+        groups = OrderedDict()
+        for i, group in zip(indexes, self.row_groups[np.asarray(indexes, dtype=int)].tolist()):
+            if not group in groups:
+                groups[group] = []
+            groups[group].append(i)
+        return list(groups.items())
+
+
+
+def hash_columns(columns):
+    """
+    Output: a SHA-1 hash of the coordinates in a LatColumns.
+    """
+    sha1 = hashlib.sha1()
+    for column in [columns.lat1, columns.lng1, columns.lat2, columns.lng2]:
+        sha1.update(np.ascontiguousarray(column, dtype='<f8').tobytes())
+    return sha1.hexdigest()
+
+
+
+class MovieDataset(object):
+    """
+    Desc: The contents of the three data files, loaded into memory together.
+    A dataset is never modified once it has been loaded, so a reference to
+    it can be used without locking while a reload swaps in a new one.
+    o version: a hash of the contents of the data files, which identifies
+      this version of the dataset.
+    o last_modified: the time (in seconds since the epoch) that the most
+      recently changed data file was modified.
+    o search_index: the InvertedIndex of the data, if it was built when
+      preprocessing; otherwise it is built here.
+    o marker_groups: the MarkerGroups of lat_data, if they were made when
+      preprocessing; otherwise they are made here.
+    """
+    def __init__(self, movie_data, loc_data, lat_data, version='', last_modified=0,
+                 search_index=None, marker_groups=None):
+        self.version = version
+        self.last_modified = last_modified
+        self.movie_data = movie_data
+        self.loc_data = loc_data
+        self.prefix_index = PrefixIndex(movie_data)
+        self.lat_data = lat_data
+        # Use the full-text index from preprocessing, unless it is missing or
+        # is for other data files:
+        if (search_index is None) or (not search_index.matches(movie_data, lat_data)):
+            search_index = InvertedIndex(movie_data, lat_data)
+        self.search_index = search_index
+        self.lat_columns = LatColumns(lat_data)
+        self.facets = LatFacets(movie_data, lat_data)
+        # Use the groups from preprocessing, and their tolerance, unless they
+        # are missing or are for other coordinates:
+        if marker_groups is None:
+            marker_groups = MarkerGroups(self.lat_columns)
+        elif not marker_groups.matches(self.lat_columns):
+            marker_groups = MarkerGroups(self.lat_columns, marker_groups.tolerance_ft)
+        self.marker_groups = marker_groups
+        # Index the points, and the bounding boxes of line segments, in lat_data:
+        self.grid = GridIndex(degrees(Grid_Cell_Ft / Earth_Radius_Ft))
+        columns = self.lat_columns
+        for i in range(len(lat_data)):
+            self.grid.insert_box(i, columns.min_lat[i], columns.max_lat[i],
+                                 columns.min_lng[i], columns.max_lng[i])
+
+
+    def find_indexes_by_loc(self, lat, lng, radius):
+        """
+        Input: latitude, longitude and a radius.
+        Output: Indexes into lat_data of all movie locations that fall within the
+                given radius of that location.
+        """
+        # Only locations in the grid cells overlapping the bounding box
+        # of the search circle need to be checked:
+        min_lat, max_lat = find_lat_range_ft(lat, radius + Boundary_Ft)
+        min_lng, max_lng = find_lng_range_ft(lat, lng, radius + Boundary_Ft)
+        candidates = np.array(self.grid.query(min_lat, max_lat, min_lng, max_lng),
+                              dtype=int)
+        #
+        return self.lat_columns.filter_by_radius(lat, lng, radius, candidates).tolist()
+
+
+    def find_indexes_by_bbox(self, min_lat, max_lat, min_lng, max_lng):
+        """
+        Input: the corners of a lat-lng box.
+        Output: Indexes into lat_data of all movie locations that are inside the
+                box, including line segments which pass through it.
+        """
+        candidates = np.array(self.grid.query(min_lat, max_lat, min_lng, max_lng),
+                              dtype=int)
+        return self.lat_columns.filter_by_bbox(min_lat, max_lat, min_lng, max_lng,
+                                               candidates).tolist()
+
+
+    def find_nearest(self, lat, lng, k):
+        """
+        Input: latitude, longitude and the number of movie locations to find.
+        Output: a list of up to k (index into lat_data, distance in feet) pairs
+                for the movie locations closest to that location, closest first.
+                The distance to a line segment is to its closest point.
+        """
+        if k <= 0:
+            return []
+        columns = self.lat_columns
+        vector = unit_vectors(lat, lng)
+        best = []  # A heap of (-distance, -index) of the k closest so far.
+        def bound(min_lat, max_lat, min_lng, max_lng):
+            # The distance to the closest point of the box, less a little for the
+            # difference between the box and the area it covers on the sphere:
+            closest_lat = min(max(lat, min_lat), max_lat)
+            closest_lng = min(max(lng, min_lng), max_lng)
+            return 0.99 * calc_great_circle_dist(lat, lng, closest_lat, closest_lng)
+        #
+        found = set()
+        for cell_dist, cell_ids in self.grid.cells_by_distance(lat, lng, bound):
+            if (len(best) >= k) and (cell_dist > -best[0][0]):
+                break
+            indexes = np.array([i for i in cell_ids if not i in found], dtype=int)
+            if len(indexes) == 0:
+                continue
+            found.update(indexes.tolist())
+            if len(best) >= k:
+                # Only compute the distances of the rows which may be closer
+                # than the k-th closest so far:
+                indexes = indexes[columns.distance_bounds(vector, indexes)[0] <= -best[0][0]]
+            dists = calc_segment_dists(lat, lng, columns.lat1[indexes], columns.lng1[indexes],
+                                       columns.lat2[indexes], columns.lng2[indexes])
+            for i, d in zip(indexes.tolist(), dists.tolist()):
+                if len(best) < k:
+                    heapq.heappush(best, (-d, -i))
+                elif (-d, -i) > best[0]:
+                    heapq.heapreplace(best, (-d, -i))
+        return sorted([(-i, -d) for d, i in best], key=lambda e: (e[1], e[0]))
+
+
+
+class RadiusCache(object):
+    """
+    Desc: A bounded, least-recently-used cache of the candidates of radius queries.
+    Queries are quantized before they are looked up: the center is snapped to a
+    grid whose cells are grid_ft across (in feet, both north-south and east-west),
+    and the radius is rounded up to a multiple of step_ft.  The cached result is
+    for a covering query: the quantized center, with a radius large enough to
+    hold the circle of every query with that key.  The caller then checks these
+    candidates against the exact query, so using the cache never changes results.
+    Set 'enabled' to False to have queries computed without the cache.
+    """
+    def __init__(self, max_size=Radius_Cache_Size, grid_ft=Radius_Cache_Grid_Ft,
+                 step_ft=Radius_Cache_Step_Ft, enabled=Radius_Cache_Enabled):
+        self.max_size = max_size
+        self.grid_ft = grid_ft
+        self.grid_size = degrees(grid_ft / Earth_Radius_Ft)  # Of latitude, in degrees.
+        self.step_ft = step_ft
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def quantize(self, lat, lng, radius):
+        """
+        Input: latitude, longitude and a radius.
+        Output: a pair consisting of: 1. the cache key for this query;
+                2. the (lat, lng, radius) of the covering query, whose circle
+                holds the circle of this query (and of every query with this key).
+        """
+        row = int(round(lat / self.grid_size))
+        # A degree of longitude is shorter, in feet, away from the equator:
+        lng_size = self.grid_size / max(cos(radians(row * self.grid_size)), 1e-6)
+        key = (row, int(round(lng / lng_size)), int(ceil(radius / self.step_ft)))
+        # The center moves by at most half a cell each way, so the covering radius
+        # adds half of the cell's diagonal (plus a little, for the curvature):
+        cover = key[2]*self.step_ft + 0.71*self.grid_ft + 1.0
+        return key, (row*self.grid_size, key[1]*lng_size, cover)
+
+
+    def get(self, key):
+        """
+        Output: the cached result for this key, or None if it is not cached.
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                # Move to the end, as the most recently used result:
+                del self._results[key]
+                self._results[key] = result
+            return result
+
+
+    def put(self, key, result):
+        """
+        Desc: Adds a result to the cache, evicting the least recently used
+              results if the cache is full.
+        """
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+                self.evictions += 1
+
+
+    def clear(self):
+        """
+        Desc: Removes all results from the cache.
+        """
+        with self._lock:
+            self._results.clear()
+
+
+    def stats(self):
+        """
+        Output: a dictionary with the size of the cache and the counts of
+                hits, misses and evictions.
+        """
+        with self._lock:
+            return {'size':len(self._results), 'hits':self.hits,
+                    'misses':self.misses, 'evictions':self.evictions}
+
+
+
+def load_data_files(filenames):
+    """
+    Input: a list of filenames of data files.  Files ending in '.bin' are
+           lat_data files in the binary format, and are memory-mapped;
+           all others are pickled data files.
+    Output: a triple consisting of:
+      1. the list of objects that were loaded from these files;
+      2. a hash of the contents of all of the files;
+      3. the time the most recently changed file was modified.
+    """
+    data = []
+    hasher = hashlib.sha1()
+    last_modified = 0
+    for filename in filenames:
+        if filename.endswith('.bin'):
+            mapped = MappedLatData(filename)
+            hasher.update(mapped.buffer)
+            data.append(mapped)
+        else:
+            with open(filename, "rb") as file:
+                contents = file.read()
+            hasher.update(contents)
+            data.append(pickle.loads(contents))
+        last_modified = max(last_modified, int(os.path.getmtime(filename)))
+    return data, hasher.hexdigest(), last_modified
+
+
+
+class MovieStore(object):
+    """
+    Desc: A process-resident store of the movie data.
+    The data files are read once, when the store is first used, and are
+    then kept in memory to answer every lookup.  Use reload() to pick up
+    a refreshed set of data files.
+    lat_data is read from the binary file lat_bin_filename instead of
+    lat_filename, if it exists.  By default this is lat_filename with the
+    extension .bin (e.g. data/lat_data.bin); pass '' to always use lat_filename.
+    """
+    def __init__(self, movie_filename=Movie_Data_Filename,
+                 loc_filename=Loc_Data_Filename,
+                 lat_filename=Lat_Data_Filename,
+                 lat_bin_filename=None,
+                 search_filename=Search_Index_Filename,
+                 groups_filename=Marker_Groups_Filename):
+        self.movie_filename = movie_filename
+        self.loc_filename = loc_filename
+        self.lat_filename = lat_filename
+        self.lat_bin_filename = lat_bin_filename
+        self.search_filename = search_filename
+        self.groups_filename = groups_filename
+        self._dataset = None
+        self._lock = threading.Lock()
+        self.radius_cache = RadiusCache()
+
+
+    def reload(self):
+        """
+        Desc: (Re)loads all data files and swaps them in as the current dataset.
+        The new dataset is fully loaded before it replaces the old one, so
+        lookups running at the same time see either the old or the new data
+        but never a mix of the two.  If loading fails, the old dataset is kept
+        and the exception is raised.
+        Output: the newly loaded dataset.
+        """
+        with self._lock:
+            lat_filename = self.lat_filename
+            lat_bin_filename = self.lat_bin_filename
+            if lat_bin_filename is None:
+                lat_bin_filename = os.path.splitext(lat_filename)[0] + '.bin'
+            if lat_bin_filename and os.path.exists(lat_bin_filename):
+                lat_filename = lat_bin_filename
+            filenames = [self.movie_filename, self.loc_filename, lat_filename]
+            # The index and groups are optional, since they can be made here:
+            optional = []
+            for name, filename in [('search_index', self.search_filename),
+                                   ('marker_groups', self.groups_filename)]:
+                if filename and os.path.exists(filename):
+                    optional.append(name)
+                    filenames.append(filename)
+            data, version, last_modified = load_data_files(filenames)
+            movie_data, loc_data, lat_data = data[:3]
+            extra = dict(zip(optional, data[3:]))
+            dataset = MovieDataset(movie_data, loc_data, lat_data, version, last_modified,
+                                   extra.get('search_index'), extra.get('marker_groups'))
+            self._dataset = dataset
+            self.radius_cache.clear()
+        return dataset
+
+
+    def dataset(self):
+        """
+        Output: the current dataset, loading the data files if this has
+                not been done yet.
+        """
+        dataset = self._dataset
+        if dataset is None:
+            dataset = self.reload()
+        return dataset
+
+
+    def get_movie_info(self, movie_key):
+        """
+        Input: a movie key
+        Output: the dictionary entry associated with that key from the
+                movie data file.
+        """
+        movie_data = self.dataset().movie_data
+        if not movie_key in movie_data:
+            return []
+        return movie_data[movie_key]
+
+
+    def suggest(self, prefix, limit):
+        """
+        Input: the start of a movie title, actor or director; and the maximum
+               number of results.
+        Output: a list of movie keys which match this prefix.
+        """
+        return self.dataset().prefix_index.lookup(prefix, limit)
+
+
+    def search(self, query, limit):
+        """
+        Input: a full-text query (see InvertedIndex.lookup()), and the maximum
+               number of movies and of locations to return.
+        Output: the matching movie keys and lat_data indexes (see InvertedIndex.lookup()).
+        """
+        return self.dataset().search_index.lookup(query, limit)
+
+
+    def get_locs_by_key(self, movie_key):
+        """
+        Input: a movie key
+        Output: the dictionary entry associated with that key from the
+                locations data file.
+        """
+        loc_data = self.dataset().loc_data
+        if not movie_key in loc_data:
+            return []
+        return loc_data[movie_key]
+
+
+    def get_batch(self, requests):
+        """
+        Input: a list of (movie key, want info, want locations) triples.
+        Output: a list with a dictionary for each request, containing the
+                'movie_key', whether it was 'found', and, if they were asked
+                for, its 'info' (as for get_movie_info()) and its 'locs' (as
+                for get_locs_by_key()).
+        All of the requests are answered from the same dataset, even if it
+        is reloaded part way through.
+        """
+        dataset = self.dataset()
+        results = []
+        for movie_key, want_info, want_locs in requests:
+            result = {'movie_key':movie_key, 'found':movie_key in dataset.movie_data}
+            if want_info:
+                result['info'] = dataset.movie_data.get(movie_key, [])
+            if want_locs:
+                result['locs'] = dataset.loc_data.get(movie_key, [])
+            results.append(result)
+        return results
+
+
+    def get_locs_by_indexes(self, indexes):
+        """
+        Input: a list of indexes into lat_data to retrieve.
+        Output: A list in of entries containing this location data.
+        """
+        lat_data = self.dataset().lat_data
+        loc_results = []
+        for i in indexes:
+            if (i < 0) or (i >= len(lat_data)):
+                # Invalid index, skip this.
+                continue
+            loc = lat_data[i]
+            loc_entry = [loc[2], loc[3], loc[4], loc[1]]
+            loc_results.append(loc_entry)
+        return loc_results
+
+
+    def get_groups_by_indexes(self, indexes):
+        """
+        Input: a list of indexes into lat_data, eg the results of a query.
+        Output: a list with an entry for each group of co-located movie
+                locations (see MarkerGroups) with some of these indexes.
+                Each entry is [latlngs, locs], where latlngs are the lat-lngs
+                of the group's first location, and locs is a list of
+                [movie-key, location description, fun fact] for each of the
+                indexes in the group.
+        """
+        dataset = self.dataset()
+        lat_data = dataset.lat_data
+        indexes = [i for i in indexes if (i >= 0) and (i < len(lat_data))]
+        groups = []
+        for group, members in dataset.marker_groups.group(indexes):
+            locs = [lat_data[i] for i in members]
+            groups.append([lat_data[int(dataset.marker_groups.leaders[group])][1],
+                           [[loc[2], loc[3], loc[4]] for loc in locs]])
+        return groups
+
+
+    def get_nearest(self, lat, lng, k):
+        """
+        Input: latitude, longitude and the number of movie locations to find.
+        Output: A list of the k movie locations closest to that location,
+                closest first, in the format of get_locs_by_indexes() with the
+                distance in feet added to the end of each entry.
+        """
+        dataset = self.dataset()
+        loc_results = []
+        for i, dist in dataset.find_nearest(lat, lng, k):
+            loc = dataset.lat_data[i]
+            loc_results.append([loc[2], loc[3], loc[4], loc[1], dist])
+        return loc_results
+
+
+    def get_indexes_by_bbox(self, min_lat, max_lat, min_lng, max_lng):
+        """
+        Input: the corners of a lat-lng box.
+        Output: Indexes into lat_data of all movie locations inside the box.
+        """
+        return self.dataset().find_indexes_by_bbox(min_lat, max_lat, min_lng, max_lng)
+
+
+    def get_clusters_by_bbox(self, min_lat, max_lat, min_lng, max_lng, cell_size):
+        """
+        Input: the corners of a lat-lng box, and the size of a cluster, in degrees.
+        Output: the clusters of the movie locations inside the box (see
+                LatColumns.cluster()).
+        """
+        dataset = self.dataset()
+        indexes = dataset.find_indexes_by_bbox(min_lat, max_lat, min_lng, max_lng)
+        return dataset.lat_columns.cluster(indexes, cell_size)
+
+
+    def get_indexes_by_loc(self, lat, lng, radius, filters=None):
+        """
+        Input: latitude, longitude and a radius; and optionally a dictionary of
+               filters on the movies (see LatFacets.filter()).
+        Output: Indexes into lat_data of all movie locations that fall within the
+                given radius of that location, and whose movies pass the filters.
+        """
+        dataset = self.dataset()
+        loc_results = self.find_indexes_by_loc(dataset, lat, lng, radius)
+        if filters:
+            loc_results = dataset.facets.filter(loc_results, filters).tolist()
+        return loc_results
+
+
+    def get_facet_counts(self, indexes):
+        """
+        Input: a list of indexes into lat_data.
+        Output: the counts of the years, directors, actors and production
+                companies of their movies (see LatFacets.counts()).
+        """
+        lat_data = self.dataset().lat_data
+        indexes = [i for i in indexes if (i >= 0) and (i < len(lat_data))]
+        return self.dataset().facets.counts(indexes)
+
+
+    def find_indexes_by_loc(self, dataset, lat, lng, radius):
+        """
+        Desc: dataset.find_indexes_by_loc(), using the cache of radius queries.
+              The cached candidates are filtered with the exact query, so the
+              result is the same as without the cache.
+        """
+        cache = self.radius_cache
+        if not cache.enabled:
+            return dataset.find_indexes_by_loc(lat, lng, radius)
+        #
+        key, (cover_lat, cover_lng, cover_radius) = cache.quantize(lat, lng, radius)
+        # Include the dataset version in the key, so results from a dataset
+        # which is being replaced by a reload are never used:
+        key = (dataset.version,) + key
+        candidates = cache.get(key)
+        if candidates is None:
+            candidates = np.array(dataset.find_indexes_by_loc(cover_lat, cover_lng,
+                                                              cover_radius), dtype=int)
+            cache.put(key, candidates)
+        return dataset.lat_columns.filter_by_radius(lat, lng, radius, candidates).tolist()
+
+
+
+# The store shared by the module-level lookup functions below:
+Store = MovieStore()
+
+
+def reload():
+    """
+    Desc: Reloads the data files used by the module-level lookup functions.
+    """
+    return Store.reload()
+
+
+
+def get_version():
+    """
+    Output: a pair consisting of the version of the current dataset (a hash of
+            its data files) and the time its data files were last modified.
+            Returns ('', 0) if the data files can not be loaded.
+    """
+    try:
+        dataset = Store.dataset()
+        return dataset.version, dataset.last_modified
+    except:
+        pass
+    return '', 0
+
 
 
 def get_movie_info(movie_key):
@@ -29,18 +1014,38 @@ def get_movie_info(movie_key):
             movie data file.
     """
     try:
-        file = open(Movie_Data_Filename, "rb" )
-        movie_data = pickle.load(file)
-        file.close()
-        if not movie_key in movie_data:
-            return []
-        return movie_data[movie_key]
+        return Store.get_movie_info(movie_key)
     except:
         print('get_move_info() - failed')
         pass
     return []  # Return empty list if things fail.
 
 
+def suggest(prefix, limit=10):
+    """
+    Input: the start of a movie title, actor or director; and the maximum
+           number of results.
+    Output: a list of movie keys which match this prefix.
+    """
+    try:
+        return Store.suggest(prefix, limit)
+    except:
+        pass
+    return []
+
+
+def search(query, limit=100):
+    """
+    Input: a full-text query, and the maximum number of movies and of locations.
+    Output: the matching movie keys and lat_data indexes (see InvertedIndex.lookup()).
+    """
+    try:
+        return Store.search(query, limit)
+    except:
+        pass
+    return {'keys':[], 'total_keys':0, 'indexes':[], 'total_indexes':0}
+
+
 def get_locs_by_key(movie_key):
     """
     Input: a movie key
@@ -48,12 +1053,7 @@ def get_locs_by_key(movie_key):
             locations data file.
     """
     try:
-        file = open(Loc_Data_Filename, "rb" )
-        loc_data = pickle.load(file)
-        file.close()
-        if not movie_key in loc_data:
-            return []
-        return loc_data[movie_key]
+        return Store.get_locs_by_key(movie_key)
     except:
         pass
     return []  # Return empty list of things fail.
@@ -61,66 +1061,116 @@ def get_locs_by_key(movie_key):
 
 
 
+def get_batch(requests):
+    """
+    Input: a list of (movie key, want info, want locations) triples.
+    Output: a list with a dictionary for each request (see MovieStore.get_batch()).
+    """
+    try:
+        return Store.get_batch(requests)
+    except:
+        pass
+    return []
+
+
+
 def get_locs_by_indexes(indexes):
     """
     Input: a list of indexes into lat_data to retrieve.
     Output: A list in of entries containing this location data.
     """
-    loc_results = []
     try:
-        file = open(Lat_Data_Filename, "rb" )
-        lat_data = pickle.load(file)
-        file.close()
-        for i in indexes:
-            if (i < 0) or (i >= len(lat_data)):
-                # Invalid index, skip this.
-                continue
-            loc_entry = [lat_data[i][2], lat_data[i][3], lat_data[i][4], lat_data[i][1]]
-            loc_results.append(loc_entry)
+        return Store.get_locs_by_indexes(indexes)
+    except:
+        pass
+    return []
+
+
+
+def get_groups_by_indexes(indexes):
+    """
+    Input: a list of indexes into lat_data.
+    Output: the groups of co-located movie locations with these indexes
+            (see MovieStore.get_groups_by_indexes()).
+    """
+    try:
+        return Store.get_groups_by_indexes(indexes)
     except:
         pass
-    return loc_results
+    return []
 
 
 
-def get_indexes_by_loc(lat, lng, radius):
+def nearest(lat, lng, k):
+    """
+    Input: latitude, longitude and the number of movie locations to find.
+    Output: A list of the k movie locations closest to that location,
+            closest first, each with its distance in feet (see MovieStore.get_nearest()).
     """
-    Input: latitude, longitude and a radius.
+    try:
+        return Store.get_nearest(lat, lng, k)
+    except:
+        pass
+    return []
+
+
+
+def get_indexes_by_bbox(min_lat, max_lat, min_lng, max_lng):
+    """
+    Input: the corners of a lat-lng box.
+    Output: Indexes into lat_data of all movie locations inside the box.
+    """
+    try:
+        return Store.get_indexes_by_bbox(min_lat, max_lat, min_lng, max_lng)
+    except:
+        pass
+    return []
+
+
+
+def get_clusters_by_bbox(min_lat, max_lat, min_lng, max_lng, cell_size):
+    """
+    Input: the corners of a lat-lng box, and the size of a cluster, in degrees.
+    Output: the clusters of the movie locations inside the box (see
+            LatColumns.cluster()).
+    """
+    try:
+        return Store.get_clusters_by_bbox(min_lat, max_lat, min_lng, max_lng, cell_size)
+    except:
+        pass
+    return []
+
+
+
+def get_indexes_by_loc(lat, lng, radius, filters=None):
+    """
+    Input: latitude, longitude and a radius; and optionally a dictionary of
+           filters on the movies (see LatFacets.filter()).
     Output: Indexes into lat_data of all movie locations that fall within the
-            given radius of that location.
+            given radius of that location, and whose movies pass the filters.
     """
     # print('get_indexes_by_loc({},{},{})'.format(lat,lng,radius))
-    loc_results = []
     try:
-        file = open(Lat_Data_Filename, "rb" )
-        lat_data = pickle.load(file)
-        file.close()
-        #
-        # The extra 250ft is to pick a range to handle finding line-segments:
-        min_lat, max_lat = find_lat_range_ft(lat, radius+250)
-        #
-        keys = [l[0] for l in lat_data]
-        i_start = bisect.bisect_left(keys, min_lat)
-        i_stop = bisect.bisect_left(keys, max_lat)
-        # print('lat range:: {}:{}, ({},{})'.format(min_lat, max_lat, i_start, i_stop))
-        #
-        for i in range(i_start, i_stop):
-            # For both points and line segments, the first two values in lat_data[1]
-            # are lat-lng values, so check if this is in the radius:
-            if calc_great_circle_dist(lat, lng, lat_data[i][1][0], lat_data[i][1][1]) <= radius:
-                loc_results.append(i)
-                continue  # Once added, no need to check if this is a line segment.
-            #
-            if len(lat_data[i][1]) == 4:
-                # This handles the line segment case, in which the 4 entries are
-                # two pairs of lat-lngs.
-                if calc_great_circle_dist(lat, lng, lat_data[i][1][2], lat_data[i][1][3]) <= radius:
-                    loc_results.append(i)
+        return Store.get_indexes_by_loc(lat, lng, radius, filters)
     except Exception as e:
         print('error:{}'.format(e))
         pass
     #
-    return loc_results
+    return []
+
+
+
+def get_facet_counts(indexes):
+    """
+    Input: a list of indexes into lat_data.
+    Output: the counts of the years, directors, actors and production
+            companies of their movies (see LatFacets.counts()).
+    """
+    try:
+        return Store.get_facet_counts(indexes)
+    except:
+        pass
+    return {'year':[], 'director':[], 'actor':[], 'prod_co':[]}
 
 
 
@@ -142,6 +1192,106 @@ def calc_great_circle_dist(lat1, lon1, lat2, lon2, radius=Earth_Radius_Ft):
 
 
 
+def calc_great_circle_dists(lat, lon, lats, lons, radius=Earth_Radius_Ft):
+    """
+    Desc: computes the Great Circle distances between a point and an array of
+          points.  This gives the same values as calc_great_circle_dist(),
+          but for all of the points in one call.
+    Input: lat/lng values using decimal degrees; lats and lons are arrays.
+    Output: an array of the distances.
+    """
+    lat1 = radians(lat)
+    lon1 = radians(lon)
+    lat2 = np.radians(lats)
+    lon2 = np.radians(lons)
+    #
+    d=2*np.arcsin(np.sqrt((np.sin((lat1-lat2)/2))**2 +
+                          cos(lat1)*np.cos(lat2)*(np.sin((lon1-lon2)/2))**2))
+    #
+    return d*radius
+
+
+
+def unit_vectors(lats, lons):
+    """
+    Desc: converts lat/lng values to vectors on the unit sphere.
+    Input: lat/lng values using decimal degrees; either numbers or arrays.
+    Output: a triple of the x, y and z values of the vectors.
+    """
+    lats = np.radians(lats)
+    lons = np.radians(lons)
+    cos_lats = np.cos(lats)
+    return cos_lats*np.cos(lons), cos_lats*np.sin(lons), np.sin(lats)
+
+
+
+def calc_chord_sq(dist, radius=Earth_Radius_Ft):
+    """
+    Desc: computes the square of the length of the chord between two points on
+          the unit sphere that are a Great Circle distance of 'dist' apart on a
+          sphere of 'radius'.  Two points are at most 'dist' apart if the
+          squared distance between their unit vectors is at most this.
+    Note: This is 4 times the 'haversine' term in calc_great_circle_dist().
+    """
+    angle = dist / radius
+    if angle >= pi:
+        return 4.0  # The whole sphere.
+    return (2*sin(angle / 2))**2
+
+
+
+def calc_segment_dist(lat, lon, lat1, lon1, lat2, lon2, radius=Earth_Radius_Ft):
+    """
+    Desc: computes and returns the Great Circle distance between a point and
+          the closest point on the line segment from (lat1,lon1) to (lat2,lon2).
+    Input: lat/lng values using decimal degrees.
+    Note: The closest point is found on a flat map centered on (lat,lon),
+          which is accurate for line segments that are a few miles long.
+          When the closest point is an end-point, this gives exactly the
+          same distance as calc_great_circle_dist() to that end-point.
+    """
+    scale = cos(radians(lat))
+    x1 = (lon1 - lon) * scale
+    y1 = lat1 - lat
+    dx = (lon2 - lon1) * scale
+    dy = lat2 - lat1
+    length_sq = dx*dx + dy*dy
+    t = 0.0
+    if length_sq > 0:
+        t = min(1.0, max(0.0, -(x1*dx + y1*dy) / length_sq))
+    if t == 0.0:
+        return calc_great_circle_dist(lat, lon, lat1, lon1, radius)
+    if t == 1.0:
+        return calc_great_circle_dist(lat, lon, lat2, lon2, radius)
+    return calc_great_circle_dist(lat, lon, lat1 + t*(lat2-lat1), lon1 + t*(lon2-lon1), radius)
+
+
+
+def calc_segment_dists(lat, lon, lats1, lons1, lats2, lons2, radius=Earth_Radius_Ft):
+    """
+    Desc: computes the distances between a point and an array of line segments.
+          This gives the same values as calc_segment_dist(), but for all of the
+          line segments in one call.
+    Input: lat/lng values using decimal degrees; lats1, lons1, lats2 and lons2
+           are arrays of the end-points of the line segments.
+    Output: an array of the distances.
+    """
+    scale = cos(radians(lat))
+    x1 = (lons1 - lon) * scale
+    y1 = lats1 - lat
+    dx = (lons2 - lons1) * scale
+    dy = lats2 - lats1
+    length_sq = dx*dx + dy*dy
+    # Points (length_sq of 0) use their first end-point:
+    t = -(x1*dx + y1*dy) / np.where(length_sq > 0, length_sq, 1.0)
+    t = np.clip(np.where(length_sq > 0, t, 0.0), 0.0, 1.0)
+    # Use the end-points as they are, where possible, rather than lat1 + 1.0*(lat2-lat1):
+    lats = np.where(t == 1.0, lats2, lats1 + t*(lats2-lats1))
+    lons = np.where(t == 1.0, lons2, lons1 + t*(lons2-lons1))
+    return calc_great_circle_dists(lat, lon, lats, lons, radius)
+
+
+
 def find_lat_range_ft(lat, radius):
     """
     Input: a latitude and a radius (in feet).
@@ -153,3 +1303,18 @@ def find_lat_range_ft(lat, radius):
     return lat-delta, lat+delta
 
 
+def find_lng_range_ft(lat, lng, radius):
+    """
+    Input: a latitude, longitude and a radius (in feet).
+    Output: a pair specifying the minimum and maximum longitudes for
+            which are within that radius.
+    Note: This does not handle circles that cross the 180th meridian, and
+          near the poles it returns the full range of longitudes.
+    """
+    ratio = sin(radius / Earth_Radius_Ft) / cos(radians(lat))
+    if ratio >= 1.0:
+        return -180.0, 180.0
+    delta = degrees(asin(ratio))
+    return lng-delta, lng+delta
+
+
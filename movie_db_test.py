@@ -3,7 +3,12 @@ File: movie_db_test.py
 Desc: Unit tests for movie_db.py
 """
 
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
+import numpy as np
 import movie_db as mdb
 
 
@@ -104,6 +109,89 @@ class MovieDbTest(unittest.TestCase):
             self.assertTrue(abs(d - output) < output/100.0)
 
 
+    def test_calc_great_circle_dists(self):
+        # Verify that the vectorized distances match calc_great_circle_dist()
+        # for every coordinate in the shipped data:
+        columns = mdb.Store.dataset().lat_columns
+        for lat, lng in [(37.7763, -122.4346), (32.9697, -96.80322)]:
+            dists1 = mdb.calc_great_circle_dists(lat, lng, columns.lat1, columns.lng1)
+            dists2 = mdb.calc_great_circle_dists(lat, lng, columns.lat2, columns.lng2)
+            for i in range(len(dists1)):
+                d1 = mdb.calc_great_circle_dist(lat, lng, columns.lat1[i], columns.lng1[i])
+                d2 = mdb.calc_great_circle_dist(lat, lng, columns.lat2[i], columns.lng2[i])
+                self.assertTrue(abs(dists1[i] - d1) <= 1e-6 * max(d1, 1.0))
+                self.assertTrue(abs(dists2[i] - d2) <= 1e-6 * max(d2, 1.0))
+
+
+    def test_filter_by_radius_boundary(self):
+        # Verify that radius queries give exactly the same indexes as checking
+        # each row with calc_great_circle_dist() and calc_segment_dist(), when
+        # the radius is the distance to a location, so it is right on the edge:
+        dataset = mdb.Store.dataset()
+        lat_data = dataset.lat_data
+        all_indexes = np.arange(len(lat_data))
+        for lat, lng in [(37.7763, -122.4346), (37.7937, -122.3999), (37.76526, -122.44388)]:
+            dists = [scalar_dist(lat, lng, loc[1]) for loc in lat_data]
+            for radius in dists[::5] + [0.0]:
+                expected = [i for i, d in enumerate(dists) if d <= radius]
+                self.assertEqual(dataset.lat_columns.filter_by_radius(
+                    lat, lng, radius, all_indexes).tolist(), expected)
+                self.assertEqual(dataset.find_indexes_by_loc(lat, lng, radius), expected)
+        # A query centered on a location, with a radius of 0, finds it:
+        latlngs = lat_data[100][1]
+        self.assertTrue(100 in dataset.find_indexes_by_loc(latlngs[0], latlngs[1], 0.0))
+
+
+    def test_filter_by_radius(self):
+        # Verify that filtering all rows in one call gives the same indexes
+        # as checking each row with calc_great_circle_dist():
+        lat_data = mdb.Store.dataset().lat_data
+        columns = mdb.Store.dataset().lat_columns
+        all_indexes = np.arange(len(lat_data))
+        for lat, lng, radius in [(37.7787, -122.5127, 1000.0), (37.7937, -122.3999, 2000.0),
+                                 (37.76526, -122.44388, 10560.0)]:
+            expected = []
+            for i, loc in enumerate(lat_data):
+                latlngs = loc[1]
+                if len(latlngs) == 4:
+                    d = mdb.calc_segment_dist(lat, lng, latlngs[0], latlngs[1],
+                                              latlngs[2], latlngs[3])
+                else:
+                    d = mdb.calc_great_circle_dist(lat, lng, latlngs[0], latlngs[1])
+                if d <= radius:
+                    expected.append(i)
+            res = columns.filter_by_radius(lat, lng, radius, all_indexes)
+            self.assertEqual(res.tolist(), expected)
+
+
+    def test_calc_segment_dist(self):
+        # A segment running east-west, about 2800 ft long:
+        seg = [37.7937, -122.4050, 37.7937, -122.3953]
+        # Test a point next to the middle of the segment, which is much
+        # further from either end-point:
+        d = mdb.calc_segment_dist(37.7947, -122.4000, seg[0], seg[1], seg[2], seg[3])
+        self.assertTrue(abs(d - 364.7) < 1.0)
+        self.assertTrue(mdb.calc_great_circle_dist(37.7947, -122.4000, seg[0], seg[1]) > 1000.0)
+        # Test points past either end, for which the closest point is an end-point:
+        for lat, lng in [(37.7947, -122.4100), (37.7900, -122.3900)]:
+            d = mdb.calc_segment_dist(lat, lng, seg[0], seg[1], seg[2], seg[3])
+            self.assertEqual(d, min(mdb.calc_great_circle_dist(lat, lng, seg[0], seg[1]),
+                                    mdb.calc_great_circle_dist(lat, lng, seg[2], seg[3])))
+        # Test a segment with both end-points the same:
+        self.assertEqual(mdb.calc_segment_dist(37.7947, -122.4, 37.7937, -122.4, 37.7937, -122.4),
+                         mdb.calc_great_circle_dist(37.7947, -122.4, 37.7937, -122.4))
+
+        # Verify that the vectorized distances match, for the shipped data:
+        columns = mdb.Store.dataset().lat_columns
+        lat, lng = 37.7937, -122.3999
+        dists = mdb.calc_segment_dists(lat, lng, columns.lat1, columns.lng1,
+                                       columns.lat2, columns.lng2)
+        for i in range(len(dists)):
+            d = mdb.calc_segment_dist(lat, lng, columns.lat1[i], columns.lng1[i],
+                                      columns.lat2[i], columns.lng2[i])
+            self.assertTrue(abs(dists[i] - d) <= 1e-6 * max(d, 1.0))
+
+
     def test_find_lat_range_ft(self):
         # Test various input sets of [lat, lng, radius]
         # Verify that the min latitude range is about [lat,lng]-radius
@@ -127,6 +215,464 @@ class MovieDbTest(unittest.TestCase):
 
 
 
+    def test_find_lng_range_ft(self):
+        # Test various input sets of [lat, lng, radius]
+        # Verify that the longitude range just covers the circle of that radius.
+        test_vals = [[37.7763, -122.0, 1000.0],
+                     [35.0, 120.0, 3180.0],
+                     [-60.0, 10.0, 52800.0]]
+        for input in test_vals:
+            min_lng, max_lng = mdb.find_lng_range_ft(input[0], input[1], input[2])
+            self.assertTrue(min_lng < input[1])
+            self.assertTrue(max_lng > input[1])
+            # The closest points to (min_lng, max_lng) are at a slightly higher latitude
+            # (lower, in the southern hemisphere), so these are just outside the radius:
+            d = mdb.calc_great_circle_dist(input[0], input[1], input[0], min_lng)
+            self.assertTrue(d > input[2])
+            self.assertTrue(abs(d - input[2]) < input[2]/100.0)
+            d = mdb.calc_great_circle_dist(input[0], input[1], input[0], max_lng)
+            self.assertTrue(abs(d - input[2]) < input[2]/100.0)
+
+        # Near the poles, all longitudes are in range:
+        self.assertEqual(mdb.find_lng_range_ft(89.999, 0.0, 5280.0), (-180.0, 180.0))
+
+
+    def test_get_indexes_by_loc_all_rows(self):
+        # Verify the spatial index gives the same results as checking every row:
+        lat_data = mdb.Store.dataset().lat_data
+        queries = [(37.7787, -122.5127, 1000.0), (37.78373, -122.46329, 500.0),
+                   (37.7937, -122.3999, 2000.0), (37.76526, -122.44388, 26400.0)]
+        for lat, lng, radius in queries:
+            expected = []
+            for i, loc in enumerate(lat_data):
+                latlngs = loc[1]
+                d = mdb.calc_segment_dist(lat, lng, latlngs[0], latlngs[1],
+                                          latlngs[-2], latlngs[-1])
+                if d <= radius:
+                    expected.append(i)
+            self.assertEqual(mdb.get_indexes_by_loc(lat, lng, radius), expected)
+
+        # Test a circle which only covers the middle of a line segment,
+        # 'Embarcadero from Broadway to Folsom':
+        self.assertTrue(819 in mdb.get_indexes_by_loc(37.7937, -122.3999, 500.0))
+
+
+    def test_movie_store(self):
+        store = mdb.MovieStore()
+        dataset = store.dataset()
+        # Data is loaded once and then reused:
+        self.assertTrue(store.dataset() is dataset)
+        self.assertEqual(store.get_locs_by_indexes([5]),
+                         mdb.get_locs_by_indexes([5]))
+
+        # Reloading swaps in a new dataset with the same contents:
+        new_dataset = store.reload()
+        self.assertFalse(new_dataset is dataset)
+        self.assertTrue(store.dataset() is new_dataset)
+        self.assertEqual(list(new_dataset.lat_data), list(dataset.lat_data))
+        self.assertEqual(new_dataset.version, dataset.version)
+        self.assertEqual(mdb.get_version(), (dataset.version, dataset.last_modified))
+
+        # A failed reload keeps the current dataset:
+        store.movie_filename = 'data/no_such_file.p'
+        self.assertRaises(IOError, store.reload)
+        self.assertTrue(store.dataset() is new_dataset)
+        self.assertEqual(store.get_indexes_by_loc(37.78373, -122.46329, 500.0),
+                         [484, 485])
+
+
+
+    def test_movie_store_lat_data_files(self):
+        # Test that the binary lat_data file, when there is one, holds the same
+        # data as the pickled one:
+        store_bin = mdb.MovieStore()
+        store_pickle = mdb.MovieStore(lat_bin_filename='')
+        lat_data_bin = store_bin.dataset().lat_data
+        lat_data_pickle = store_pickle.dataset().lat_data
+        self.assertTrue(isinstance(lat_data_bin, mdb.MappedLatData))
+        self.assertTrue(isinstance(lat_data_pickle, list))
+        self.assertEqual(list(lat_data_bin), lat_data_pickle)
+        self.assertEqual(store_bin.get_indexes_by_loc(37.7937, -122.3999, 2000.0),
+                         store_pickle.get_indexes_by_loc(37.7937, -122.3999, 2000.0))
+        # The binary file is found next to lat_filename, so a lat_data.p from
+        # another directory is not replaced by data/lat_data.bin:
+        work = tempfile.mkdtemp()
+        try:
+            lat_filename = os.path.join(work, 'lat_data.p')
+            with open(lat_filename, 'wb') as file:
+                pickle.dump(lat_data_pickle[:10], file)
+            store = mdb.MovieStore(lat_filename=lat_filename)
+            self.assertEqual(store.dataset().lat_data, lat_data_pickle[:10])
+            shutil.copy('data/lat_data.bin', os.path.join(work, 'lat_data.bin'))
+            self.assertTrue(isinstance(store.reload().lat_data, mdb.MappedLatData))
+        finally:
+            shutil.rmtree(work)
+
+
+    def test_radius_cache(self):
+        cache = mdb.RadiusCache(max_size=2, grid_ft=10.0, step_ft=50.0)
+        # Test that nearby queries quantize to the same key:
+        key1, query1 = cache.quantize(37.7787, -122.5127, 1000.0)
+        key2, query2 = cache.quantize(query1[0] + 0.00001, query1[1] - 0.00001, 960.0)
+        self.assertEqual(key1, key2)
+        self.assertEqual(query1, query2)
+        self.assertTrue(abs(query1[0] - 37.7787) < 0.0001)
+        self.assertTrue(abs(query1[1] - -122.5127) < 0.0001)
+        self.assertNotEqual(cache.quantize(37.7787, -122.5127, 1010.0)[0], key1)
+        # The covering query holds the circle of the query:
+        for lat, lng, radius in [(37.7787, -122.5127, 1000.0), (37.77874, -122.51276, 20.0),
+                                 (60.0, 10.00003, 0.0), (-33.9, 151.2, 75.0)]:
+            key, (cover_lat, cover_lng, cover_radius) = cache.quantize(lat, lng, radius)
+            self.assertTrue(mdb.calc_great_circle_dist(lat, lng, cover_lat, cover_lng) + radius
+                            <= cover_radius)
+        # The grid is the same size in feet east-west as north-south:
+        lng_ft = mdb.calc_great_circle_dist(60.0, 10.0, 60.0, 10.01)
+        lat_ft = mdb.calc_great_circle_dist(60.0, 10.0, 60.01, 10.0)
+        keys = [cache.quantize(60.0, 10.0, 0.0)[0], cache.quantize(60.0, 10.01, 0.0)[0],
+                cache.quantize(60.01, 10.0, 0.0)[0]]
+        self.assertAlmostEqual((keys[1][1] - keys[0][1]) / lng_ft,
+                               (keys[2][0] - keys[0][0]) / lat_ft, delta=0.002)
+
+        # Test hits, misses and evicting the least recently used result:
+        self.assertEqual(cache.get('a'), None)
+        cache.put('a', [1])
+        cache.put('b', [2])
+        self.assertEqual(cache.get('a'), [1])
+        cache.put('c', [3])  # Evicts 'b'
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), [3])
+        self.assertEqual(cache.stats(), {'size':2, 'hits':2, 'misses':2, 'evictions':1})
+        cache.clear()
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+    def test_movie_store_radius_cache(self):
+        store = mdb.MovieStore()
+        dataset = store.dataset()
+        lat, lng, radius = 37.7787, -122.5127, 1000.0
+        res = store.get_indexes_by_loc(lat, lng, radius)
+        self.assertEqual(res, dataset.find_indexes_by_loc(lat, lng, radius))
+        self.assertEqual(store.radius_cache.stats()['misses'], 1)
+        # A nearby query uses the cached candidates, but gets its own exact result:
+        self.assertEqual(store.get_indexes_by_loc(lat + 0.00001, lng - 0.00001, 960.0),
+                         dataset.find_indexes_by_loc(lat + 0.00001, lng - 0.00001, 960.0))
+        self.assertEqual(store.radius_cache.stats()['hits'], 1)
+        # Reloading the data clears the cache:
+        store.reload()
+        self.assertEqual(store.radius_cache.stats()['size'], 0)
+        self.assertEqual(store.get_indexes_by_loc(lat, lng, radius), res)
+        self.assertEqual(store.radius_cache.stats()['misses'], 2)
+        # Test with the cache turned off:
+        store.radius_cache.enabled = False
+        self.assertEqual(store.get_indexes_by_loc(lat, lng, radius), res)
+        self.assertEqual(store.radius_cache.stats()['misses'], 2)
+
+
+    def test_radius_cache_exact(self):
+        # The cache never changes the results, including small radii and
+        # locations right on the edge of the circle:
+        store = mdb.MovieStore()
+        dataset = store.dataset()
+        columns = dataset.lat_columns
+        queries = [(37.7787, -122.5127, 1000.0), (37.7937, -122.3999, 3000.0),
+                   (columns.lat1[100], columns.lng1[100] + 0.00005, 20.0),
+                   (columns.lat1[100], columns.lng1[100], 0.0)]
+        for i in range(0, len(dataset.lat_data), 37):
+            lat, lng = columns.lat1[i] + 0.00003, columns.lng1[i] - 0.00002
+            dist = mdb.calc_segment_dist(lat, lng, columns.lat1[i], columns.lng1[i],
+                                         columns.lat2[i], columns.lng2[i])
+            queries += [(lat, lng, dist), (lat, lng, dist * (1 - 1e-6)), (lat, lng, 12.0)]
+        for lat, lng, radius in queries + queries:
+            self.assertEqual(store.get_indexes_by_loc(lat, lng, radius),
+                             dataset.find_indexes_by_loc(lat, lng, radius))
+        self.assertTrue(store.radius_cache.stats()['hits'] >= len(queries))
+        self.assertEqual(store.get_indexes_by_loc(queries[2][0], queries[2][1], 20.0), [100])
+
+
+    def test_filter_by_bbox(self):
+        # Test line segments that cross the box, pass by a corner, or end inside it:
+        columns = mdb.LatColumns([[0, [0.0, -2.0, 0.0, 2.0]], [0, [2.0, 0.5, 0.5, 2.0]],
+                                  [0, [1.5, 0.0, 0.0, 1.5]], [0, [0.5, 0.5]],
+                                  [0, [1.0, 1.0]], [0, [1.01, 0.5]],
+                                  [0, [0.5, 0.5, 3.0, 3.0]], [0, [-1.0, -1.0, -1.0, 3.0]]])
+        res = columns.filter_by_bbox(0.0, 1.0, 0.0, 1.0, np.arange(8))
+        self.assertEqual(res.tolist(), [0, 2, 3, 4, 6])
+
+        # Verify on all rows against a check of each row:
+        dataset = mdb.Store.dataset()
+        for box in [(37.77, 37.79, -122.42, -122.39), (37.80, 37.81, -122.48, -122.40),
+                    (37.6, 37.9, -122.6, -122.3)]:
+            expected = [i for i, loc in enumerate(dataset.lat_data)
+                        if segment_in_box(loc[1], *box)]
+            self.assertEqual(dataset.find_indexes_by_bbox(*box), expected)
+            self.assertEqual(mdb.get_indexes_by_bbox(*box), expected)
+
+
+    def test_cluster(self):
+        columns = mdb.LatColumns([[0, [0.1, 0.1]], [0, [0.3, 0.5]], [0, [1.5, 0.5]],
+                                  [0, [0.2, 0.2, 0.4, 0.4]], [0, [-0.5, 0.5]]])
+        clusters = columns.cluster([0, 1, 2, 3, 4], 1.0)
+        self.assertEqual([c['count'] for c in clusters], [1, 3, 1])
+        self.assertEqual([c['index'] for c in clusters], [4, 0, 2])
+        self.assertAlmostEqual(clusters[1]['lat'], (0.1 + 0.3 + 0.3) / 3)
+        self.assertAlmostEqual(clusters[1]['lng'], (0.1 + 0.5 + 0.3) / 3)
+        self.assertEqual(columns.cluster([], 1.0), [])
+        self.assertRaises(ValueError, columns.cluster, [0, 1], 0.0)
+
+        # The clusters of a box hold all of the locations in it:
+        box = (37.7, 37.85, -122.52, -122.35)
+        clusters = mdb.get_clusters_by_bbox(box[0], box[1], box[2], box[3], 0.01)
+        self.assertEqual(sum(c['count'] for c in clusters), len(mdb.get_indexes_by_bbox(*box)))
+
+
+
+    def test_find_nearest(self):
+        # Verify against the distances to all rows:
+        dataset = mdb.Store.dataset()
+        columns = dataset.lat_columns
+        for lat, lng in [(37.7937, -122.3999), (37.7787, -122.5127), (37.76526, -122.44388),
+                         (37.8199, -122.4783), (40.7128, -74.0060)]:
+            dists = mdb.calc_segment_dists(lat, lng, columns.lat1, columns.lng1,
+                                           columns.lat2, columns.lng2)
+            expected = sorted(zip(range(len(dists)), dists.tolist()), key=lambda e: (e[1], e[0]))
+            for k in [1, 5, 50, 2000]:
+                res = dataset.find_nearest(lat, lng, k)
+                self.assertEqual(res, expected[:k])
+
+        # The module function returns the locations with their distances:
+        res = mdb.nearest(37.7937, -122.3999, 3)
+        indexes = [i for i, d in dataset.find_nearest(37.7937, -122.3999, 3)]
+        self.assertEqual([loc[:4] for loc in res], mdb.get_locs_by_indexes(indexes))
+        self.assertEqual([loc[4] for loc in res],
+                         [d for i, d in dataset.find_nearest(37.7937, -122.3999, 3)])
+        self.assertEqual(dataset.find_nearest(37.7937, -122.3999, 0), [])
+
+
+    def test_distance_bounds(self):
+        # The bounds from the chords hold the distance to each point and line
+        # segment, near and far, and are close to it for nearby rows:
+        columns = mdb.Store.dataset().lat_columns
+        self.assertEqual(columns.seg_ft[~columns.has_segment].tolist(),
+                         [0.0] * int((~columns.has_segment).sum()))
+        segments = np.nonzero(columns.has_segment)[0]
+        self.assertTrue(len(segments) > 0)
+        for i in segments[:20].tolist():
+            self.assertAlmostEqual(columns.seg_ft[i], mdb.calc_great_circle_dist(
+                columns.lat1[i], columns.lng1[i], columns.lat2[i], columns.lng2[i]), places=3)
+        all_indexes = np.arange(len(columns.lat1))
+        for lat, lng in [(37.7937, -122.3999), (37.8199, -122.4783), (40.7128, -74.0060),
+                         (-33.9, 151.2)]:
+            lower, upper = columns.distance_bounds(mdb.unit_vectors(lat, lng), all_indexes)
+            dists = mdb.calc_segment_dists(lat, lng, columns.lat1, columns.lng1,
+                                           columns.lat2, columns.lng2)
+            self.assertTrue((lower < dists).all())
+            self.assertTrue((upper > dists).all())
+        lower, upper = columns.distance_bounds(mdb.unit_vectors(37.7937, -122.3999), segments)
+        self.assertTrue(np.isfinite(upper).all())
+
+
+    def test_chord_radius_check(self):
+        # The chord check agrees with the Great Circle distance just inside and
+        # just outside of the radius of each point (to within a millionth of
+        # the distance, which is about the precision of the chord for points
+        # that are a few feet apart):
+        columns = mdb.Store.dataset().lat_columns
+        points = np.arange(len(columns.lat1))[~columns.has_segment]
+        for lat, lng in [(37.7937, -122.3999), (37.76526, -122.44388), (37.8199, -122.4783)]:
+            x, y, z = mdb.unit_vectors(lat, lng)
+            for i in points[::7]:
+                dist = mdb.calc_great_circle_dist(lat, lng, columns.lat1[i], columns.lng1[i])
+                if dist < 1.0:
+                    continue
+                chord_sq = ((columns.x[i] - x)**2 + (columns.y[i] - y)**2 +
+                            (columns.z[i] - z)**2)
+                self.assertTrue(chord_sq <= mdb.calc_chord_sq(dist * (1 + 1e-6)))
+                self.assertTrue(chord_sq > mdb.calc_chord_sq(dist * (1 - 1e-6)))
+                res = columns.filter_by_radius(lat, lng, dist * (1 + 1e-6), np.array([i]))
+                self.assertEqual(res.tolist(), [i])
+                res = columns.filter_by_radius(lat, lng, dist * (1 - 1e-6), np.array([i]))
+                self.assertEqual(res.tolist(), [])
+
+        # Test the chord of distances of up to half way around the Earth:
+        self.assertEqual(mdb.calc_chord_sq(0.0), 0.0)
+        half = np.pi * mdb.Earth_Radius_Ft
+        self.assertAlmostEqual(mdb.calc_chord_sq(half / 2), 2.0)
+        self.assertEqual(mdb.calc_chord_sq(half), 4.0)
+        self.assertEqual(mdb.calc_chord_sq(2 * half), 4.0)
+        x, y, z = mdb.unit_vectors(np.array([0.0, 90.0]), np.array([90.0, 0.0]))
+        self.assertTrue(np.allclose(x, [0.0, 0.0]))
+        self.assertTrue(np.allclose(y, [1.0, 0.0]))
+        self.assertTrue(np.allclose(z, [0.0, 1.0]))
+
+    def test_lat_facets(self):
+        movie_data = {'A (1958)': {'year': '1958', 'director': 'Alfred Hitchcock',
+                                   'actor1': 'James Stewart', 'actor2': 'Kim Novak',
+                                   'actor3': '', 'prod_co': 'Paramount'},
+                      'B (1963)': {'year': '1963', 'director': 'Alfred Hitchcock',
+                                   'actor1': 'Tippi Hedren', 'actor2': 'Tippi Hedren',
+                                   'actor3': '', 'prod_co': ''},
+                      'C (2001)': {'year': '2001', 'director': 'Steven Soderbergh',
+                                   'actor1': 'George Clooney', 'actor2': ' Kim  Novak',
+                                   'actor3': '', 'prod_co': 'Warner'}}
+        lat_data = [[0, [0, 0], 'A (1958)'], [0, [0, 0], 'C (2001)'], [0, [0, 0], 'A (1958)'],
+                    [0, [0, 0], 'B (1963)'], [0, [0, 0], 'Unknown (1900)']]
+        facets = mdb.LatFacets(movie_data, lat_data)
+        self.assertEqual(facets.year.dtype, np.int16)
+        self.assertEqual(facets.year.tolist(), [1958, 2001, 1958, 1963, 0])
+        self.assertEqual(facets.director.dtype, np.int32)
+        self.assertEqual([facets.names['director'][i] for i in facets.director[:4]],
+                         ['Alfred Hitchcock', 'Steven Soderbergh', 'Alfred Hitchcock',
+                          'Alfred Hitchcock'])
+        self.assertEqual(facets.director[4], -1)
+        self.assertEqual(facets.prod_co.tolist()[2:], [0, -1, -1])
+        # Names are stored with their whitespace collapsed:
+        self.assertEqual(facets.names['actor'],
+                         ['George Clooney', 'James Stewart', 'Kim Novak', 'Tippi Hedren'])
+
+        # Test the filters:
+        indexes = np.arange(5)
+        self.assertEqual(facets.filter(indexes, {}).tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(facets.filter(indexes, {'min_year': 1960}).tolist(), [1, 3])
+        self.assertEqual(facets.filter(indexes, {'min_year': 1950, 'max_year': 1960}).tolist(),
+                         [0, 2])
+        self.assertEqual(facets.filter(indexes, {'director': 'alfred  HITCHCOCK'}).tolist(),
+                         [0, 2, 3])
+        self.assertEqual(facets.filter(indexes, {'actor': 'Kim Novak'}).tolist(), [0, 1, 2])
+        self.assertEqual(facets.filter(indexes, {'actor': 'kim  novak '}).tolist(), [0, 1, 2])
+        self.assertEqual(facets.filter(indexes, {'actor': 'Kim Novak',
+                                                 'director': 'Alfred Hitchcock'}).tolist(),
+                         [0, 2])
+        self.assertEqual(facets.filter(indexes, {'prod_co': 'Warner'}).tolist(), [1])
+        self.assertEqual(facets.filter(indexes, {'actor': 'Nobody'}).tolist(), [])
+        self.assertEqual(facets.filter([3, 1], {'max_year': 2000}).tolist(), [3])
+
+        # Test the counts:
+        counts = facets.counts(indexes)
+        self.assertEqual(counts['year'], [[1958, 2], [1963, 1], [2001, 1]])
+        self.assertEqual(counts['director'], [['Alfred Hitchcock', 3], ['Steven Soderbergh', 1]])
+        # An actor is counted once per location, even if listed twice:
+        self.assertEqual(counts['actor'], [['Kim Novak', 3], ['James Stewart', 2],
+                                           ['George Clooney', 1], ['Tippi Hedren', 1]])
+        self.assertEqual(counts['prod_co'], [['Paramount', 2], ['Warner', 1]])
+        self.assertEqual(facets.counts(indexes, max_names=1)['actor'], [['Kim Novak', 3]])
+        self.assertEqual(facets.counts([]),
+                         {'year': [], 'director': [], 'actor': [], 'prod_co': []})
+
+        # Filtering the radius queries of the store:
+        all_indexes = mdb.get_indexes_by_loc(37.7937, -122.3999, 3000.0)
+        dataset = mdb.Store.dataset()
+        for filters in [{'min_year': 1950, 'max_year': 1969}, {'director': 'Alfred Hitchcock'},
+                        {'actor': 'Clint Eastwood', 'min_year': 1970}]:
+            expected = [i for i in all_indexes if facet_match(dataset, i, filters)]
+            self.assertEqual(mdb.get_indexes_by_loc(37.7937, -122.3999, 3000.0, filters),
+                             expected)
+        counts = mdb.get_facet_counts(all_indexes)
+        self.assertEqual(sum(c for y, c in counts['year']), len(all_indexes))
+
+
+    def test_marker_groups(self):
+        # 0 and 2 are the same point, 3 is 5 ft north of them, 4 is 100 ft north,
+        # and 1 and 5 are the same line segment:
+        ft = np.degrees(1.0 / mdb.Earth_Radius_Ft)
+        columns = mdb.LatColumns([[0, [37.8, -122.4]], [0, [37.8, -122.4, 37.81, -122.4]],
+                                  [0, [37.8, -122.4]], [0, [37.8 + 5*ft, -122.4]],
+                                  [0, [37.8 + 100*ft, -122.4]],
+                                  [0, [37.8, -122.4, 37.81, -122.4]]])
+        groups = mdb.MarkerGroups(columns, 10.0)
+        self.assertEqual(groups.row_groups.tolist(), [0, 1, 0, 0, 2, 1])
+        self.assertEqual(groups.leaders.tolist(), [0, 1, 4])
+        self.assertEqual([groups.members(g).tolist() for g in range(3)], [[0, 2, 3], [1, 5], [4]])
+        self.assertEqual(groups.group([5, 3, 4, 0]), [(1, [5]), (0, [3, 0]), (2, [4])])
+        self.assertEqual(groups.group([]), [])
+        self.assertTrue(groups.matches(columns))
+        self.assertFalse(groups.matches(mdb.LatColumns([[0, [37.8, -122.4]]])))
+        # A tolerance of 0 only groups identical coordinates:
+        groups = mdb.MarkerGroups(columns, 0.0)
+        self.assertEqual(groups.row_groups.tolist(), [0, 1, 0, 2, 3, 1])
+        groups = mdb.MarkerGroups(columns, 200.0)
+        self.assertEqual(groups.row_groups.tolist(), [0, 1, 0, 0, 0, 1])
+
+        # Every location of the data is in one group, within the tolerance of its leader:
+        dataset = mdb.Store.dataset()
+        groups = dataset.marker_groups
+        self.assertEqual(sorted(groups.rows.tolist()), list(range(len(dataset.lat_data))))
+        for i in range(0, len(dataset.lat_data), 5):
+            leader = dataset.lat_data[int(groups.leaders[groups.row_groups[i]])]
+            self.assertTrue(mdb.calc_great_circle_dist(leader[1][0], leader[1][1],
+                                                       dataset.lat_data[i][1][0],
+                                                       dataset.lat_data[i][1][1])
+                            <= groups.tolerance_ft)
+
+        # The records of the groups of a query:
+        indexes = mdb.get_indexes_by_loc(37.7937, -122.3999, 3000.0)
+        records = mdb.get_groups_by_indexes(indexes)
+        self.assertTrue(len(records) < len(indexes))
+        members = groups.group(indexes)
+        self.assertEqual(len(records), len(members))
+        for (latlngs, locs), (group, group_indexes) in zip(records, members):
+            self.assertEqual(latlngs, dataset.lat_data[int(groups.leaders[group])][1])
+            self.assertEqual(locs, [loc[:3] for loc in mdb.get_locs_by_indexes(group_indexes)])
+        self.assertEqual(sum(len(locs) for latlngs, locs in records), len(indexes))
+
+
+    def test_dataset_search_index(self):
+        # A prebuilt search index is only used for the data it was built from;
+        # an index for other text, with the same rows and keys, is rebuilt:
+        dataset = mdb.Store.dataset()
+        lat_data = [list(loc) for loc in dataset.lat_data]
+        index = mdb.InvertedIndex(dataset.movie_data, lat_data)
+        self.assertTrue(mdb.MovieDataset(dataset.movie_data, dataset.loc_data, lat_data,
+                                         search_index=index).search_index is index)
+        lat_data[0][3] = 'Zyzzyva Point'
+        changed = mdb.MovieDataset(dataset.movie_data, dataset.loc_data, lat_data,
+                                   search_index=index)
+        self.assertFalse(changed.search_index is index)
+        self.assertEqual(changed.search_index.lookup('zyzzyva')['indexes'], [0])
+
+
+
+
+
+def scalar_dist(lat, lng, latlngs):
+    """
+    Output: the distance from lat, lng to a point or line segment of lat_data,
+            computed one location at a time.
+    """
+    if len(latlngs) == 4:
+        return mdb.calc_segment_dist(lat, lng, latlngs[0], latlngs[1], latlngs[2], latlngs[3])
+    return mdb.calc_great_circle_dist(lat, lng, latlngs[0], latlngs[1])
+
+
+
+def facet_match(dataset, i, filters):
+    """
+    Output: whether the movie of lat_data[i] passes the filters, checked on movie_data.
+    """
+    info = dataset.movie_data[dataset.lat_data[i][2]]
+    year = int(info['year'])
+    return ((year >= filters.get('min_year', year)) and (year <= filters.get('max_year', year))
+            and (info['director'] == filters.get('director', info['director']))
+            and (('actor' not in filters) or
+                 (filters['actor'] in [info['actor1'], info['actor2'], info['actor3']])))
+
+
+
+def segment_in_box(latlngs, min_lat, max_lat, min_lng, max_lng):
+    """
+    Output: True if the point, or some part of the line segment, is in the box.
+            The segment is checked by sampling many points along it.
+    """
+    lat1, lng1 = latlngs[0], latlngs[1]
+    lat2, lng2 = latlngs[-2], latlngs[-1]
+    for i in range(1001):
+        t = i / 1000.0
+        lat, lng = lat1 + t*(lat2 - lat1), lng1 + t*(lng2 - lng1)
+        if (min_lat <= lat <= max_lat) and (min_lng <= lng <= max_lng):
+            return True
+    return False
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,352 @@
+"""
+File: parser_benchmark.py
+
+Desc: Times the location parser in location_parser.py against the parser it
+replaced, on the location descriptions in the DataSF CSV file, and checks
+that the two give byte-for-byte the same output.
+
+Usage: python parser_benchmark.py [CSV file] [number of repeats]
+
+The workload is the parsing done while preprocessing: each description is
+parsed when finding the locations to geocode, when rating them, and when
+looking up their lat-lngs.  The functions named legacy_* below are the
+earlier parser, kept unchanged as the reference.
+"""
+
+import re
+import sys
+import time
+import location_parser
+import preprocess_data
+
+
+
+def workload(descs, parse_base, parse_single_rated):
+    """
+    Input: a list of raw location descriptions; and the parse_location_base()
+           and parse_location_single_rated() functions to use.
+    Output: a list of the parsed results, one line of text per description.
+    """
+    lines = []
+    for desc in descs:
+        base = parse_base(desc)
+        rated = None
+        if (desc != '') and (type(base) != tuple):
+            rated = parse_single_rated(desc)
+        base2 = parse_base(desc)
+        lines.append(repr((desc, base, rated, base2)))
+    return lines
+
+
+
+def run(filename, repeats=5):
+    """
+    Input: the CSV file of movie locations, and the number of times to time each parser.
+    Output: a dictionary of the best times (in seconds) of the legacy parser,
+            of the new parser with an empty cache, and of the new parser with
+            its cache filled; the speedup; and whether the outputs are identical.
+    """
+    descs = [row[2] for row in preprocess_data.load_csv(filename)]
+    #
+    legacy_time = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        legacy_lines = workload(descs, legacy_parse_location_base,
+                                legacy_parse_location_single_rated)
+        t = time.perf_counter() - start
+        legacy_time = t if legacy_time is None else min(legacy_time, t)
+    #
+    new_time = None
+    for i in range(repeats):
+        location_parser.clear_cache()
+        start = time.perf_counter()
+        new_lines = workload(descs, location_parser.parse_location_base,
+                             location_parser.parse_location_single_rated)
+        t = time.perf_counter() - start
+        new_time = t if new_time is None else min(new_time, t)
+    #
+    start = time.perf_counter()
+    cached_lines = workload(descs, location_parser.parse_location_base,
+                            location_parser.parse_location_single_rated)
+    cached_time = time.perf_counter() - start
+    #
+    legacy_bytes = '\n'.join(legacy_lines).encode('utf-8')
+    identical = ((legacy_bytes == '\n'.join(new_lines).encode('utf-8')) and
+                 (legacy_bytes == '\n'.join(cached_lines).encode('utf-8')))
+    return {'descriptions':len(descs), 'legacy':legacy_time, 'new':new_time,
+            'cached':cached_time, 'speedup':legacy_time / new_time, 'identical':identical}
+
+
+
+########################################################
+
+# The parser replaced by location_parser.py:
+
+def legacy_clean_location(loc):
+    """
+    Input: a location description string that has been parsed.
+    Output: this same string cleaned up in a couple of ways:
+     - whitespace is trimmed
+     - '&' is replaced by 'and'
+     - text such as, 'near', "off of', is dropped
+    """
+    if not loc:
+        return loc
+    #
+    loc = loc.strip()
+    res = re.search(r"^and ([\w .&']+)", loc, re.IGNORECASE)
+    if res:
+        loc = res.group(1)
+    #
+    res = re.search(r"^at ([\w .&']+)", loc, re.IGNORECASE)
+    if res:
+        loc = res.group(1)
+    #
+    res = re.search(r"^near ([\w .&']+)", loc, re.IGNORECASE)
+    if res:
+        loc = res.group(1)
+    #
+    res = re.search(r"^off of ([\w .&']+)", loc, re.IGNORECASE)
+    if res:
+        loc = res.group(1)
+    #
+    res = re.search(r"^off ([\w .&']+)", loc, re.IGNORECASE)
+    if res:
+        loc = res.group(1)
+    #
+    res = re.search(r"^Intersection of ([\w .&']+)", loc, re.IGNORECASE)
+    if res:
+        loc = res.group(1)
+    #
+    res = re.search(r"^corner of ([\w .&']+)", loc, re.IGNORECASE)
+    if res:
+        loc = res.group(1)
+    #
+    loc = loc.replace('&', 'and')
+    return loc
+
+
+
+def legacy_parse_simple_street(loc):
+    """
+    Input: A string containing a description of a location, eg '123 Pine St',
+           after some preprocessing has been done to split out text enclosed
+           in parentheses.
+    Output:
+      o The substring 'Pier[s]', followed by a number, if it is in the input string.
+      o The substring consisting of a number followed by text but not containing commas
+        (eg, '123 Central St') if it is in the input string.  Also, if the number is
+        hyphenated (100-201 Broadway), then the first part of the number and hyphen
+        are not included.
+      o Otherwise returns None.
+    """
+    # Handle Piers first:
+    res = re.search(r'(Piers? [\d /]+)', loc)
+    if res:
+        return legacy_clean_location(res.group(0))
+    # Next, search for '124 X St at Y St', we only want '124 X St':
+    res = re.search(r"-*([\d]+) ([\da-zA-Z\ .']+) at", loc)
+    if not res:
+        # Next, search for '124 X St':
+        res = re.search(r"-*([\d]+) ([\da-zA-Z\ .']+)", loc)
+    if res:
+        addr = res.group(1) + ' ' + res.group(2).strip()
+        return legacy_clean_location(addr)
+    #
+    return legacy_clean_location(res)
+
+
+
+def legacy_parse_intersection(loc):
+    """
+    Input: A string containing a description of a location, eg '123 Pine St'.
+           This is after some preprocessing has been done to split out
+           text enclosed in parentheses.
+    Output:
+      o If this string specifies an intersection of two streets, then
+        return the substring that best specifies this.
+        eg "Pine [at|&] Kearny" is an intersection.
+      o returns None if no intersection is in the string description.
+    Note: this does not handle descriptions which specify a range,
+          such as "X from Y and Z"
+    """
+    res = re.search(r"([\da-zA-Z\ .']+ & [\da-zA-Z\ .']+)", loc)
+    if res:
+        return legacy_clean_location(res.group(0))
+    #
+    res = re.search(r"([\da-zA-Z\ .']+ at [\da-zA-Z\ .']+)", loc)
+    if res:
+        return legacy_clean_location(res.group(0))
+    res = re.search(r"([\da-zA-Z\ .']+ and [\da-zA-Z\ .']+)", loc)
+    if res:
+        return legacy_clean_location(res.group(0))
+    return res  # No success.
+
+
+
+def legacy_parse_location(loc):
+    """
+    Input: A string containing a description of a location, eg '123 Pine St'.
+           This is after some preprocessing has been done to split out
+           text enclosed in parentheses.
+    Output: A pair consisting of: 1. a parsed location; 2. a rating on how
+            much information/accuracy is in this parsed location.
+    """
+    res = legacy_parse_simple_street(loc)
+    if res:
+        return (res, 1)
+    res = legacy_parse_intersection(loc)
+    if res:
+        return (res, 2)
+    # Assume something like landmark name or neighborhood so use entire
+    # description, but assign a low accuracy/confidence score:
+    return (loc, 100)
+
+
+
+def legacy_split_on_parens(loc):
+    """
+    Input: A location description string.
+    Output: It searches the string for a substring in which there is some
+            text followed by more text in parentheses, eg 'aba daba (daba doo)'.
+            and returns ['aba daba', 'daba doo'] in these cases.
+            Otherwise it returns the entire string in a list: 'aba daba' => ['aba daba']
+    Assumes that there is at most one set of ()s.
+    """
+    res = re.search(r'(.+)\((.+)\)', loc)
+    if not res:
+        # This location does not contain ()s, return None
+        return [loc]
+    #
+    return [res.group(1).strip(), res.group(2).strip()]
+    
+
+
+def legacy_parse_location_single(loc):
+    """
+    This function parses a description string to identify a single-point
+    location, as opposed to a location specified by two points.
+    Input: A location description string.
+    Ouput: A parsed string that best specifies the location.
+    """
+    if loc == '':
+        return ''
+    return legacy_parse_location_single_rated(loc)[0]
+
+
+
+def legacy_parse_location_single_rated(loc):
+    """
+    Input: A location description string, which is not empty.
+    Ouput: A pair consisting of: 1. the parsed string that best specifies the
+           location; 2. the rating of that parse (see legacy_parse_location()).
+    """
+    addresses = []
+    locs = legacy_split_on_parens(loc)
+    for l in locs:
+        res = legacy_parse_location(l)
+        if res:
+            addresses.append(res)
+    return min(addresses, key = lambda t: t[1])
+
+
+
+
+def legacy_parse_location_range(loc):
+    """
+    This function looks for and parses descriptions which specify a range.
+    Examples of location ranges which are looked for:
+      o X between Y and Z
+      o X, between Y and Z
+      o .*[,]X between Y and Z
+      o X from Y and Z
+      o X from Y & Z
+      o X from Y to Z
+    Input: A location description string.
+    Output:
+      o A pair or two location strings, if this is in the input,
+          eg: ('X and Y', 'X and Z').
+      o None, if a location range is not described.
+    Note that in the SF-movie-locations dataset the X, Y and Z values tend to be
+    very simple and need no further processing.
+    """
+    res = re.search(r"([\da-zA-Z\ .']+),? between ([\da-zA-Z\ .']+) and ([\da-zA-Z\ .']+)", loc,
+                    re.IGNORECASE)
+    if not res:
+        res = re.search(r"([\da-zA-Z\ .']+),? between ([\da-zA-Z\ .']+) & ([\da-zA-Z\ .']+)", loc,
+                        re.IGNORECASE)
+    if not res:
+        res = re.search(r"([\da-zA-Z\ .']+) from ([\da-zA-Z\ .']+) and ([\da-zA-Z\ .']+)", loc,
+                        re.IGNORECASE)
+    if not res:
+        res = re.search(r"([\da-zA-Z\ .']+) from ([\da-zA-Z\ .']+) & ([\da-zA-Z\ .']+)", loc,
+                        re.IGNORECASE)
+    if not res:
+        res = re.search(r"([\da-zA-Z\ .']+) from ([\da-zA-Z\ .']+) to ([\da-zA-Z\ .']+)", loc,
+                        re.IGNORECASE)
+    if not res:
+        res = re.search(r"([\da-zA-Z\ .']+) at ([\da-zA-Z\ .']+) and ([\da-zA-Z\ .']+)", loc,
+                        re.IGNORECASE)
+    if not res:
+        res = re.search(r"([\da-zA-Z\ .']+) at ([\da-zA-Z\ .']+) & ([\da-zA-Z\ .']+)", loc,
+                        re.IGNORECASE)
+    #
+    if not res:
+        return res
+    #
+    loc1 = legacy_clean_location(res.group(1))
+    loc2 = legacy_clean_location(res.group(2))
+    loc3 = legacy_clean_location(res.group(3))
+    #
+    return ('{} and {}'.format(loc1, loc2),
+            '{} and {}'.format(loc1, loc3))
+
+
+
+def legacy_parse_location_base(loc):
+    """
+    Desc: Takes a raw location descriptions and returns a parsed location.
+    Input: A raw location description, as read from the data source.
+    Output: A parsed locations suitable for sending to a geocoder.
+            This may be a single parsed-location (indicating a specific
+            location), or a pair of parsed-locations (indicating a range).
+    """
+    # First test that loc contains text:
+    if loc == '':
+        return ''  # If no location text => return an empty string.
+    # Next, check if loc parses to a street range:
+    res = legacy_parse_location_range(loc)
+    if res:
+        return res
+    # Default case, parse loc as a specific/single spot:
+    return legacy_parse_location_single(loc)
+
+
+def legacy_parse_locations(locations):
+    """
+    Desc: Takes a list of raw location descriptions and returns a list
+          of parsed locations.
+    Input: A list of location descriptions, as read from the data source.
+    Output: A list of parsed locations suitable for sending to a geocoder.
+            Each item may be a single parsed-location (indicating a specific
+            location), or a pair of parsed-locations (indicating a range).
+    """
+    return [legacy_parse_location_base(loc) for loc in locations]
+
+
+
+if __name__ == '__main__':
+    filename = preprocess_data.Raw_Movie_Data
+    repeats = 5
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    if len(sys.argv) > 2:
+        repeats = int(sys.argv[2])
+    res = run(filename, repeats)
+    print('{} location descriptions, best of {} runs:'.format(res['descriptions'], repeats))
+    print('  legacy parser:        {:.4f} s'.format(res['legacy']))
+    print('  new parser:           {:.4f} s ({:.1f}x faster)'.format(res['new'], res['speedup']))
+    print('  new parser (cached):  {:.4f} s'.format(res['cached']))
+    print('  identical output:     {}'.format(res['identical']))
+    if not res['identical']:
+        sys.exit(1)
@@ -11,15 +11,60 @@ https://geopy.readthedocs.org/en/1.6.0/#module-geopy.geocoders
 
 """
 
+import argparse
+import collections
 import copy
 import csv
-import re
+import hashlib
+import os
 import pickle
+import time
 import geopy
+import geocode
+import lat_data_file
+import location_parser
+import movie_db
+import search_index
+# The functions for parsing a location description are in location_parser.py:
+from location_parser import (clean_location, parse_simple_street, parse_intersection,
+                             parse_location, split_on_parens, parse_location_single,
+                             parse_location_single_rated, parse_location_range,
+                             parse_location_base, parse_locations)
 
 Default_Location = (37.76526, -122.44388)
 
 Raw_Movie_Data = 'data/film_locations_sf.csv'
+Num_Columns = 11  # The number of columns in the CSV file.
+
+# Geocoding settings: the text added to each location to make a query,
+# the maximum queries per second for each provider, and the database in
+# which results are cached, along with how long they are kept for.
+Geocode_Suffix = ', San Francisco, CA'
+Geocoder_US_Rate = 1.0
+Google_Rate = 5.0
+Geocode_Cache = 'geocode_cache.db'
+Geocode_Cache_TTL = 180 * 24 * 60 * 60  # Re-geocode after 180 days (in seconds).
+
+# The manifest of the last build, used for incremental builds:
+Build_Manifest = 'build_manifest.p'
+
+
+def read_csv(filename):
+    """
+    Input: The filename for a CSV file.
+    Output: A generator of the rows of the CSV file except the first one.
+            The file is closed once all of the rows have been read.
+    Note: it assumes the first row is a list of titles and does not include this.
+    """
+    with open(filename, newline='') as file:
+        reader = csv.reader(file, delimiter=',')
+        #
+        # First row is column titles:
+        next(reader, None)
+        #
+        for row in reader:
+            yield row
+
 
 
 def load_csv(filename):
@@ -29,18 +74,32 @@ def load_csv(filename):
     This function reads a CSV file and returns the data rows as a list.
     Note: it assumes the first row is a list of titles and does not include this.
     """
-    # reader = csv.reader(open(filename, newline=''), delimiter=',')
-    file = open(filename, newline='')
-    reader = csv.reader(file, delimiter=',')
-    #
-    # First row is column titles:
-    row = next(reader)
-    #
-    data = []
-    for row in reader:
-        data.append(row)
-    file.close()
-    return data
+    return list(read_csv(filename))
+
+
+
+def normalize_rows(rows):
+    """
+    Input: An iterable of rows from the DataSF CSV file.
+    Output: A generator of the rows, skipping blank lines and padding rows
+            which are missing their last columns with empty strings.
+    """
+    for row in rows:
+        if not row:
+            continue
+        if len(row) < Num_Columns:
+            row = row + [''] * (Num_Columns - len(row))
+        yield row
+
+
+
+def key_rows(rows):
+    """
+    Input: An iterable of rows from the DataSF CSV file.
+    Output: A generator of (movie-key, row) pairs.
+    """
+    for row in rows:
+        yield make_key(row[0].strip(), row[1]), row
 
 
 
@@ -51,15 +110,35 @@ def write_movie_keys(movie_keys, ofilename):
     This function takes a list of movie names and writes it to a file
     formatted for including in the website as a Javascript variable.
     """
-    file = open(ofilename, "w")
-    file.write('<script>\n');
-    file.write('   Movie_Keys = [\n');
-    if len(movie_keys) > 0:
-        for i in range(0, len(movie_keys)-1):
-            file.write('            "{}",\n'.format(movie_keys[i]))
-        file.write('            "{}"\n'.format(movie_keys[-1]))
-    file.write('          ];\n');
-    file.write('</script>\n');
+    with open(ofilename, "w") as file:
+        file.write('<script>\n');
+        file.write('   Movie_Keys = [\n');
+        if len(movie_keys) > 0:
+            for i in range(0, len(movie_keys)-1):
+                file.write('            "{}",\n'.format(movie_keys[i]))
+            file.write('            "{}"\n'.format(movie_keys[-1]))
+        file.write('          ];\n');
+        file.write('</script>\n');
+
+
+
+def load_pickle(filename):
+    """
+    Output: the object pickled in the file.
+    """
+    with open(filename, "rb") as file:
+        return pickle.load(file)
+
+
+
+def dump_pickle(obj, filename):
+    """
+    Desc: Pickles an object to a file.  The file is replaced rather than
+          rewritten in place, so a website reloading it never reads a
+          half-written file (see lat_data_file.open_for_replace()).
+    """
+    with lat_data_file.open_for_replace(filename) as file:
+        pickle.dump(obj, file)
 
 
 
@@ -76,7 +155,7 @@ def make_key(title, year):
 
 def create_movie_data(raw_data):
     """
-    Input: A list of rows from the DataSF CSV file.
+    Input: A list, or any iterable, of rows from the DataSF CSV file.
     Output: A structured data-structure for searching.
     Format:
       o Top layer is a dictionary on movie names
@@ -84,11 +163,21 @@ def create_movie_data(raw_data):
         1. movie information: general info on this movie
         2. a list of movie locations
     """
+    return group_rows(key_rows(normalize_rows(raw_data)))
+
+
+
+def group_rows(keyed_rows):
+    """
+    Input: An iterable of (movie-key, row) pairs, from key_rows().
+    Output: The dictionaries of movie information and of movie locations,
+            as for create_movie_data().  The rows are used one at a time,
+            so they can be streamed from the CSV file.
+    """
     movies_db = dict()
     locations_db = dict()
     #
-    for row in raw_data:
-        movie_key = make_key(row[0].strip(), row[1])
+    for movie_key, row in keyed_rows:
         if not movie_key in movies_db:
             movie_data = {'title':row[0],
                           'year':row[1],
@@ -127,6 +216,28 @@ def extract_loc_descs(loc_data):
     return sorted(list(set(loc_descs)))
 
 
+def extract_loc_confidences(loc_data):
+    """
+    Input: loc_data; A dictionary of {'movie-key', [List of location descriptions]}
+    Output: A dictionary mapping each parsed location description to the rating
+            of its parse (see parse_location()), where lower is more accurate.
+            The two ends of a range are intersections, and are rated as such.
+    """
+    confidences = {}
+    for key in loc_data:
+        for loc in loc_data[key]:
+            if loc[0] == '':
+                continue
+            res = parse_location_base(loc[0])
+            if type(res) == tuple:
+                rated = [(res[0], 2), (res[1], 2)]
+            else:
+                rated = [parse_location_single_rated(loc[0])]
+            for parsed, rating in rated:
+                confidences[parsed] = min(rating, confidences.get(parsed, rating))
+    return confidences
+
+
 def insert_latlng_data(loc_data, latlng_data):
     """
     Input:
@@ -138,15 +249,25 @@ def insert_latlng_data(loc_data, latlng_data):
     loc_keys = list(loc_data.keys())
     for key in loc_keys:
         for loc in loc_data[key]:
-            res = parse_location_base(loc[0])
-            if type(res) == tuple:
-                latlng1 = latlng_data[res[0]]
-                latlng2 = latlng_data[res[1]]
-                loc.append([latlng1[0], latlng1[1], latlng2[0], latlng2[1]])
-            else:
-                latlng = latlng_data[res]
-                loc.append([latlng[0], latlng[1]])
-            
+            loc.append(find_loc_latlngs(loc[0], latlng_data))
+
+
+def find_loc_latlngs(loc_desc, latlng_data):
+    """
+    Input:
+    o loc_desc: a raw location description.
+    o latlng_data: a dictionary mapping parsed location descriptions to lat-long values.
+    Output:
+    o the lat-long values of this location: [lat, lng] for a single location,
+      or [lat1, lng1, lat2, lng2] for a range.
+    """
+    res = parse_location_base(loc_desc)
+    if type(res) == tuple:
+        latlng1 = latlng_data[res[0]]
+        latlng2 = latlng_data[res[1]]
+        return [latlng1[0], latlng1[1], latlng2[0], latlng2[1]]
+    latlng = latlng_data[res]
+    return [latlng[0], latlng[1]]
 
 
 
@@ -171,257 +292,170 @@ def sort_loc_by_lats(loc_data):
 
 ########################################################
 
-# The following functions are for parsing a location description:
+# The following functions are for building the data files, either from
+# scratch or incrementally, by patching the files from a previous build:
 
-def clean_location(loc):
+def fingerprint_row(row):
     """
-    Input: a location description string that has been parsed.
-    Output: this same string cleaned up in a couple of ways:
-     - whitespace is trimmed
-     - '&' is replaced by 'and'
-     - text such as, 'near', "off of', is dropped
+    Input: a row from the DataSF CSV file.
+    Output: a hash of the contents of the row.
     """
-    if not loc:
-        return loc
-    #
-    loc = loc.strip()
-    res = re.search('^and ([\w .&\']+)', loc, re.IGNORECASE)
-    if res:
-        loc = res.group(1)
-    #
-    res = re.search('^at ([\w .&\']+)', loc, re.IGNORECASE)
-    if res:
-        loc = res.group(1)
-    #
-    res = re.search('^near ([\w .&\']+)', loc, re.IGNORECASE)
-    if res:
-        loc = res.group(1)
-    #
-    res = re.search('^off of ([\w .&\']+)', loc, re.IGNORECASE)
-    if res:
-        loc = res.group(1)
-    #
-    res = re.search('^off ([\w .&\']+)', loc, re.IGNORECASE)
-    if res:
-        loc = res.group(1)
-    #
-    res = re.search('^Intersection of ([\w .&\']+)', loc, re.IGNORECASE)
-    if res:
-        loc = res.group(1)
-    #
-    res = re.search('^corner of ([\w .&\']+)', loc, re.IGNORECASE)
-    if res:
-        loc = res.group(1)
-    #
-    loc = loc.replace('&', 'and')
-    return loc
-
+    return hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest()
 
 
-def parse_simple_street(loc):
+def fingerprint_file(filename):
     """
-    Input: A string containing a description of a location, eg '123 Pine St',
-           after some preprocessing has been done to split out text enclosed
-           in parentheses.
-    Output:
-      o The substring 'Pier[s]', followed by a number, if it is in the input string.
-      o The substring consisting of a number followed by text but not containing commas
-        (eg, '123 Central St') if it is in the input string.  Also, if the number is
-        hyphenated (100-201 Broadway), then the first part of the number and hyphen
-        are not included.
-      o Otherwise returns None.
-    """
-    # print('parse_simple_street({})'.format(loc))
-    # Handle Piers first:
-    res = re.search('(Piers? [\d /]+)', loc)
-    if res:
-        return clean_location(res.group(0))
-    # Next, search for '124 X St at Y St', we only want '124 X St':
-    res = re.search('-*([\d]+) ([\da-zA-Z\ .\']+) at', loc)
-    if not res:
-        # Next, search for '124 X St':
-        res = re.search('-*([\d]+) ([\da-zA-Z\ .\']+)', loc)
-    if res:
-        addr = res.group(1) + ' ' + res.group(2).strip()
-        return clean_location(addr)
-    #
-    return clean_location(res)
-
-
-
-def parse_intersection(loc):
+    Input: a filename.
+    Output: a hash of the contents of the file.
     """
-    Input: A string containing a description of a location, eg '123 Pine St'.
-           This is after some preprocessing has been done to split out
-           text enclosed in parentheses.
-    Output:
-      o If this string specifies an intersection of two streets, then
-        return the substring that best specifies this.
-        eg "Pine [at|&] Kearny" is an intersection.
-      o returns None if no intersection is in the string description.
-    Note: this does not handle descriptions which specify a range,
-          such as "X from Y and Z"
-    """
-    res = re.search('([\da-zA-Z\ .\']+ & [\da-zA-Z\ .\']+)', loc)
-    if res:
-        return clean_location(res.group(0))
-    #
-    res = re.search('([\da-zA-Z\ .\']+ at [\da-zA-Z\ .\']+)', loc)
-    if res:
-        return clean_location(res.group(0))
-    res = re.search('([\da-zA-Z\ .\']+ and [\da-zA-Z\ .\']+)', loc)
-    if res:
-        return clean_location(res.group(0))
-    return res  # No success.
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 16), b''):
+            sha.update(block)
+    return sha.hexdigest()
 
 
-
-def parse_location(loc):
-    """
-    Input: A string containing a description of a location, eg '123 Pine St'.
-           This is after some preprocessing has been done to split out
-           text enclosed in parentheses.
-    Output: A pair consisting of: 1. a parsed location; 2. a rating on how
-            much information/accuracy is in this parsed location.
+def build_data(raw_data, find_latlngs, workers=1):
     """
-    res = parse_simple_street(loc)
-    if res:
-        return (res, 1)
-    res = parse_intersection(loc)
-    if res:
-        return (res, 2)
-    # Assume something like landmark name or neighborhood so use entire
-    # description, but assign a low accuracy/confidence score:
-    return (loc, 100)
-
+    Desc: Builds all of the data structures from the CSV rows.
+    Input:
+    o raw_data: A list, or any iterable, of rows from the DataSF CSV file,
+      eg read_csv().  The rows are only read once, one at a time.
+    o find_latlngs: a function which takes a loc_data dictionary (see
+      create_movie_data()) and returns a dictionary mapping each parsed
+      location description in it to its lat-lng, eg by geocoding them.
+    o workers: the number of worker processes used to parse the location
+      descriptions (see location_parser.parse_distinct()).
+    Output: A tuple of (movie_data, loc_data, lat_data, manifest), where
+            loc_data includes the lat-lngs of its locations and the manifest
+            is used for later incremental builds (see make_manifest()).
+    """
+    row_keys = []
+    def fingerprint(keyed_rows):
+        for movie_key, row in keyed_rows:
+            row_keys.append((fingerprint_row(row), movie_key))
+            yield movie_key, row
+    movie_data, loc_data = group_rows(fingerprint(key_rows(normalize_rows(raw_data))))
+    location_parser.parse_distinct([loc[0] for key in loc_data for loc in loc_data[key]],
+                                   workers)
+    loc_latlngs = find_latlngs(loc_data)
+    loc_data2 = copy.deepcopy(loc_data)
+    insert_latlng_data(loc_data2, loc_latlngs)
+    lat_data = sort_loc_by_lats(loc_data2)
+    return movie_data, loc_data2, lat_data, make_manifest(row_keys, loc_data2)
 
 
-def split_on_parens(loc):
-    """
-    Input: A location description string.
-    Output: It searches the string for a substring in which there is some
-            text followed by more text in parentheses, eg 'aba daba (daba doo)'.
-            and returns ['aba daba', 'daba doo'] in these cases.
-            Otherwise it returns the entire string in a list: 'aba daba' => ['aba daba']
-    Assumes that there is at most one set of ()s.
+def make_manifest(row_keys, loc_data):
     """
-    res = re.search('(.+)\((.+)\)', loc)
-    if not res:
-        # This location does not contain ()s, return None
-        return [loc]
+    Input:
+    o row_keys: A list of the (fingerprint, movie-key) of each row of the
+      DataSF CSV file, in order.
+    o loc_data: The loc_data dictionary built from these rows, including lat-lngs.
+    Output: A manifest of the build, which is a dictionary of:
+    o 'rows': the fingerprint of each row, in order.
+    o 'entries': a dictionary mapping each fingerprint to the movie key and the
+      loc_data entry, [location description, fun fact, lat-lngs], of that row.
+    """
+    rows = []
+    entries = {}
+    next_loc = dict((key, 0) for key in loc_data)
+    for fp, movie_key in row_keys:
+        rows.append(fp)
+        # The entries for each movie in loc_data are in the order of its rows:
+        entries[fp] = [movie_key, loc_data[movie_key][next_loc[movie_key]]]
+        next_loc[movie_key] += 1
+    return {'rows':rows, 'entries':entries}
+
+
+def merge_by_lat(lat_data1, lat_data2):
+    """
+    Input: two lists of lat_data entries, each sorted on lat.
+    Output: a single list of all of the entries, sorted on lat.
+    """
+    merged = []
+    i, j = 0, 0
+    while (i < len(lat_data1)) and (j < len(lat_data2)):
+        if lat_data2[j][0] < lat_data1[i][0]:
+            merged.append(lat_data2[j])
+            j += 1
+        else:
+            merged.append(lat_data1[i])
+            i += 1
+    merged.extend(lat_data1[i:])
+    merged.extend(lat_data2[j:])
+    return merged
+
+
+def incremental_build(raw_data, manifest, movie_data, loc_data, lat_data, find_latlngs,
+                      workers=1):
+    """
+    Desc: Updates the data structures from a previous build to match the current
+          CSV rows.  Only the rows which are new or have changed since that build
+          are parsed and geocoded, and only the movies with new, changed or
+          removed rows are updated.  New entries are merged into lat_data
+          rather than re-sorting it.
+    Input:
+    o raw_data: A list of rows from the DataSF CSV file.
+    o manifest, movie_data, loc_data, lat_data: the results of the previous build.
+    o find_latlngs: as for build_data(); it is only given the new rows.
+    o workers: as for build_data().
+    Output: A tuple of (movie_data, loc_data, lat_data, manifest) for the
+            current rows.  The previous data structures are not modified.
+    Note: The result is the same as build_data(), except that lat_data entries
+          with the same lat may be in a different order.
+    """
+    raw_data = list(normalize_rows(raw_data))
+    entries = manifest['entries']
+    fingerprints = [fingerprint_row(row) for row in raw_data]
     #
-    return [res.group(1).strip(), res.group(2).strip()]
-    
-
-
-def parse_location_single(loc):
-    """
-    This function parses a description string to identify a single-point
-    location, as opposed to a location specified by two points.
-    Input: A location description string.
-    Ouput: A parsed string that best specifies the location.
-    """
-    if loc == '':
-        return ''
-    # print('parse_locations_single({})'.format(loc))
-    addresses = []
-    locs = split_on_parens(loc)
-    for l in locs:
-        res = parse_location(l)
-        if res:
-            addresses.append(res)
-    best_loc = min(addresses, key = lambda t: t[1])
-    return best_loc[0]
-
-
-
-
-def parse_location_range(loc):
-    """
-    This function looks for and parses descriptions which specify a range.
-    Examples of location ranges which are looked for:
-      o X between Y and Z
-      o X, between Y and Z
-      o .*[,]X between Y and Z
-      o X from Y and Z
-      o X from Y & Z
-      o X from Y to Z
-    Input: A location description string.
-    Output:
-      o A pair or two location strings, if this is in the input,
-          eg: ('X and Y', 'X and Z').
-      o None, if a location range is not described.
-    Note that in the SF-movie-locations dataset the X, Y and Z values tend to be
-    very simple and need no further processing.
-    """
-    res = re.search('([\da-zA-Z\ .\']+),? between ([\da-zA-Z\ .\']+) and ([\da-zA-Z\ .\']+)', loc,
-                    re.IGNORECASE)
-    if not res:
-        res = re.search('([\da-zA-Z\ .\']+),? between ([\da-zA-Z\ .\']+) & ([\da-zA-Z\ .\']+)', loc,
-                        re.IGNORECASE)
-    if not res:
-        res = re.search('([\da-zA-Z\ .\']+) from ([\da-zA-Z\ .\']+) and ([\da-zA-Z\ .\']+)', loc,
-                        re.IGNORECASE)
-    if not res:
-        res = re.search('([\da-zA-Z\ .\']+) from ([\da-zA-Z\ .\']+) & ([\da-zA-Z\ .\']+)', loc,
-                        re.IGNORECASE)
-    if not res:
-        res = re.search('([\da-zA-Z\ .\']+) from ([\da-zA-Z\ .\']+) to ([\da-zA-Z\ .\']+)', loc,
-                        re.IGNORECASE)
-    if not res:
-        res = re.search('([\da-zA-Z\ .\']+) at ([\da-zA-Z\ .\']+) and ([\da-zA-Z\ .\']+)', loc,
-                        re.IGNORECASE)
-    if not res:
-        res = re.search('([\da-zA-Z\ .\']+) at ([\da-zA-Z\ .\']+) & ([\da-zA-Z\ .\']+)', loc,
-                        re.IGNORECASE)
+    # Parse and geocode the new rows:
+    new_rows = []
+    new_fps = set()
+    for fp, row in zip(fingerprints, raw_data):
+        if (not fp in entries) and (not fp in new_fps):
+            new_fps.add(fp)
+            new_rows.append(row)
+    location_parser.parse_distinct([row[2] for row in new_rows], workers)
+    new_movie_data, new_loc_data = create_movie_data(new_rows)
+    new_latlngs = {}
+    if new_rows:
+        new_latlngs = find_latlngs(new_loc_data)
+    entries = dict((fp, entries[fp]) for fp in set(fingerprints) if fp in entries)
+    for fp, row in zip(fingerprints, raw_data):
+        if (fp in new_fps) and (not fp in entries):
+            loc = [row[2], row[3], find_loc_latlngs(row[2], new_latlngs)]
+            entries[fp] = [make_key(row[0].strip(), row[1]), loc]
     #
-    if not res:
-        return res
+    # The movies which have had rows added or removed:
+    old_counts = collections.Counter(manifest['rows'])
+    new_counts = collections.Counter(fingerprints)
+    changed_fps = (old_counts - new_counts) + (new_counts - old_counts)
+    changed_keys = set(manifest['entries'][fp][0] for fp in changed_fps
+                       if fp in manifest['entries'])
+    changed_keys.update(entries[fp][0] for fp in changed_fps if fp in entries)
     #
-    loc1 = clean_location(res.group(1))
-    loc2 = clean_location(res.group(2))
-    loc3 = clean_location(res.group(3))
+    # Rebuild the movie_data and loc_data entries of these movies:
+    movie_data = dict(movie_data)
+    loc_data = dict(loc_data)
+    for key in changed_keys:
+        movie_data.pop(key, None)
+        loc_data.pop(key, None)
+    for fp, row in zip(fingerprints, raw_data):
+        key, loc = entries[fp]
+        if not key in changed_keys:
+            continue
+        if not key in movie_data:
+            movie_data[key] = create_movie_data([row])[0][key]
+            loc_data[key] = []
+        loc_data[key].append(loc)
     #
-    return ('{} and {}'.format(loc1, loc2),
-            '{} and {}'.format(loc1, loc3))
-
-
-
-def parse_location_base(loc):
-    """
-    Desc: Takes a raw location descriptions and returns a parsed location.
-    Input: A raw location description, as read from the data source.
-    Output: A parsed locations suitable for sending to a geocoder.
-            This may be a single parsed-location (indicating a specific
-            location), or a pair of parsed-locations (indicating a range).
-    """
-    # First test that loc contains text:
-    if loc == '':
-        return ''  # If no location text => return an empty string.
-    # Next, check if loc parses to a street range:
-    res = parse_location_range(loc)
-    if res:
-        return res
-    # Default case, parse loc as a specific/single spot:
-    return parse_location_single(loc)
-
-
-def parse_locations(locations):
-    """
-    Desc: Takes a list of raw location descriptions and returns a list
-          of parsed locations.
-    Input: A list of location descriptions, as read from the data source.
-    Output: A list of parsed locations suitable for sending to a geocoder.
-            Each item may be a single parsed-location (indicating a specific
-            location), or a pair of parsed-locations (indicating a range).
-    """
-    return [parse_location_base(loc) for loc in locations]
-
-
-
-# End of functions for parsing a location description.
+    # Patch lat_data: drop the entries of these movies, then merge in their new ones:
+    kept = [e for e in lat_data if not e[2] in changed_keys]
+    changed_loc_data = dict((key, loc_data[key]) for key in changed_keys if key in loc_data)
+    lat_data = merge_by_lat(kept, sort_loc_by_lats(changed_loc_data))
+    #
+    return movie_data, loc_data, lat_data, {'rows':fingerprints, 'entries':entries}
 
-################################################################
 
 
 def parse_locations_to_file(locations, dest_fname):
@@ -429,12 +463,11 @@ def parse_locations_to_file(locations, dest_fname):
     Desc: Takes a list of raw location descriptions, parses them, and writes the list to file.
     This was used in testing and development.
     """
-    file = open(dest_fname, "w")
-    for loc in locations:
-        res = parse_location_base(loc)
-        print('parse_locations() {} => {}'.format(loc, res))
-        file.write('[{}] => [{}] (conf:{})\n'.format(loc, res[0], res[1]))
-    file.close()
+    with open(dest_fname, "w") as file:
+        for loc in locations:
+            res = parse_location_base(loc)
+            print('parse_locations() {} => {}'.format(loc, res))
+            file.write('[{}] => [{}] (conf:{})\n'.format(loc, res[0], res[1]))
 
 
 
@@ -442,93 +475,403 @@ def write_list(l, fname):
     """
     Desc: Writes a list to a file, with each list-element on its own line.
     """
-    file = open(fname, "w")
-    for item in l:
-        file.write('{}\n'.format(item))
-    file.close()
+    with open(fname, "w") as file:
+        for item in l:
+            file.write('{}\n'.format(item))
     
 
 
-def get_latlng(addr):
+def make_providers():
+    """
+    Desc: Creates the geocoding providers to use, in the order to try them.
+          It uses the GeoPy library, and from testing, geocoder.us and Google
+          did the best job.
+    Output: A list of geocode.Provider objects.
+    """
+    # geolocators = [geopy.geocoders.OpenMapQuest(format_string='%s'), geopy.geocoders.Yandex(),
+    #   geopy.geocoders.Nominatim()]
+    return [geocode.Provider('geocoder.us', geopy.geocoders.GeocoderDotUS(), Geocoder_US_Rate),
+            geocode.Provider('google', geopy.geocoders.GoogleV3(), Google_Rate)]
+
+
+
+def get_latlng(addr, providers=None):
     """
     Desc: Gets the lag-lng values for a location string.
-          It uses the GeoPy library and tries multiple geocoders to get a location.
+          It tries multiple geocoders to get a location.
           The first successful result is used.
-    Input: A parsed location string.
+    Input: A parsed location string; and optionally, the geocoding providers
+           to use (see make_providers()).
     Output: A lat-lng pair.
     """
     if addr == '':
         return Default_Location
-    addr = addr + ', San Francisco, CA'
-    # geolocator = geopy.geocoders.Nominatim()
-    # geolocators = [geopy.geocoders.OpenMapQuest(format_string='%s'), geopy.geocoders.Yandex(),
-    #   geopy.geocoders.GoogleV3(), geopy.geocoders.GeocoderDotUS()]
-    geolocators = [geopy.geocoders.GeocoderDotUS(), geopy.geocoders.GoogleV3()]
-    for geoloc in geolocators:
-        try:
-            res = geoloc.geocode(addr)
-            if res:
-                return res[1]
-        except Exception as e:
-            print(e)
+    if providers is None:
+        providers = make_providers()
+    latlng, provider_name = geocode.geocode_one(addr + Geocode_Suffix, providers)
+    if latlng:
+        return latlng
     return Default_Location
 
 
-def get_latlngs(locs):
+def get_latlngs(locs, cache=None, workers=4, providers=None, confidences=None):
     """
     Desc: finds the lat-lng values for a list of parsed location/address strings
-          using a geocoder.
-    Input: A list of parsed addresses.
+          using a geocoder.  Locations are geocoded concurrently.  If a cache
+          (a geocode.GeocodeCache, or a geocode.Checkpoint) is given, only the
+          locations missing from it are geocoded, and their results are saved
+          to it as they arrive.
+    Input: A list of parsed addresses; the cache; the number of worker threads;
+           the geocoding providers to use (see make_providers()); and a
+           dictionary of the confidence score of each address.
     Output: A dictionary mapping from address=>lat-lng values.
     """
-    latlngs = {}
+    addrs = [l for l in locs if l != '']
+    if providers is None:
+        providers = make_providers()
+    latlngs = geocode.geocode_all(addrs, providers, cache, default=Default_Location,
+                                  suffix=Geocode_Suffix, workers=workers,
+                                  confidences=confidences)
+    if isinstance(cache, geocode.GeocodeCache):
+        print(cache.report())
+    failed = 0
     for l in locs:
-        res = get_latlng(l)
-        latlngs[l] = res
+        if not l in latlngs:
+            if l != '':
+                failed += 1
+            latlngs[l] = Default_Location
+    if failed > 0:
+        print('get_latlngs() - {} locations failed, run again to retry them.'.format(failed))
     return latlngs
 
 
+def import_latlngs(cache, latlngs, provider, confidences=None):
+    """
+    Desc: Adds lat-lngs found earlier (eg in a latlon_data.p file) to a
+          geocode.GeocodeCache, for the addresses which are not already in it.
+    Input: The cache; a dictionary mapping from address=>lat-lng values; the
+           name to record as their provider; and optionally, a dictionary of
+           the confidence score of each address.
+    """
+    if confidences is None:
+        confidences = {}
+    for addr, latlng in latlngs.items():
+        if (addr != '') and (cache.entry(addr) is None):
+            cache.append(addr, latlng, provider, confidences.get(addr))
 
-if __name__ == '__main__':
-    print('SF Movies :: preprocessing data.')
 
-    # 1. Read the CSV file containing movie data:
-    raw_data = load_csv(Raw_Movie_Data)
-
-    # 2. Convert the raw data into a dictionary of movie info and
-    #    location info.
-    movie_data, loc_data = create_movie_data(raw_data)
-
-    # 3. Create the 'movie_keys.html' file, consisting of all movies with year (eg: 'Blah Blah (19XX)')
-    # This file is used for the autocomplete feature in filtering on movie name.
-    # format is:
-    # <script>
-    #   Movie_Keys = [
-    #                   ...
-    #                 ];
-    # </script>
-    movie_keys = sorted(list(movie_data.keys()))
-    write_movie_keys(movie_keys, 'movie_keys.html')
-    
-    # 4. Create a database of unique locations and find their lat-lngs.
-    loc_descs = extract_loc_descs(loc_data)
 
-    # Uncomment the following two lines to find lat-lngs of the loc_descs:
-    # loc_latlngs = get_latlngs(loc_descs)
-    # pickle.dump(loc_latlngs, open( "latlon_data.p", "wb" ))
-    loc_latlngs = pickle.load(open( "latlon_data.p", "rb" ))
+########################################################
+
+# The following are for running the preprocessing from the command line, as
+# a pipeline of stages:
+#   ingest:  read the CSV file into movie_data and loc_data.
+#   parse:   parse the location descriptions.
+#   geocode: find the lat-lngs of the parsed locations.
+#   index:   add the lat-lngs to loc_data, and sort the locations on lat.
+#   emit:    write the data files used by the website.
+# The result of each stage is cached in the work directory, so a stage can
+# be run again on its own, using the cached results of the stages before it.
+# Each cached result is stored with a fingerprint of the CSV file it was made
+# from, and is only used for that same file.
+
+Stages = ['ingest', 'parse', 'geocode', 'index', 'emit']
+
+Default_Output_Dir = 'data'   # Where the website reads the data files from.
+Default_Work_Dir = 'build'    # Where the results of each stage are cached.
+
+
+class Pipeline(object):
+    """
+    Desc: The preprocessing stages, with the settings for a run:
+    o input_filename: the DataSF CSV file.
+    o output_dir: the directory to write the data files to.
+    o work_dir: the directory in which the result of each stage is cached.
+    o workers: the number of processes used to parse location descriptions.
+    o geocode_cache: the filename of the geocode.GeocodeCache.
+    o providers: the geocoding providers (default: make_providers()).
+    o group_tolerance_ft: the distance in feet within which locations are
+      grouped into one map marker (see movie_db.MarkerGroups).
+    """
+    def __init__(self, input_filename=Raw_Movie_Data, output_dir=Default_Output_Dir,
+                 work_dir=Default_Work_Dir, workers=1, geocode_cache=Geocode_Cache,
+                 providers=None, group_tolerance_ft=movie_db.Group_Tolerance_Ft):
+        self.input_filename = input_filename
+        self.output_dir = output_dir
+        self.work_dir = work_dir
+        self.workers = workers
+        self.geocode_cache = geocode_cache
+        self.providers = providers
+        self.group_tolerance_ft = group_tolerance_ft
+        self.timings = []  # A list of (stage, seconds, number of items).
+        self._input_fingerprint = None
+
+
+    def input_fingerprint(self):
+        """
+        Output: a hash of the contents of the CSV file, computed once per Pipeline.
+        """
+        if self._input_fingerprint is None:
+            self._input_fingerprint = fingerprint_file(self.input_filename)
+        return self._input_fingerprint
+
+
+    def artifact_filename(self, stage):
+        """
+        Output: the filename in which the result of a stage is cached.
+        """
+        return os.path.join(self.work_dir, stage + '.p')
+
+
+    def output_filename(self, name):
+        """
+        Output: the filename of one of the data files in the output directory.
+        """
+        return os.path.join(self.output_dir, name)
+
+
+    def result(self, stage):
+        """
+        Output: the result of a stage, from its cached file if there is one
+                which was made from the same CSV file, and otherwise by
+                running the stage.
+        """
+        filename = self.artifact_filename(stage)
+        if os.path.exists(filename):
+            fingerprint, res = load_pickle(filename)
+            if fingerprint == self.input_fingerprint():
+                return res
+        return self.run(stage)
+
+
+    def save_result(self, stage, res):
+        """
+        Desc: Caches the result of a stage, with the fingerprint of the CSV file.
+        """
+        if not os.path.isdir(self.work_dir):
+            os.makedirs(self.work_dir)
+        dump_pickle((self.input_fingerprint(), res), self.artifact_filename(stage))
+
+
+    def run(self, stage):
+        """
+        Desc: Runs a stage, caches its result and prints how long it took.
+        Output: the result of the stage.
+        """
+        start = time.time()
+        res, count = getattr(self, stage)()
+        seconds = time.time() - start
+        self.timings.append((stage, seconds, count))
+        rate = count / seconds if seconds > 0 else float('inf')
+        print('{:8} {:.2f}s, {} items ({:.0f} items/s)'.format(stage + ':', seconds, count, rate))
+        self.save_result(stage, res)
+        return res
 
 
-    # 5. Insert these lat-lngs into loc_data:
-    loc_data2 = copy.deepcopy(loc_data)
-    insert_latlng_data(loc_data2, loc_latlngs)
+    def run_all(self, last_stage='emit'):
+        """
+        Desc: Runs each stage up to and including last_stage, ignoring any cached results.
+        """
+        for stage in Stages[:Stages.index(last_stage)+1]:
+            self.run(stage)
+
+
+    def ingest(self):
+        """
+        Output: a dictionary of movie_data, loc_data and the (fingerprint, movie-key)
+                of each row, and the number of rows.
+        """
+        row_keys = []
+        def fingerprint(keyed_rows):
+            for movie_key, row in keyed_rows:
+                row_keys.append((fingerprint_row(row), movie_key))
+                yield movie_key, row
+        movie_data, loc_data = group_rows(fingerprint(key_rows(normalize_rows(
+            read_csv(self.input_filename)))))
+        res = {'movie_data':movie_data, 'loc_data':loc_data, 'row_keys':row_keys}
+        return res, len(row_keys)
+
+
+    def parse(self):
+        """
+        Output: a dictionary of the parse of each raw location description, the
+                sorted parsed descriptions, and their confidences; and the number
+                of raw descriptions.
+        """
+        loc_data = self.result('ingest')['loc_data']
+        parses = location_parser.parse_distinct(
+            [loc[0] for key in loc_data for loc in loc_data[key]], self.workers)
+        res = {'parses':parses, 'loc_descs':extract_loc_descs(loc_data),
+               'confidences':extract_loc_confidences(loc_data)}
+        return res, len(parses)
+
+
+    def geocode(self):
+        """
+        Output: a dictionary mapping the parsed descriptions to their lat-lngs,
+                and the number of parsed descriptions.
+        """
+        parsed = self.result('parse')
+        latlngs = self.find_latlngs(parsed['loc_descs'], parsed['confidences'])
+        return latlngs, len(parsed['loc_descs'])
+
+
+    def find_latlngs(self, loc_descs, confidences):
+        """
+        Input: a list of parsed location descriptions, and their confidences.
+        Output: a dictionary mapping these to their lat-lngs.  Lat-lngs which are
+                not in the geocode cache are added to it from latlon_data.p in
+                the output directory, and the results are written back to it.
+        """
+        cache = geocode.GeocodeCache(self.geocode_cache, ttl=Geocode_Cache_TTL)
+        loc_latlngs = {}
+        latlon_filename = self.output_filename('latlon_data.p')
+        if os.path.exists(latlon_filename):
+            loc_latlngs = load_pickle(latlon_filename)
+        known = dict((d, loc_latlngs[d]) for d in loc_descs if d in loc_latlngs)
+        import_latlngs(cache, known, 'latlon_data.p', confidences)
+        latlngs = get_latlngs(loc_descs, cache, providers=self.providers,
+                              confidences=confidences)
+        loc_latlngs.update(latlngs)
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        dump_pickle(loc_latlngs, latlon_filename)
+        return latlngs
+
+
+    def index(self):
+        """
+        Output: a tuple of (movie_data, loc_data, lat_data, manifest) as for
+                build_data(), and the number of locations.
+        """
+        ingested = self.result('ingest')
+        parsed = self.result('parse')
+        latlngs = self.result('geocode')
+        # (Seeds the uncapped parses, as parse_distinct() does; the cached
+        #  parse stage only has the base parses, not the rated ones):
+        location_parser.Seeded_Base.update(parsed['parses'])
+        loc_data = copy.deepcopy(ingested['loc_data'])
+        insert_latlng_data(loc_data, latlngs)
+        lat_data = sort_loc_by_lats(loc_data)
+        manifest = make_manifest(ingested['row_keys'], loc_data)
+        return (ingested['movie_data'], loc_data, lat_data, manifest), len(lat_data)
+
+
+    def emit(self):
+        """
+        Desc: Writes the data files used by the website to the output directory.
+        Output: the filenames written, and the number of locations.
+        """
+        movie_data, loc_data, lat_data, manifest = self.result('index')
+        return self.write_outputs(movie_data, loc_data, lat_data, manifest), len(lat_data)
+
+
+    def write_outputs(self, movie_data, loc_data, lat_data, manifest):
+        """
+        Desc: Writes the data files used by the website to the output directory.
+        Output: the filenames written.
+        """
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        filenames = []
+        for obj, name in [(movie_data, 'movie_data.p'), (loc_data, 'loc_data.p'),
+                          (lat_data, 'lat_data.p'), (manifest, Build_Manifest)]:
+            filenames.append(self.output_filename(name))
+            dump_pickle(obj, filenames[-1])
+        # lat_data is also written in a binary format, which the website
+        # memory-maps instead of loading lat_data.p:
+        filenames.append(self.output_filename('lat_data.bin'))
+        lat_data_file.write_lat_data(lat_data, filenames[-1])
+        # The full-text index for /search:
+        filenames.append(self.output_filename('search_index.p'))
+        dump_pickle(search_index.InvertedIndex(movie_data, lat_data), filenames[-1])
+        # The groups of co-located locations, shown as one map marker each:
+        filenames.append(self.output_filename('marker_groups.p'))
+        dump_pickle(movie_db.MarkerGroups(movie_db.LatColumns(lat_data), self.group_tolerance_ft),
+                    filenames[-1])
+        return filenames
+
+
+    def incremental(self):
+        """
+        Desc: Updates the data files in the output directory to match the CSV
+              file, only parsing and geocoding the rows that are new or have
+              changed since they were written (see incremental_build()).
+              If there is no manifest from an earlier build, all stages are run.
+              The cached results of the index and emit stages are replaced by
+              those of this build, so later stages do not use older data.
+        """
+        manifest_filename = self.output_filename(Build_Manifest)
+        if not os.path.exists(manifest_filename):
+            self.run_all()
+            return
+        start = time.time()
+        def find_latlngs(loc_data):
+            return self.find_latlngs(extract_loc_descs(loc_data),
+                                     extract_loc_confidences(loc_data))
+        raw_data = load_csv(self.input_filename)
+        res = incremental_build(raw_data, load_pickle(manifest_filename),
+                                load_pickle(self.output_filename('movie_data.p')),
+                                load_pickle(self.output_filename('loc_data.p')),
+                                load_pickle(self.output_filename('lat_data.p')),
+                                find_latlngs, self.workers)
+        self.save_result('index', res)
+        self.save_result('emit', self.write_outputs(*res))
+        seconds = time.time() - start
+        self.timings.append(('incremental', seconds, len(raw_data)))
+        print('incremental: {:.2f}s, {} rows'.format(seconds, len(raw_data)))
+
+
+
+def main(argv=None):
+    """
+    Desc: The command line interface for preprocessing; see --help.
+    Input: the command line arguments (default: sys.argv[1:]).
+    Output: the Pipeline that was run.
+    """
+    parser = argparse.ArgumentParser(
+        description='SF Movies :: preprocessing data.',
+        epilog='Each stage uses the cached results of the stages before it, if there '
+        'are any, and otherwise runs them.  "all" runs every stage.')
+    parser.add_argument('stage', nargs='?', default='all', choices=Stages + ['all'],
+                        help='the stage to run (default: all)')
+    parser.add_argument('--input', default=Raw_Movie_Data,
+                        help='the DataSF CSV file (default: %(default)s)')
+    parser.add_argument('--output-dir', default=Default_Output_Dir,
+                        help='the directory to write the data files to (default: %(default)s)')
+    parser.add_argument('--work-dir', default=Default_Work_Dir,
+                        help='the directory in which to cache the results of each stage '
+                        '(default: %(default)s)')
+    parser.add_argument('--geocode-cache', default=Geocode_Cache,
+                        help='the geocode cache database (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='the number of processes used to parse the location descriptions')
+    parser.add_argument('--group-tolerance', type=float, default=movie_db.Group_Tolerance_Ft,
+                        help='the distance in feet within which locations are grouped '
+                        'into one map marker; 0 only groups identical coordinates '
+                        '(default: %(default)s)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='with "all": only process the CSV rows which are new or changed '
+                        'since the last build, and patch the data files from that build')
+    args = parser.parse_args(argv)
+    if args.incremental and (args.stage != 'all'):
+        parser.error('--incremental can only be used with the stage "all"')
+    print('SF Movies :: preprocessing data.')
+    #
+    pipeline = Pipeline(args.input, args.output_dir, args.work_dir, args.workers,
+                        args.geocode_cache, group_tolerance_ft=args.group_tolerance)
+    if args.stage != 'all':
+        pipeline.run(args.stage)
+    elif args.incremental:
+        pipeline.incremental()
+    else:
+        pipeline.run_all()
+    #
+    total = sum(t[1] for t in pipeline.timings)
+    print('total:   {:.2f}s'.format(total))
+    return pipeline
 
-    # 6. Create a list of locations sorted on lat:
-    lat_data = sort_loc_by_lats(loc_data2)
 
 
-    # 7. Write these processed data structures to file.
-    #    These files will be used by the website as the database.
-    pickle.dump(movie_data, open( "movie_data.p", "wb" ))
-    pickle.dump(loc_data2, open( "loc_data.p", "wb" ))
-    pickle.dump(lat_data, open( "lat_data.p", "wb" ))
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,15 @@ Desc: Unit tests for preprocess_data.py
 """
 
 
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+import geocode
+import location_parser
+import movie_db
 import preprocess_data as ppd
 
 
@@ -29,6 +37,30 @@ class PreprocessTest(unittest.TestCase):
         self.assertEqual(data2[0][2], 'Randall Musuem')
 
 
+    def test_read_csv(self):
+        rows = ppd.read_csv(ppd.Raw_Movie_Data)
+        self.assertFalse(isinstance(rows, list))
+        self.assertEqual(next(rows)[:3], ['180', '2011', 'Randall Musuem'])
+        self.assertEqual([next(rows)] + list(rows), ppd.load_csv(ppd.Raw_Movie_Data)[1:])
+
+
+    def test_normalize_rows(self):
+        rows = [['A Movie', '2012', 'Pier 39'], [], ['B'] * 11]
+        self.assertEqual(list(ppd.normalize_rows(rows)),
+                         [['A Movie', '2012', 'Pier 39'] + [''] * 8, ['B'] * 11])
+        self.assertEqual(list(ppd.key_rows([['A Movie ', '2012']])),
+                         [('A Movie (2012)', ['A Movie ', '2012'])])
+
+
+    def test_build_data_streamed(self):
+        # Streaming the rows from the file gives the same result as a list of rows:
+        from_list = ppd.build_data(ppd.load_csv(ppd.Raw_Movie_Data), fake_find_latlngs([]))
+        streamed = ppd.build_data(ppd.read_csv(ppd.Raw_Movie_Data), fake_find_latlngs([]))
+        self.assertEqual(streamed, from_list)
+        self.assertEqual(ppd.create_movie_data(ppd.read_csv(ppd.Raw_Movie_Data)),
+                         ppd.create_movie_data(ppd.load_csv(ppd.Raw_Movie_Data)))
+
+
     def test_write_movie_keys(self):
         # Can try a couple of test cases and verify the resulting file
         # is in the correct format.
@@ -155,6 +187,24 @@ class PreprocessTest(unittest.TestCase):
             self.assertEqual(ppd.parse_location_single(input), output)
 
 
+    def test_parse_location_single_rated(self):
+        test_pairs = [('Corner of Van Ness & Mission Street', ('Van Ness and Mission Street', 2)),
+                      ('Café Trieste', ('Café Trieste', 100)),
+                      ("McDonald's Restaurant (701 3rd Street, SOMA)", ("701 3rd Street", 1))]
+        for input, output in test_pairs:
+            self.assertEqual(ppd.parse_location_single_rated(input), output)
+
+
+    def test_extract_loc_confidences(self):
+        loc_data = {'A (2001)': [['Café Trieste', ''], ['', ''],
+                                 ['Leavenworth from Filbert & Francisco St', '']],
+                    'B (2002)': [["Starbucks at 333 O'Farrell St.", ''],
+                                 ['Leavenworth and Filbert', '']]}
+        self.assertEqual(ppd.extract_loc_confidences(loc_data),
+                         {'Café Trieste': 100, "333 O'Farrell St.": 1,
+                          'Leavenworth and Filbert': 2, 'Leavenworth and Francisco St': 2})
+
+
     def test_parse_location_range(self):
         test_pairs = [('Corner of Van Ness & Mission Street', None),
                       ("Nam Yuen Restaurant (740 Washington Street, Chinatown)", None),
@@ -195,6 +245,219 @@ class PreprocessTest(unittest.TestCase):
         # Note: geocoders have a fixed number of free requests/day
         return True
 
+
+    def test_fingerprint_row(self):
+        row = ['180', '2011', 'Randall Musuem', '']
+        self.assertEqual(ppd.fingerprint_row(row), ppd.fingerprint_row(list(row)))
+        self.assertNotEqual(ppd.fingerprint_row(row),
+                            ppd.fingerprint_row(['180', '2011', 'Randall Museum', '']))
+        # The fields are separated, so moving text between them is a change:
+        self.assertNotEqual(ppd.fingerprint_row(['ab', 'c']), ppd.fingerprint_row(['a', 'bc']))
+
+
+    def test_merge_by_lat(self):
+        a = [[1.0, 'a1'], [3.0, 'a3'], [5.0, 'a5']]
+        b = [[2.0, 'b2'], [3.0, 'b3'], [6.0, 'b6']]
+        merged = ppd.merge_by_lat(a, b)
+        self.assertEqual([e[1] for e in merged], ['a1', 'b2', 'a3', 'b3', 'a5', 'b6'])
+        self.assertEqual(ppd.merge_by_lat([], b), b)
+        self.assertEqual(ppd.merge_by_lat(a, []), a)
+
+
+    def test_make_manifest(self):
+        raw_data = ppd.load_csv(ppd.Raw_Movie_Data)[:50]
+        movie_data, loc_data, lat_data, manifest = ppd.build_data(raw_data, fake_find_latlngs([]))
+        self.assertEqual(len(manifest['rows']), len(raw_data))
+        for row, fp in zip(raw_data, manifest['rows']):
+            key, loc = manifest['entries'][fp]
+            self.assertEqual(key, ppd.make_key(row[0].strip(), row[1]))
+            self.assertEqual(loc[:2], [row[2], row[3]])
+            self.assertTrue(loc in loc_data[key])
+
+
+    def test_build_data_workers(self):
+        # Parsing with worker processes gives the same result as parsing serially:
+        raw_data = ppd.load_csv(ppd.Raw_Movie_Data)
+        location_parser.clear_cache()
+        serial = ppd.build_data(raw_data, fake_find_latlngs([]))
+        location_parser.clear_cache()
+        location_parser.Parse_Chunk_Size, chunk_size = 200, location_parser.Parse_Chunk_Size
+        try:
+            parallel = ppd.build_data(raw_data, fake_find_latlngs([]), workers=3)
+        finally:
+            location_parser.Parse_Chunk_Size = chunk_size
+        self.assertEqual(parallel, serial)
+
+
+    def test_incremental_build(self):
+        raw_data = ppd.load_csv(ppd.Raw_Movie_Data)
+        # The first build has some of the rows, and the later builds add rows,
+        # remove rows and change rows:
+        changed = [list(row) for row in raw_data[100:110]]
+        for row in changed:
+            row[3] = row[3] + ' (changed)'
+        builds = [raw_data[:300],
+                  raw_data[:400],
+                  raw_data[50:400],
+                  raw_data[50:100] + changed + raw_data[110:420]]
+        geocoded = []
+        prev = ppd.build_data(builds[0], fake_find_latlngs(geocoded))
+        for rows in builds[1:]:
+            geocoded[:] = []
+            movie_data, loc_data, lat_data, manifest = ppd.incremental_build(
+                rows, prev[3], prev[0], prev[1], prev[2], fake_find_latlngs(geocoded))
+            full = ppd.build_data(rows, fake_find_latlngs([]))
+            self.assertEqual(movie_data, full[0])
+            self.assertEqual(loc_data, full[1])
+            self.assertEqual(manifest, full[3])
+            # lat_data is sorted, but entries with the same lat may be in a different order:
+            lats = [e[0] for e in lat_data]
+            self.assertEqual(lats, sorted(lats))
+            self.assertEqual(sorted(lat_data, key=lat_sort_key),
+                             sorted(full[2], key=lat_sort_key))
+            # Only the locations of the new rows are geocoded:
+            old_fps = set(prev[3]['rows'])
+            new_locs = set(row[2] for row in rows if not ppd.fingerprint_row(row) in old_fps)
+            self.assertTrue(set(geocoded) <= new_locs)
+            prev = (movie_data, loc_data, lat_data, manifest)
+
+        # Nothing is geocoded if no rows have changed:
+        geocoded[:] = []
+        result = ppd.incremental_build(builds[-1], prev[3], prev[0], prev[1], prev[2],
+                                       fake_find_latlngs(geocoded))
+        self.assertEqual(geocoded, [])
+        self.assertEqual(result[2], prev[2])
+
+
+    def test_pipeline(self):
+        work = tempfile.mkdtemp()
+        try:
+            input_filename = os.path.join(work, 'movies.csv')
+            with open(ppd.Raw_Movie_Data, newline='') as src:
+                lines = src.readlines()
+            with open(input_filename, 'w', newline='') as dest:
+                dest.writelines(lines[:80])
+            output_dir = os.path.join(work, 'data')
+            work_dir = os.path.join(work, 'build')
+            geocoder = HashGeocoder()
+            providers = [geocode.Provider('stub', geocoder, 1000.0)]
+            pipeline = ppd.Pipeline(input_filename, output_dir, work_dir, 1,
+                                    os.path.join(work, 'geocode.db'), providers)
+            pipeline.run_all()
+            self.assertEqual([t[0] for t in pipeline.timings], ppd.Stages)
+            self.assertTrue(len(geocoder.queries) > 0)
+
+            # The data files are the same as those from build_data(), and can be
+            # read by the website:
+            latlons = ppd.load_pickle(os.path.join(output_dir, 'latlon_data.p'))
+            expected = ppd.build_data(ppd.read_csv(input_filename), lambda loc_data: latlons)
+            for data, name in zip(expected, ['movie_data.p', 'loc_data.p', 'lat_data.p',
+                                             ppd.Build_Manifest]):
+                self.assertEqual(ppd.load_pickle(os.path.join(output_dir, name)), data)
+            store = movie_db.MovieStore(*[os.path.join(output_dir, name) for name in
+                                          ['movie_data.p', 'loc_data.p', 'lat_data.p',
+                                           'lat_data.bin', 'search_index.p',
+                                           'marker_groups.p']])
+            self.assertEqual(len(store.dataset().lat_data), len(expected[2]))
+            self.assertEqual(store.dataset().search_index.keys, sorted(expected[0].keys()))
+            groups = ppd.load_pickle(os.path.join(output_dir, 'marker_groups.p'))
+            self.assertEqual(groups.tolerance_ft, movie_db.Group_Tolerance_Ft)
+            self.assertEqual(store.dataset().marker_groups.leaders.tolist(),
+                             groups.leaders.tolist())
+
+            # A stage can be run on its own, using the cached results of the others:
+            num_queries = len(geocoder.queries)
+            location_parser.clear_cache()
+            pipeline = ppd.Pipeline(input_filename, output_dir, work_dir, 1,
+                                    os.path.join(work, 'geocode.db'), providers)
+            pipeline.run('index')
+            self.assertEqual([t[0] for t in pipeline.timings], ['index'])
+            # (The cached parses are all seeded, with no size limit):
+            self.assertEqual(location_parser.Seeded_Base, pipeline.result('parse')['parses'])
+            self.assertEqual(location_parser.Base_Cache, {})
+            self.assertEqual(len(geocoder.queries), num_queries)
+            # Geocoding again only uses the geocode cache:
+            pipeline.run('geocode')
+            self.assertEqual(len(geocoder.queries), num_queries)
+
+            # After the CSV file changes, the cached results are not used:
+            with open(input_filename, 'w', newline='') as dest:
+                dest.writelines(lines[:60])
+            pipeline = ppd.Pipeline(input_filename, output_dir, work_dir, 1,
+                                    os.path.join(work, 'geocode.db'), providers)
+            pipeline.run('index')
+            self.assertEqual([t[0] for t in pipeline.timings],
+                             ['ingest', 'parse', 'geocode', 'index'])
+            self.assertEqual(pipeline.result('index')[0],
+                             ppd.build_data(ppd.read_csv(input_filename),
+                                            lambda loc_data: latlons)[0])
+
+            # An incremental build replaces the cached results of the later stages,
+            # so running emit afterwards writes the same data:
+            with open(input_filename, 'w', newline='') as dest:
+                dest.writelines(lines[:70])
+            pipeline = ppd.Pipeline(input_filename, output_dir, work_dir, 1,
+                                    os.path.join(work, 'geocode.db'), providers)
+            pipeline.incremental()
+            lat_data = ppd.load_pickle(os.path.join(output_dir, 'lat_data.p'))
+            pipeline.run('emit')
+            self.assertEqual([t[0] for t in pipeline.timings], ['incremental', 'emit'])
+            self.assertEqual(ppd.load_pickle(os.path.join(output_dir, 'lat_data.p')), lat_data)
+
+            # The command line:
+            pipeline = ppd.main(['parse', '--input', input_filename, '--output-dir', output_dir,
+                                 '--work-dir', work_dir, '--workers', '2',
+                                 '--group-tolerance', '0'])
+            # (ingest is run too, as its cached result is from an earlier CSV file):
+            self.assertEqual([t[0] for t in pipeline.timings], ['ingest', 'parse'])
+            self.assertEqual(pipeline.workers, 2)
+            self.assertEqual(pipeline.group_tolerance_ft, 0.0)
+            # --incremental only applies to "all":
+            with self.assertRaises(SystemExit):
+                ppd.main(['emit', '--incremental', '--input', input_filename])
+        finally:
+            shutil.rmtree(work)
+
+
+
+class HashGeocoder(object):
+    """
+    Desc: A stand-in for a GeoPy geocoder, which gives each query a lat-lng
+          made from its hash, and records the queries.
+    """
+    def __init__(self):
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def geocode(self, query):
+        with self._lock:
+            self.queries.append(query)
+        h = int(hashlib.sha1(query.encode('utf-8')).hexdigest()[:8], 16)
+        return (query, (37.7 + (h % 1000) / 10000.0, -122.5 + (h // 1000 % 1000) / 10000.0))
+
+
+
+def fake_find_latlngs(geocoded):
+    """
+    Output: a find_latlngs function for build_data(), which gives each location
+            description a lat-lng made from its hash, and adds the location
+            descriptions of the rows it is given to 'geocoded'.
+    """
+    def find_latlngs(loc_data):
+        latlngs = {}
+        for key in loc_data:
+            for loc in loc_data[key]:
+                geocoded.append(loc[0])
+        for desc in ppd.extract_loc_descs(loc_data):
+            h = int(hashlib.sha1(desc.encode('utf-8')).hexdigest()[:8], 16)
+            latlngs[desc] = (37.7 + (h % 1000) / 10000.0, -122.5 + (h // 1000 % 1000) / 10000.0)
+        return latlngs
+    return find_latlngs
+
+
+def lat_sort_key(entry):
+    return (entry[0], entry[2], entry[3], entry[4])
+
         
 
 
@@ -0,0 +1,214 @@
+"""
+File: search_index.py
+
+Desc: Text indexes over the movie data, for finding movies from
+a few typed characters rather than an exact movie key, and for
+full-text search over the movies and their filming locations.
+"""
+
+import bisect
+import hashlib
+import re
+import numpy as np
+
+
+# The fields of movie_data which are searched by the InvertedIndex:
+Movie_Fields = ['title', 'director', 'actor1', 'actor2', 'actor3', 'prod_co']
+
+
+def tokenize(text):
+    """
+    Input: a string of text.
+    Output: the list of lower-cased words in that text.
+    Example: "Ocean's 11 (2001)" => ["ocean's", '11', '2001']
+    """
+    return re.findall("[\\w']+", text.lower())
+
+
+def hash_fields(movie_data, lat_data):
+    """
+    Input: movie_data and lat_data, as for InvertedIndex.
+    Output: a SHA-1 hash of the fields which are indexed: the movie keys and
+            their Movie_Fields, and the movie key, location description and
+            fun fact of each row of lat_data.
+    """
+    sha1 = hashlib.sha1()
+    for key in sorted(movie_data.keys()):
+        info = movie_data[key]
+        fields = [key] + [info.get(field, '') for field in Movie_Fields]
+        sha1.update(('\x1f'.join(fields) + '\x1e').encode('utf-8'))
+    for i in range(len(lat_data)):
+        loc = lat_data[i]
+        sha1.update(('\x1f'.join([loc[2], loc[3], loc[4]]) + '\x1e').encode('utf-8'))
+    return sha1.hexdigest()
+
+
+
+class PrefixIndex(object):
+    """
+    Desc: A case-insensitive prefix index over the movie keys, for autocomplete.
+    A movie can be found from the start of its key (eg 'ocean' => "Ocean's 11 (2001)"),
+    or from the start of any word in its title, the names of its actors, or the
+    name of its director (eg 'cruise' or 'tom c' => movies with Tom Cruise).
+    Lookups are a binary search into sorted arrays of strings.
+    """
+    def __init__(self, movie_data):
+        """
+        Input: movie_data; a dictionary of {movie-key: movie info}.
+        """
+        keys = sorted(movie_data.keys(), key=lambda k: (k.lower(), k))
+        self.keys = keys
+        self.lower_keys = [k.lower() for k in keys]
+        #
+        entries = set()
+        for key in keys:
+            info = movie_data[key]
+            for field in ['title', 'director', 'actor1', 'actor2', 'actor3']:
+                name = ' '.join(info.get(field, '').lower().split())
+                if not name:
+                    continue
+                entries.add((name, key))
+                for word in tokenize(name):
+                    entries.add((word, key))
+        entries = sorted(entries, key=lambda e: (e[0], e[1].lower(), e[1]))
+        self.tokens = [e[0] for e in entries]
+        self.token_keys = [e[1] for e in entries]
+
+
+    def lookup(self, prefix, limit=10):
+        """
+        Input: the text to complete, and the maximum number of movie keys to return.
+        Output: a list of up to 'limit' movie keys which match this prefix.
+                Movie keys that start with the prefix come first, in alphabetical
+                order, followed by those with a matching title word, actor or director.
+        """
+        prefix = ' '.join(prefix.lower().split())
+        results = []
+        if (not prefix) or (limit <= 0):
+            return results
+        found = set()
+        for strings, values in [(self.lower_keys, self.keys),
+                                (self.tokens, self.token_keys)]:
+            i = bisect.bisect_left(strings, prefix)
+            while (i < len(strings)) and strings[i].startswith(prefix):
+                if not values[i] in found:
+                    found.add(values[i])
+                    results.append(values[i])
+                    if len(results) >= limit:
+                        return results
+                i += 1
+        return results
+
+
+
+class InvertedIndex(object):
+    """
+    Desc: A full-text index over the movie information (title, director, actors
+    and production company) and the filming locations (the location
+    descriptions and fun facts).
+    Each word maps to two posting lists: the movies, and the rows of lat_data
+    (ie the filming locations), which contain it.  A word in a movie's
+    information is in all of the rows of that movie, so 'hitchcock' finds
+    every Hitchcock location, and 'hitchcock coit' the ones at Coit Tower.
+    The posting lists are sorted arrays of ids, and the words are a sorted
+    list, so a word which ends in '*' matches all words with that prefix.
+    The index is built while preprocessing the data, and saved with pickle.
+    """
+    def __init__(self, movie_data, lat_data):
+        """
+        Input: movie_data; a dictionary of {movie-key: movie info}, and
+               lat_data; a list of [lat, latlngs, movie-key, location description, fun fact].
+        """
+        self.keys = sorted(movie_data.keys())
+        self.num_rows = len(lat_data)
+        self.fields_hash = hash_fields(movie_data, lat_data)
+        key_ids = dict((key, i) for i, key in enumerate(self.keys))
+        movie_rows = dict((key, []) for key in self.keys)
+        for i in range(len(lat_data)):
+            key = lat_data[i][2]
+            if key in movie_rows:
+                movie_rows[key].append(i)
+        #
+        postings = {}  # Maps word => (set of key ids, set of rows).
+        def add(text, key_id, rows):
+            for word in tokenize(text):
+                if not word in postings:
+                    postings[word] = (set(), set())
+                postings[word][0].add(key_id)
+                postings[word][1].update(rows)
+        for key in self.keys:
+            info = movie_data[key]
+            for field in Movie_Fields:
+                add(info.get(field, ''), key_ids[key], movie_rows[key])
+        for i in range(len(lat_data)):
+            loc = lat_data[i]
+            if loc[2] in key_ids:
+                add(loc[3] + ' ' + loc[4], key_ids[loc[2]], [i])
+        #
+        self.words = sorted(postings.keys())
+        self.key_postings = [np.array(sorted(postings[w][0]), dtype=np.int32) for w in self.words]
+        self.row_postings = [np.array(sorted(postings[w][1]), dtype=np.int32) for w in self.words]
+
+
+    def matches(self, movie_data, lat_data):
+        """
+        Output: whether this index was built from this movie_data and lat_data.
+        """
+        return (self.num_rows == len(lat_data)) and \
+               (self.keys == sorted(movie_data.keys())) and \
+               (getattr(self, 'fields_hash', None) == hash_fields(movie_data, lat_data))
+
+
+    def word_range(self, word, prefix):
+        """
+        Input: a word, and whether it is a prefix.
+        Output: the range of positions in self.words which match it.
+        """
+        start = bisect.bisect_left(self.words, word)
+        if not prefix:
+            if (start < len(self.words)) and (self.words[start] == word):
+                return start, start+1
+            return start, start
+        stop = start
+        while (stop < len(self.words)) and self.words[stop].startswith(word):
+            stop += 1
+        return start, stop
+
+
+    def lookup(self, query, limit=100):
+        """
+        Input: the query, and the maximum number of movies and of rows to return.
+               The query is a list of words, all of which must match (AND); a
+               word ending in '*' matches any word which starts with it.
+        Output: a dictionary of:
+          o 'keys': up to 'limit' of the matching movie keys, in alphabetical order.
+          o 'total_keys': the number of matching movies.
+          o 'indexes': up to 'limit' of the matching rows of lat_data, in order.
+          o 'total_indexes': the number of matching rows.
+        """
+        terms = []
+        for text in query.lower().split():
+            words = tokenize(text)
+            for i, word in enumerate(words):
+                terms.append((word, text.endswith('*') and (i == len(words)-1)))
+        key_ids = None
+        rows = None
+        for word, prefix in terms:
+            start, stop = self.word_range(word, prefix)
+            if stop - start == 1:
+                word_keys, word_rows = self.key_postings[start], self.row_postings[start]
+            else:
+                word_keys = np.unique(np.concatenate(
+                    [np.zeros(0, dtype=np.int32)] + self.key_postings[start:stop]))
+                word_rows = np.unique(np.concatenate(
+                    [np.zeros(0, dtype=np.int32)] + self.row_postings[start:stop]))
+            if key_ids is None:
+                key_ids, rows = word_keys, word_rows
+            else:
+                key_ids = np.intersect1d(key_ids, word_keys)
+                rows = np.intersect1d(rows, word_rows)
+        if key_ids is None:
+            return {'keys':[], 'total_keys':0, 'indexes':[], 'total_indexes':0}
+        limit = max(0, limit)
+        return {'keys':[self.keys[i] for i in key_ids[:limit]], 'total_keys':len(key_ids),
+                'indexes':rows[:limit].tolist(), 'total_indexes':len(rows)}
@@ -0,0 +1,119 @@
+"""
+File: search_index_test.py
+Desc: Unit tests for search_index.py
+"""
+
+import unittest
+import search_index
+
+
+Test_Movie_Data = {
+    "Ocean's 11 (2001)": {'title': "Ocean's 11", 'year': '2001', 'prod_co': '',
+                          'director': 'Steven Soderbergh', 'actor1': 'George Clooney',
+                          'actor2': 'Brad Pitt', 'actor3': ''},
+    'Vertigo (1958)': {'title': 'Vertigo', 'year': '1958', 'prod_co': '',
+                       'director': 'Alfred Hitchcock', 'actor1': 'James Stewart',
+                       'actor2': 'Kim Novak', 'actor3': ''},
+    'The Birds (1963)': {'title': 'The Birds', 'year': '1963', 'prod_co': '',
+                         'director': 'Alfred Hitchcock', 'actor1': 'Tippi Hedren',
+                         'actor2': 'Rod Taylor', 'actor3': ''},
+    'Bird on a Wire (1990)': {'title': 'Bird on a Wire', 'year': '1990', 'prod_co': '',
+                              'director': 'John Badham', 'actor1': 'Mel Gibson',
+                              'actor2': 'Goldie Hawn', 'actor3': ''}}
+
+
+class SearchIndexTest(unittest.TestCase):
+    def test_tokenize(self):
+        self.assertEqual(search_index.tokenize("Ocean's 11 (2001)"), ["ocean's", '11', '2001'])
+        self.assertEqual(search_index.tokenize('  Hemingway & Gelhorn'), ['hemingway', 'gelhorn'])
+        self.assertEqual(search_index.tokenize(''), [])
+
+
+    def test_prefix_index(self):
+        index = search_index.PrefixIndex(Test_Movie_Data)
+
+        # Test on empty input:
+        self.assertEqual(index.lookup(''), [])
+        self.assertEqual(index.lookup('   '), [])
+        self.assertEqual(index.lookup('bird', 0), [])
+
+        # Test on the start of movie keys, in any case:
+        self.assertEqual(index.lookup("OCEAN'S"), ["Ocean's 11 (2001)"])
+        self.assertEqual(index.lookup('v'), ['Vertigo (1958)'])
+
+        # Movie keys which start with the prefix come before other matches:
+        self.assertEqual(index.lookup('bird'), ['Bird on a Wire (1990)', 'The Birds (1963)'])
+
+        # Test on words in titles, and names of actors and directors:
+        self.assertEqual(index.lookup('hitch'), ['The Birds (1963)', 'Vertigo (1958)'])
+        self.assertEqual(index.lookup('Alfred  H'), ['The Birds (1963)', 'Vertigo (1958)'])
+        self.assertEqual(index.lookup('clooney'), ["Ocean's 11 (2001)"])
+        self.assertEqual(index.lookup('wire'), ['Bird on a Wire (1990)'])
+
+        # Test the limit on the number of results:
+        self.assertEqual(index.lookup('hitch', 1), ['The Birds (1963)'])
+
+        # Test on a prefix that is not in the index:
+        self.assertEqual(index.lookup('zzz'), [])
+
+
+
+    def test_inverted_index(self):
+        lat_data = [[37.79, [37.79, -122.40], 'Vertigo (1958)', 'Coit Tower', ''],
+                    [37.80, [37.80, -122.41], 'The Birds (1963)', 'Bodega Bay',
+                     'Hitchcock filmed the gulls here'],
+                    [37.81, [37.81, -122.42], "Ocean's 11 (2001)", 'Coit Tower', ''],
+                    [37.82, [37.82, -122.43], 'Vertigo (1958)', 'Fort Point', '']]
+        index = search_index.InvertedIndex(Test_Movie_Data, lat_data)
+        self.assertEqual(index.num_rows, 4)
+
+        # The index only matches the data it was built from, even when only the
+        # text of a row or a movie changes:
+        self.assertTrue(index.matches(Test_Movie_Data, lat_data))
+        changed = [list(loc) for loc in lat_data]
+        changed[1][4] = 'Hitchcock filmed the crows here'
+        self.assertFalse(index.matches(Test_Movie_Data, changed))
+        movie_data = dict((key, dict(info)) for key, info in Test_Movie_Data.items())
+        movie_data['Vertigo (1958)']['director'] = 'Brian De Palma'
+        self.assertFalse(index.matches(movie_data, lat_data))
+
+        # Test on empty input:
+        empty = {'keys':[], 'total_keys':0, 'indexes':[], 'total_indexes':0}
+        self.assertEqual(index.lookup(''), empty)
+        self.assertEqual(index.lookup(' & '), empty)
+
+        # A word in a movie's information is in all of that movie's rows:
+        res = index.lookup('Hitchcock')
+        self.assertEqual(res['keys'], ['The Birds (1963)', 'Vertigo (1958)'])
+        self.assertEqual(res['indexes'], [0, 1, 3])
+        self.assertEqual((res['total_keys'], res['total_indexes']), (2, 3))
+
+        # A word in a location is in that row, and its movie:
+        res = index.lookup('coit')
+        self.assertEqual(res['keys'], ["Ocean's 11 (2001)", 'Vertigo (1958)'])
+        self.assertEqual(res['indexes'], [0, 2])
+        self.assertEqual(index.lookup('gulls')['indexes'], [1])
+
+        # All of the words must match:
+        res = index.lookup('HITCHCOCK coit')
+        self.assertEqual(res['keys'], ['Vertigo (1958)'])
+        self.assertEqual(res['indexes'], [0])
+        self.assertEqual(index.lookup('hitchcock clooney'), empty)
+        self.assertEqual(index.lookup('hitchcock zzz'), empty)
+
+        # Test prefixes, which only apply to words ending in '*':
+        self.assertEqual(index.lookup('bird')['keys'], ['Bird on a Wire (1990)'])
+        self.assertEqual(index.lookup('bird*')['keys'],
+                         ['Bird on a Wire (1990)', 'The Birds (1963)'])
+        self.assertEqual(index.lookup('hitch'), empty)
+        self.assertEqual(index.lookup('hitch* tow*')['indexes'], [0])
+
+        # Test the limit, which does not change the totals:
+        res = index.lookup('hitchcock', limit=1)
+        self.assertEqual(res['keys'], ['The Birds (1963)'])
+        self.assertEqual(res['indexes'], [0])
+        self.assertEqual((res['total_keys'], res['total_indexes']), (2, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,265 @@
 # all the imports
+import calendar
+import gzip
+import hashlib
+import io
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from flask import Flask, request, session, g, redirect, url_for, \
-     abort, render_template, flash, jsonify, json
+     abort, render_template, flash, jsonify, json, Response
 from contextlib import closing
 import movie_db as mdb
+try:
+    import brotli  # Optional: also serve brotli-compressed responses.
+except ImportError:
+    brotli = None
+try:
+    import orjson  # Optional: a faster JSON encoder, with the same output.
+except ImportError:
+    orjson = None
+
+
+# Number of locations returned per page by /search_by_loc:
+Default_Page_Size = 100
+Max_Page_Size = 500
+
+# Number of movie keys returned by /suggest:
+Default_Suggest_Limit = 10
+Max_Suggest_Limit = 50
+
+# Number of movie keys, and of locations, returned by /search:
+Default_Search_Limit = 100
+Max_Search_Limit = 500
+
+# Number of locations returned by /get_nearest:
+Default_Nearest_K = 10
+Max_Nearest_K = 100
+
+# Number of locations returned by /get_by_bbox:
+Default_Bbox_Limit = 500
+Max_Bbox_Limit = 2000
+
+# /get_by_bbox returns clusters rather than locations at this map zoom
+# level and below.  The clusters are grid cells, with this many across
+# each 256 pixel map tile (so a cluster is about 64 pixels across):
+Cluster_Max_Zoom = 14
+Cluster_Cells_Per_Tile = 4
+# The smallest cluster cell, in degrees (about a foot), used when the box is
+# a single point or the zoom is very large:
+Min_Cluster_Cell_Size = 3e-6
+
+# Maximum number of movie keys in a /batch request.  This can be changed
+# with the app's 'MAX_BATCH_SIZE' setting:
+Max_Batch_Size = 100
+
+# The read endpoints, whose responses only depend on the request and the dataset.
+# Browsers and caches can keep these responses until the dataset changes:
+Cached_Endpoints = set(['get_movie_info', 'get_by_key', 'get_by_indexes',
+                        'get_indexes_by_loc', 'search_by_loc', 'suggest',
+                        'get_by_bbox', 'get_nearest', 'search'])
+# The read endpoints whose responses may be compressed, and so vary by the
+# request's Accept-Encoding header (see rendered_response()):
+Encoded_Endpoints = set(['get_movie_info', 'get_by_key'])
+# Responses are kept for a short time, and then revalidated with their ETag,
+# which is cheap, so that a deploy that changes their format is picked up soon:
+Cache_Max_Age = 60 * 60  # One hour, in seconds.
+
+# The version of the format of the responses, which is part of every ETag.
+# Change it to the date of the change whenever the format of a response
+# changes (adding '.2', '.3', ... for more changes on the same day), so that
+# cached responses in the old format are not reused.  Its date is also the
+# earliest Last-Modified time, for If-Modified-Since requests:
+Api_Version = '2026-10-17.2'
+Api_Version_Time = calendar.timegm(time.strptime(Api_Version[:10], '%Y-%m-%d'))
+
+# The responses of /get_movie_info and /get_by_key are rendered to bytes,
+# and compressed, the first time each movie is asked for.  This is the
+# maximum number of rendered responses kept, and the smallest body that
+# is worth compressing:
+Max_Rendered_Responses = 4096
+Min_Compress_Size = 256
 
 
 # create our little application :)
 app = Flask(__name__)
 app.config.from_object(__name__)
+app.config.setdefault('MAX_BATCH_SIZE', Max_Batch_Size)
 ## Instead of 'app.config.from_object(), can use the following
 ## to configure from a file:
 # app.config.from_envvar('FLASKR_SETTINGS', silent=True)
 
 
+# The ETag for a read request is a hash of the API version, the dataset version
+# and the request's URL, so it changes whenever the data files are updated, or
+# the format of the responses changes.
+def make_etag(version):
+    url = request.full_path
+    return hashlib.sha1((Api_Version + ' ' + version + ' ' + url).encode('utf-8')).hexdigest()
+
+
+# A compressed response has its own ETag: the ETag of the request, followed by
+# the content encoding.
+def set_cache_headers(response):
+    etag = g.etag
+    if response.headers.get('Content-Encoding'):
+        etag += '-' + response.headers['Content-Encoding']
+    response.set_etag(etag)
+    response.last_modified = g.last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = Cache_Max_Age
+    return response
+
+
+# Before a read request is handled, check if the client already has the
+# current response, and if so, respond with '304 Not Modified':
+@app.before_request
+def check_not_modified():
+    if not request.endpoint in Cached_Endpoints:
+        return None
+    version, last_modified = mdb.get_version()
+    if not version:
+        return None
+    g.etag = make_etag(version)
+    last_modified = max(last_modified, Api_Version_Time)
+    g.last_modified = last_modified
+    #
+    not_modified = False
+    if request.headers.get('If-None-Match'):
+        # The ETag may be that of a compressed response (see set_cache_headers()):
+        for suffix in ['', '-gzip', '-br']:
+            if request.if_none_match.contains_weak(g.etag + suffix):
+                not_modified = True
+                g.etag += suffix
+                break
+    elif request.if_modified_since:
+        since = calendar.timegm(request.if_modified_since.utctimetuple())
+        not_modified = (last_modified <= since)
+    if not_modified:
+        response = set_cache_headers(app.response_class(status=304))
+        # (A 304 must have the same Vary header as the 200 response would):
+        if request.endpoint in Encoded_Endpoints:
+            response.vary.add('Accept-Encoding')
+        return response
+    return None
+
+
+# Add caching headers to the successful responses from the read endpoints:
+@app.after_request
+def add_cache_headers(response):
+    if (request.endpoint in Cached_Endpoints) and (response.status_code == 200) \
+       and ('etag' in g):
+        set_cache_headers(response)
+    return response
+
+
+
+# Encodes the data of a response as compact JSON bytes, with no whitespace
+# between items, sorted keys and UTF-8 text, using orjson if it is installed.
+# orjson writes the shortest repr of each float, like json, so both give the
+# same values; data which orjson cannot encode (eg very large ints) uses json.
+def encode_json(data):
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(data, separators=(',', ':'), sort_keys=True,
+                      ensure_ascii=False).encode('utf-8')
+
+
+# Returns a JSON response of the keyword args, like jsonify(), but encoded
+# with encode_json().
+def json_response(**data):
+    return app.response_class(encode_json(data), mimetype='application/json')
+
+
+# Returns a list of locations, in the format of mdb.get_locs_by_indexes(), in
+# the format asked for by the request's 'format' arg.  If this is 'columnar',
+# the locations are instead a dictionary of columns:
+# o keys: the distinct movie keys, in order of their first location;
+# o key_ids: the position in 'keys' of the movie key of each location;
+# o descs, funfacts: the location descriptions and fun facts;
+# o latlngs: the lat-lngs of all of the locations in one flat list, where a
+#   location has 4 values if its 'has_segment' is 1, and 2 values otherwise;
+# o dists: the distances in feet, if the locations have them (see mdb.nearest()).
+def format_locs(locs):
+    if request.args.get('format') != 'columnar':
+        return locs
+    keys = []
+    key_ids = {}
+    columns = {'keys': keys, 'key_ids': [], 'descs': [], 'funfacts': [],
+               'latlngs': [], 'has_segment': []}
+    if locs and (len(locs[0]) > 4):
+        columns['dists'] = [loc[4] for loc in locs]
+    for loc in locs:
+        if not loc[0] in key_ids:
+            key_ids[loc[0]] = len(keys)
+            keys.append(loc[0])
+        columns['key_ids'].append(key_ids[loc[0]])
+        columns['descs'].append(loc[1])
+        columns['funfacts'].append(loc[2])
+        columns['latlngs'].extend(loc[3])
+        columns['has_segment'].append(1 if len(loc[3]) == 4 else 0)
+    return columns
+
+
+
+# Memoized response bodies, mapping (dataset version, endpoint, movie key)
+# to a dictionary of {content encoding: body bytes}, where '' is uncompressed.
+# They are kept in order of use, and the least recently used body is evicted
+# when there are more than Max_Rendered_Responses.
+Rendered_Bodies = OrderedDict()
+Rendered_Bodies_Lock = threading.Lock()
+
+
+# Compresses a response body with each of the encodings that are available,
+# returning the dictionary of {content encoding: body bytes}.
+def encode_body(body):
+    bodies = {'': body}
+    if len(body) < Min_Compress_Size:
+        return bodies
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as file:
+        file.write(body)
+    bodies['gzip'] = buf.getvalue()
+    if brotli is not None:
+        bodies['br'] = brotli.compress(body)
+    return bodies
+
+
+# Returns a JSON response for a movie, using the memoized body if there is
+# one, and otherwise rendering the dictionary returned by make_data() and
+# memoizing it.  The body is sent in the best encoding that the client
+# accepts (br, then gzip, then uncompressed).
+def rendered_response(endpoint, movie_key, make_data):
+    version = mdb.get_version()[0]
+    cache_key = (version, endpoint, movie_key)
+    with Rendered_Bodies_Lock:
+        bodies = Rendered_Bodies.get(cache_key)
+        if bodies is not None:
+            Rendered_Bodies.move_to_end(cache_key)
+    if bodies is None:
+        bodies = encode_body(encode_json(make_data()))
+        if version:
+            with Rendered_Bodies_Lock:
+                Rendered_Bodies[cache_key] = bodies
+                while len(Rendered_Bodies) > Max_Rendered_Responses:
+                    Rendered_Bodies.popitem(last=False)
+    encoding = ''
+    for name in ['br', 'gzip']:
+        if (name in bodies) and (request.accept_encodings[name] > 0):
+            encoding = name
+            break
+    response = app.response_class(bodies[encoding], mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+
 # Index/Home/Splash page for this website:
 @app.route('/')
 def index():
@@ -22,12 +268,60 @@ def index():
     return render_template('index.html')
 
 
+# Given the start of a movie title, actor or director,
+# Returns the movie keys that match it, for the autocomplete field.
+@app.route('/suggest', methods=['GET'])
+def suggest():
+    response = json_response(q='', keys=[])  # Response on error
+    try:
+        q = request.args.get('q')
+        if not q:
+            # Not a valid query, return error-response:
+            return response
+        limit = int(request.args.get('limit', Default_Suggest_Limit))
+        limit = min(max(1, limit), Max_Suggest_Limit)
+        response = json_response(q=q, keys=mdb.suggest(q, limit))
+    except:
+        pass
+    return response
+
+
+
+# Given a query of words, eg 'hitchcock coit', in any movie's title, director,
+# actors or production company, or in its location descriptions or fun facts,
+# Returns the movies and the locations that contain all of the words.
+# A word ending in '*' matches any word that starts with it, eg 'hitch*'.
+# Optional arg: 'limit' is the maximum number of movie keys, and of locations,
+# to return (the totals of each are also returned).
+@app.route('/search', methods=['GET'])
+def search():
+    # Response on error
+    response = json_response(q='', keys=[], total_keys=0, indexes=[], total_indexes=0, locs=[])
+    try:
+        q = request.args.get('q')
+        if not q:
+            # Not a valid query, return error-response:
+            return response
+        limit = int(request.args.get('limit', Default_Search_Limit))
+        limit = min(max(1, limit), Max_Search_Limit)
+        if app.debug:
+            print('search({},{})'.format(q, limit))
+        res = mdb.search(q, limit)
+        response = json_response(q=q, keys=res['keys'], total_keys=res['total_keys'],
+                                 indexes=res['indexes'], total_indexes=res['total_indexes'],
+                                 locs=format_locs(mdb.get_locs_by_indexes(res['indexes'])))
+    except:
+        pass
+    return response
+
+
+
 # Given a movie key ('Movie Name (Year)'),
-# Returns info on that movie.
+# Returns info on that movie.  The response is pre-rendered (see rendered_response()).
 # Note: this is not currently being used.
 @app.route('/get_movie_info', methods=['GET'])
 def get_movie_info():
-    response = jsonify(movie_key='', info=[])  # Response on error
+    response = json_response(movie_key='', info=[])  # Response on error
     try:
         key = request.args.get('movie_key')
         if app.debug:
@@ -36,7 +330,10 @@ def get_movie_info():
             # Not a valid query, return error-response:
             return response
         movie_info = mdb.get_movie_info(key)
-        response = jsonify(movie_key=key, info=movie_info)
+        if not movie_info:
+            return json_response(movie_key=key, info=movie_info)
+        response = rendered_response('get_movie_info', key,
+                                     lambda: dict(movie_key=key, info=movie_info))
     except:
         pass
     return response
@@ -44,10 +341,11 @@ def get_movie_info():
 
 
 # Given a movie key ('Movie Name (Year)'),
-# Returns location information for that movie key.
+# Returns location information for that movie key.  The response is
+# pre-rendered and compressed (see rendered_response()).
 @app.route('/get_by_key', methods=['GET'])
 def get_by_key():
-    response = jsonify(movie_key='', locs=[])  # Response on error
+    response = json_response(movie_key='', locs=[])  # Response on error
     try:
         key = request.args.get('movie_key')
         if app.debug:
@@ -56,7 +354,57 @@ def get_by_key():
             # Not a valid query, return error-response:
             return response
         movie_locs = mdb.get_locs_by_key(key)
-        response = jsonify(movie_key=key, locs=movie_locs)
+        if not movie_locs:
+            return json_response(movie_key=key, locs=movie_locs)
+        response = rendered_response('get_by_key', key,
+                                     lambda: dict(movie_key=key, locs=movie_locs))
+    except:
+        pass
+    return response
+
+
+
+# Given a JSON body with a list of movie keys,
+# Returns the info and/or locations of each movie, in one response.
+# Body: {"keys": [...], "info": true, "locs": true}, where 'info' and 'locs'
+# (default true) say what to return for every key, and each key is either a
+# movie key or {"movie_key": ..., "info": ..., "locs": ...} to choose per key.
+# 'info' and 'locs' must be JSON booleans; other values are refused with a 400.
+# Requests with more than MAX_BATCH_SIZE keys are refused with a 413.
+@app.route('/batch', methods=['POST'])
+def batch():
+    response = json_response(results=[])  # Response on error
+    try:
+        body = request.get_json(force=True, silent=True)
+        if (not isinstance(body, dict)) or (not isinstance(body.get('keys'), list)):
+            # Not a valid query, return error-response:
+            response.status_code = 400
+            return response
+        keys = body['keys']
+        max_size = app.config['MAX_BATCH_SIZE']
+        if len(keys) > max_size:
+            response = json_response(results=[],
+                                     error='At most {} keys per batch'.format(max_size))
+            response.status_code = 413
+            return response
+        want_info = body.get('info', True)
+        want_locs = body.get('locs', True)
+        requests = []
+        for key in keys:
+            if isinstance(key, dict):
+                requests.append((str(key.get('movie_key', '')), key.get('info', want_info),
+                                 key.get('locs', want_locs)))
+            else:
+                requests.append((str(key), want_info, want_locs))
+        flags = [want_info, want_locs] + [flag for req in requests for flag in req[1:]]
+        if not all(isinstance(flag, bool) for flag in flags):
+            response = json_response(results=[],
+                                     error="'info' and 'locs' must be true or false")
+            response.status_code = 400
+            return response
+        if app.debug:
+            print('batch() - {} keys'.format(len(requests)))
+        response = json_response(results=mdb.get_batch(requests))
     except:
         pass
     return response
@@ -67,7 +415,7 @@ def get_by_key():
 # Returns the movie locations at those indexes.
 @app.route('/get_by_indexes', methods=['GET'])
 def get_by_indexes():
-    response = jsonify(locs=[])  # Response on error
+    response = json_response(locs=[])  # Response on error
     try:
         indexes_str = json.loads(request.args.get('indexes'))
         if not indexes_str:
@@ -79,21 +427,182 @@ def get_by_indexes():
         if app.debug:
             print('get_by_indexes() - indexes: {}'.format(indexes))
         movie_locs = mdb.get_locs_by_indexes(indexes)
-        response = jsonify(locs=movie_locs)
+        response = json_response(locs=format_locs(movie_locs))
     except:
         pass
     return response
 
 
 
+# Returns whether the request's 'group' arg is set, in which case the locations
+# are returned as one record for each group of locations at the same spot (see
+# mdb.get_groups_by_indexes()), rather than one record for each location.
+def is_grouped():
+    return request.args.get('group', '') not in ['', '0', 'false']
+
+
+
+# Returns whether the request's 'facets' arg is set, in which case the counts
+# of the movies' years, directors, actors and production companies are added
+# to the response (see mdb.get_facet_counts()).  They are left out by default,
+# since counting them takes longer than the query itself.
+def wants_facets():
+    return request.args.get('facets', '') not in ['', '0', 'false']
+
+
+
+# Reads the optional filters on the movies of a location query from the
+# request args: 'min_year', 'max_year', 'director', 'actor' and 'prod_co'.
+# Returns a dictionary of the filters which are given (see mdb.LatFacets.filter()).
+def get_facet_filters():
+    filters = {}
+    for arg in ['min_year', 'max_year']:
+        if request.args.get(arg):
+            filters[arg] = int(request.args.get(arg))
+    for arg in ['director', 'actor', 'prod_co']:
+        if request.args.get(arg):
+            filters[arg] = request.args.get(arg)
+    return filters
+
+
+
 # Given a lat-lng and radius,
 # Returns the indexes into the latitude-sorted data file.
+# Optional args: filters on the movies (see get_facet_filters()), and 'facets'
+# to add the counts of the years, directors, actors and production companies
+# of their movies (see wants_facets()).
 @app.route('/get_indexes_by_loc', methods=['GET'])
 def get_indexes_by_loc():
     # Response on error
     if app.debug:
         print('get_indexes_by_loc() - started')
-    response = jsonify(lat=0, lng=0, radius=0, indexes=[])
+    response = json_response(lat=0, lng=0, radius=0, indexes=[])
+    try:
+        rad = request.args.get('radius')
+        lat = request.args.get('lat')
+        lng = request.args.get('lng')
+        if (not rad) or (not lat) or (not lng):
+            # Not a valid query, return error-response:
+            return response
+        rad = float(rad)
+        lat = float(lat)
+        lng = float(lng)
+        filters = get_facet_filters()
+        if app.debug:
+            print('get_indexes_by_loc({},{},{}) - filters: {}'.format(lat,lng,rad,filters))
+        movie_indexes = mdb.get_indexes_by_loc(lat, lng, rad, filters)
+        extra = {}
+        if wants_facets():
+            extra['facets'] = mdb.get_facet_counts(movie_indexes)
+        response = json_response(lat=lat, lng=lng, radius=rad,
+                                 indexes=movie_indexes, **extra)
+    except:
+        pass
+    return response
+
+
+
+# Given a lat-lng and optionally a number of locations, 'k',
+# Returns the k movie locations closest to that lat-lng, closest first.
+@app.route('/get_nearest', methods=['GET'])
+def get_nearest():
+    response = json_response(lat=0, lng=0, k=0, locs=[])  # Response on error
+    try:
+        lat = request.args.get('lat')
+        lng = request.args.get('lng')
+        if (not lat) or (not lng):
+            # Not a valid query, return error-response:
+            return response
+        lat = float(lat)
+        lng = float(lng)
+        k = int(request.args.get('k', Default_Nearest_K))
+        k = min(max(1, k), Max_Nearest_K)
+        if app.debug:
+            print('get_nearest({},{},{})'.format(lat, lng, k))
+        response = json_response(lat=lat, lng=lng, k=k,
+                                 locs=format_locs(mdb.nearest(lat, lng, k)))
+    except:
+        pass
+    return response
+
+
+
+# Given the corners of a lat-lng box, eg the map's viewport,
+# Returns the movie locations inside the box.
+# Optional args: 'limit' is the maximum number of locations to return (the
+# indexes of all of them are returned), and 'zoom' is the map's zoom level.
+# At a zoom of Cluster_Max_Zoom or less, or if 'cluster' is set, the
+# locations are grouped into grid cells and the clusters are returned instead.
+# Otherwise, if 'group' is set, up to 'limit' groups of co-located locations
+# are returned instead of the locations and their indexes (see is_grouped()).
+@app.route('/get_by_bbox', methods=['GET'])
+def get_by_bbox():
+    # Response on error
+    response = json_response(min_lat=0, max_lat=0, min_lng=0, max_lng=0, total=0,
+                             indexes=[], locs=[])
+    try:
+        bounds = [request.args.get(arg) for arg in ['min_lat', 'max_lat', 'min_lng', 'max_lng']]
+        if not all(bounds):
+            # Not a valid query, return error-response:
+            return response
+        min_lat, max_lat, min_lng, max_lng = [float(b) for b in bounds]
+        zoom = request.args.get('zoom')
+        cluster = request.args.get('cluster', '') not in ['', '0', 'false']
+        if zoom is not None:
+            zoom = int(zoom)
+            cluster = cluster or (zoom <= Cluster_Max_Zoom)
+        if app.debug:
+            print('get_by_bbox({},{},{},{}) - zoom: {}'.format(min_lat, max_lat, min_lng,
+                                                               max_lng, zoom))
+        if cluster:
+            if zoom is not None:
+                # (Zooms beyond 64 would only give cells smaller than the smallest.)
+                cell_size = 360.0 / 2.0**min(max(zoom, 0), 64) / Cluster_Cells_Per_Tile
+            else:
+                cell_size = max(max_lat - min_lat, max_lng - min_lng) / (2*Cluster_Cells_Per_Tile)
+            cell_size = max(cell_size, Min_Cluster_Cell_Size)
+            clusters = mdb.get_clusters_by_bbox(min_lat, max_lat, min_lng, max_lng, cell_size)
+            return json_response(min_lat=min_lat, max_lat=max_lat,
+                                 min_lng=min_lng, max_lng=max_lng,
+                                 total=sum(c['count'] for c in clusters), cell_size=cell_size,
+                                 clusters=clusters)
+        #
+        limit = int(request.args.get('limit', Default_Bbox_Limit))
+        limit = min(max(1, limit), Max_Bbox_Limit)
+        movie_indexes = mdb.get_indexes_by_bbox(min_lat, max_lat, min_lng, max_lng)
+        if is_grouped():
+            groups = mdb.get_groups_by_indexes(movie_indexes)
+            return json_response(min_lat=min_lat, max_lat=max_lat,
+                                 min_lng=min_lng, max_lng=max_lng, total=len(movie_indexes),
+                                 total_groups=len(groups), groups=groups[:limit])
+        movie_locs = mdb.get_locs_by_indexes(movie_indexes[:limit])
+        response = json_response(min_lat=min_lat, max_lat=max_lat,
+                                 min_lng=min_lng, max_lng=max_lng, total=len(movie_indexes),
+                                 indexes=movie_indexes, locs=format_locs(movie_locs))
+    except:
+        pass
+    return response
+
+
+
+# Given a lat-lng and radius,
+# Returns the movie locations within that radius, one page at a time.
+# Optional args: 'cursor' is where in the results to start (the 'next_cursor'
+# of the previous page), 'page_size' is how many locations to return, and
+# 'format=ndjson' streams all remaining locations, one JSON list per line.
+# The locations can also be filtered on their movies (see get_facet_filters()),
+# and if 'facets' is set each page includes the counts of the movies' years,
+# directors, actors and production companies, over all of the (filtered)
+# locations (see wants_facets()).
+# If 'group' is set, the pages are of groups of co-located locations rather
+# than of locations (see is_grouped()), and 'total' is the number of groups.
+@app.route('/search_by_loc', methods=['GET'])
+def search_by_loc():
+    if app.debug:
+        print('search_by_loc() - started')
+    # Response on error
+    response = json_response(lat=0, lng=0, radius=0, total=0, cursor=0,
+                             next_cursor=None, locs=[])
     try:
         rad = request.args.get('radius')
         lat = request.args.get('lat')
@@ -104,11 +613,44 @@ def get_indexes_by_loc():
         rad = float(rad)
         lat = float(lat)
         lng = float(lng)
+        cursor = max(0, int(request.args.get('cursor', 0)))
+        page_size = int(request.args.get('page_size', Default_Page_Size))
+        page_size = min(max(1, page_size), Max_Page_Size)
+        filters = get_facet_filters()
         if app.debug:
-            print('get_indexes_by_loc({},{},{})'.format(lat,lng,rad))
-        movie_indexes = mdb.get_indexes_by_loc(lat, lng, rad)
-        response = jsonify(lat=lat, lng=lng, radius=rad,
-                           indexes=movie_indexes)
+            print('search_by_loc({},{},{}) - cursor: {}, filters: {}'.format(
+                lat, lng, rad, cursor, filters))
+        movie_indexes = mdb.get_indexes_by_loc(lat, lng, rad, filters)
+        # When grouped, the pages are of groups rather than of locations:
+        grouped = is_grouped()
+        items = movie_indexes
+        if grouped:
+            items = mdb.get_groups_by_indexes(movie_indexes)
+        def get_page(start):
+            page = items[start:start+page_size]
+            return page if grouped else mdb.get_locs_by_indexes(page)
+        #
+        if request.args.get('format') == 'ndjson':
+            def generate():
+                for i in range(cursor, len(items), page_size):
+                    for loc in get_page(i):
+                        yield encode_json(loc) + b'\n'
+            return Response(generate(), mimetype='application/x-ndjson')
+        #
+        next_cursor = cursor + page_size
+        if next_cursor >= len(items):
+            next_cursor = None
+        page = get_page(cursor)
+        extra = {}
+        if wants_facets():
+            extra['facets'] = mdb.get_facet_counts(movie_indexes)
+        if grouped:
+            return json_response(lat=lat, lng=lng, radius=rad, total=len(items),
+                                 cursor=cursor, next_cursor=next_cursor, groups=page,
+                                 **extra)
+        response = json_response(lat=lat, lng=lng, radius=rad, total=len(items),
+                                 cursor=cursor, next_cursor=next_cursor,
+                                 locs=format_locs(page), **extra)
     except:
         pass
     return response
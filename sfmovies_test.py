@@ -4,10 +4,13 @@ Desc: Unit tests for sfmovies.py
 """
 
 
+import calendar
+import gzip
 import os
 import sfmovies
 import unittest
 import tempfile
+import warnings
 from flask import json, jsonify
 
 
@@ -60,6 +63,30 @@ class SFMoviesTestCase(unittest.TestCase):
         self.assertEqual(data['info'], [])
 
 
+    def test_suggest(self):
+        # Test on an empty query:
+        rv = self.app.get('/suggest', query_string=dict(q=''))
+        data = json.loads(rv.data)
+        self.assertEqual(data['q'], '')
+        self.assertEqual(data['keys'], [])
+
+        # Test on a title prefix:
+        rv = self.app.get('/suggest', query_string=dict(q='about a'))
+        data = json.loads(rv.data)
+        self.assertEqual(data['q'], 'about a')
+        self.assertEqual(data['keys'], ['About a Boy (2014)'])
+
+        # Test on a director's name, with a limit:
+        rv = self.app.get('/suggest', query_string=dict(q='hitchcock', limit=2))
+        data = json.loads(rv.data)
+        self.assertEqual(data['keys'], ['Family Plot (1976)', 'Marnie (1964)'])
+
+        # Test on a prefix that does not match:
+        rv = self.app.get('/suggest', query_string=dict(q='zzzz'))
+        data = json.loads(rv.data)
+        self.assertEqual(data['keys'], [])
+
+
     def test_get_by_key(self):
         # Test on an empty key:
         key = ''
@@ -207,6 +234,515 @@ class SFMoviesTestCase(unittest.TestCase):
 
 
 
+    def test_search_by_loc(self):
+        # Test on incorrect get args:
+        msg = dict(wrongArg='blah blah')
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        data = json.loads(rv.data)
+        self.assertEqual(data['total'], 0)
+        self.assertEqual(data['next_cursor'], None)
+        self.assertEqual(data['locs'], [])
+
+        # Test on invalid arg values:
+        msg = dict(radius='not', lat='valid', lng='values')
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        data = json.loads(rv.data)
+        self.assertEqual(data['total'], 0)
+        self.assertEqual(data['locs'], [])
+
+        # Test on a valid input, which fits in one page:
+        msg = dict(radius='500.0', lat='37.78373', lng='-122.46329')
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        data = json.loads(rv.data)
+        self.assertEqual(data['lat'], 37.78373)
+        self.assertEqual(data['lng'], -122.46329)
+        self.assertEqual(data['radius'], 500.0)
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['cursor'], 0)
+        self.assertEqual(data['next_cursor'], None)
+        self.assertEqual(data['locs'], sfmovies.mdb.get_locs_by_indexes([484, 485]))
+
+        # Test paging through a larger result, 4 locations at a time:
+        indexes = sfmovies.mdb.get_indexes_by_loc(37.7787, -122.5127, 1000.0)
+        locs = []
+        cursor = 0
+        while cursor is not None:
+            msg = dict(radius='1000.0', lat='37.7787', lng='-122.5127',
+                       cursor=cursor, page_size=4)
+            rv = self.app.get('/search_by_loc', query_string=msg)
+            data = json.loads(rv.data)
+            self.assertEqual(data['total'], len(indexes))
+            self.assertTrue(len(data['locs']) <= 4)
+            locs.extend(data['locs'])
+            cursor = data['next_cursor']
+        self.assertEqual(locs, sfmovies.mdb.get_locs_by_indexes(indexes))
+
+        # Test streaming all locations as NDJSON:
+        msg = dict(radius='1000.0', lat='37.7787', lng='-122.5127',
+                   page_size=4, format='ndjson')
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        self.assertEqual(rv.mimetype, 'application/x-ndjson')
+        lines = rv.data.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], locs)
+
+
+
+    def test_encode_json_backends(self):
+        # orjson, when it is installed, writes the same bytes as json for the
+        # data of the responses:
+        if sfmovies.orjson is None:
+            self.skipTest('orjson is not installed')
+        mdb = sfmovies.mdb
+        indexes = mdb.get_indexes_by_loc(37.7937, -122.3999, 3000.0)
+        for data in [{'locs': mdb.get_locs_by_key('Vertigo (1958)'), 'movie_key': 'Vertigo (1958)'},
+                     {'info': mdb.get_movie_info('Vertigo (1958)')},
+                     {'indexes': indexes, 'facets': mdb.get_facet_counts(indexes),
+                      'lat': 37.7937, 'lng': -122.3999, 'radius': 3000.0},
+                     {'locs': mdb.get_locs_by_indexes(indexes)},
+                     {'groups': mdb.get_groups_by_indexes(indexes), 'next_cursor': None},
+                     {'nearest': mdb.nearest(37.7937, -122.3999, 20)},
+                     {'text': 'Caf\u00e9 \u201cTrieste\u201d \\ "quoted" \n\t\x1f', 'b': True}]:
+            fast, slow = encode_json_both(data)
+            self.assertEqual(fast, slow)
+        for url, msg in [('/search_by_loc', dict(radius=3000.0, lat=37.7937, lng=-122.3999,
+                                                 format='columnar', facets=1)),
+                         ('/get_by_bbox', dict(min_lat=37.77, max_lat=37.79, min_lng=-122.42,
+                                               max_lng=-122.39, group=1)),
+                         ('/get_nearest', dict(lat=37.7937, lng=-122.3999, k=20))]:
+            rv = self.app.get(url, query_string=msg)
+            fast, slow = encode_json_both(json.loads(rv.data))
+            self.assertEqual(fast, slow)
+            self.assertEqual(fast, rv.data)
+
+
+    def test_cache_headers(self):
+        # Test that a read endpoint has caching headers:
+        msg = dict(movie_key='About a Boy (2014)')
+        rv = self.app.get('/get_by_key', query_string=msg)
+        self.assertEqual(rv.status_code, 200)
+        etag = rv.headers.get('ETag')
+        self.assertTrue(etag)
+        self.assertTrue(rv.headers.get('Last-Modified'))
+        self.assertTrue('max-age={}'.format(sfmovies.Cache_Max_Age) in
+                        rv.headers.get('Cache-Control'))
+
+        # Test that the same request gets the same ETag, and a different
+        # request gets a different one:
+        rv = self.app.get('/get_by_key', query_string=msg)
+        self.assertEqual(rv.headers.get('ETag'), etag)
+        rv = self.app.get('/get_by_key', query_string=dict(movie_key='Vertigo (1958)'))
+        self.assertNotEqual(rv.headers.get('ETag'), etag)
+
+        # Test that a request with a matching ETag gets a 304 with no data:
+        rv = self.app.get('/get_by_key', query_string=msg,
+                          headers={'If-None-Match': etag})
+        self.assertEqual(rv.status_code, 304)
+        self.assertEqual(rv.data, b'')
+        self.assertEqual(rv.headers.get('ETag'), etag)
+
+        # Test that a request with an old ETag gets the full response:
+        rv = self.app.get('/get_by_key', query_string=msg,
+                          headers={'If-None-Match': '"old-version"'})
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(json.loads(rv.data)['movie_key'], 'About a Boy (2014)')
+
+        # Test If-Modified-Since, with a time after and before the data was modified:
+        last_modified = rv.headers.get('Last-Modified')
+        rv = self.app.get('/get_by_key', query_string=msg,
+                          headers={'If-Modified-Since': last_modified})
+        self.assertEqual(rv.status_code, 304)
+        rv = self.app.get('/get_by_key', query_string=msg,
+                          headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        self.assertEqual(rv.status_code, 200)
+
+        # Test that the ETag, and Last-Modified, change with the API version:
+        api_version = sfmovies.Api_Version
+        try:
+            sfmovies.Api_Version = '2099-01-01'
+            rv = self.app.get('/get_by_key', query_string=msg,
+                              headers={'If-None-Match': etag})
+            self.assertEqual(rv.status_code, 200)
+            self.assertNotEqual(rv.headers.get('ETag'), etag)
+        finally:
+            sfmovies.Api_Version = api_version
+        api_version_time = sfmovies.Api_Version_Time
+        try:
+            sfmovies.Api_Version_Time = calendar.timegm((2099, 1, 1, 0, 0, 0))
+            rv = self.app.get('/get_by_key', query_string=msg,
+                              headers={'If-Modified-Since': last_modified})
+            self.assertEqual(rv.status_code, 200)
+            self.assertTrue('2099' in rv.headers.get('Last-Modified'))
+        finally:
+            sfmovies.Api_Version_Time = api_version_time
+
+        # Test that the index page is not cached:
+        rv = self.app.get('/')
+        self.assertEqual(rv.headers.get('ETag'), None)
+
+
+    def test_rendered_responses(self):
+        key = 'Vertigo (1958)'
+        msg = dict(movie_key=key)
+        sfmovies.Rendered_Bodies.clear()
+        rv = self.app.get('/get_by_key', query_string=msg)
+        data = json.loads(rv.data)
+        self.assertEqual(data, {'movie_key': key, 'locs': sfmovies.mdb.get_locs_by_key(key)})
+        self.assertEqual(rv.headers.get('Content-Encoding'), None)
+        self.assertEqual(rv.headers.get('Vary'), 'Accept-Encoding')
+        self.assertEqual(rv.mimetype, 'application/json')
+        etag = rv.headers.get('ETag')
+        # The body is memoized, and served again without rendering it:
+        version = sfmovies.mdb.get_version()[0]
+        bodies = sfmovies.Rendered_Bodies[(version, 'get_by_key', key)]
+        self.assertEqual(bodies[''], rv.data)
+        rv = self.app.get('/get_by_key', query_string=msg)
+        self.assertEqual(rv.data, bodies[''])
+
+        # A client which accepts gzip gets the compressed body, with its own ETag:
+        rv = self.app.get('/get_by_key', query_string=msg,
+                          headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(rv.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(rv.data).decode('utf-8')), data)
+        gzip_etag = rv.headers.get('ETag')
+        self.assertEqual(gzip_etag, etag[:-1] + '-gzip"')
+        rv = self.app.get('/get_by_key', query_string=msg,
+                          headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag})
+        self.assertEqual(rv.status_code, 304)
+        self.assertEqual(rv.headers.get('ETag'), gzip_etag)
+        self.assertEqual(rv.headers.get('Vary'), 'Accept-Encoding')
+        rv = self.app.get('/get_by_key', query_string=msg,
+                          headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertEqual(rv.headers.get('Content-Encoding'), None)
+
+        # Small bodies are not compressed:
+        rv = self.app.get('/get_movie_info', query_string=msg,
+                          headers={'Accept-Encoding': 'gzip'})
+        data = json.loads(rv.data)
+        self.assertEqual(data['info'], sfmovies.mdb.get_movie_info(key))
+        self.assertEqual(rv.headers.get('Content-Encoding'), None)
+        self.assertEqual(sfmovies.encode_body(b'{}'), {'': b'{}'})
+
+        # Unknown keys are not memoized:
+        rv = self.app.get('/get_by_key', query_string=dict(movie_key='No Such Movie'))
+        self.assertEqual(json.loads(rv.data)['locs'], [])
+        self.assertFalse((version, 'get_by_key', 'No Such Movie') in sfmovies.Rendered_Bodies)
+
+        # When there are too many bodies, the least recently used one is evicted:
+        keys = ['About a Boy (2014)', "Ocean's 11 (2001)", 'Vertigo (1958)']
+        max_rendered = sfmovies.Max_Rendered_Responses
+        sfmovies.Max_Rendered_Responses = 2
+        try:
+            sfmovies.Rendered_Bodies.clear()
+            for movie_key in [keys[0], keys[1], keys[0], keys[2]]:
+                rv = self.app.get('/get_by_key', query_string=dict(movie_key=movie_key))
+                self.assertEqual(json.loads(rv.data)['locs'],
+                                 sfmovies.mdb.get_locs_by_key(movie_key))
+            self.assertEqual(list(sfmovies.Rendered_Bodies.keys()),
+                             [(version, 'get_by_key', keys[0]),
+                              (version, 'get_by_key', keys[2])])
+        finally:
+            sfmovies.Max_Rendered_Responses = max_rendered
+            sfmovies.Rendered_Bodies.clear()
+
+
+    def test_columnar_format(self):
+        # Responses are compact JSON:
+        msg = dict(radius='5000.0', lat='37.7937', lng='-122.3999', page_size=500)
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        self.assertEqual(rv.data, sfmovies.encode_json(json.loads(rv.data)))
+        # The encoding is lossless, for full-precision floats and non-ASCII text,
+        # with either encoder:
+        data = {'latlngs': [37.79371234567891, -122.39990000000001, 1e-07],
+                'desc': 'Caf\u00e9 \u201cTrieste\u201d', 'ids': [0, -1, 2**40, 2**70]}
+        for encoded in encode_json_both(data):
+            self.assertEqual(json.loads(encoded.decode('utf-8')), data)
+        locs = json.loads(rv.data)['locs']
+        self.assertTrue(len(locs) > 4)
+
+        # The columnar format holds the same locations:
+        msg['format'] = 'columnar'
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        columns = json.loads(rv.data)['locs']
+        self.assertEqual(decode_columns(columns), locs)
+        self.assertEqual(len(columns['keys']), len(set(loc[0] for loc in locs)))
+        # Which is smaller, for a dense query with many locations per movie:
+        self.assertTrue(len(sfmovies.encode_json(columns)) < len(sfmovies.encode_json(locs)))
+
+        # With line segments, from /get_by_indexes:
+        indexes = list(range(0, 1000, 7))
+        rv = self.app.get('/get_by_indexes', query_string=dict(indexes=json.dumps(indexes),
+                                                               format='columnar'))
+        columns = json.loads(rv.data)['locs']
+        self.assertTrue(1 in columns['has_segment'])
+        self.assertEqual(decode_columns(columns), sfmovies.mdb.get_locs_by_indexes(indexes))
+
+        # With distances, from /get_nearest:
+        rv = self.app.get('/get_nearest', query_string=dict(lat=37.7937, lng=-122.3999, k=5,
+                                                            format='columnar'))
+        columns = json.loads(rv.data)['locs']
+        locs = sfmovies.mdb.nearest(37.7937, -122.3999, 5)
+        self.assertEqual(columns['dists'], [loc[4] for loc in locs])
+        self.assertEqual(decode_columns(columns), [loc[:4] for loc in locs])
+
+        # An empty result:
+        rv = self.app.get('/get_by_bbox', query_string=dict(min_lat=0, max_lat=1, min_lng=0,
+                                                            max_lng=1, format='columnar'))
+        self.assertEqual(json.loads(rv.data)['locs']['keys'], [])
+
+
+    def test_marker_groups(self):
+        # Viewport queries can return one record per group of co-located locations:
+        box = dict(min_lat=37.78, max_lat=37.80, min_lng=-122.42, max_lng=-122.39)
+        rv = self.app.get('/get_by_bbox', query_string=box)
+        data = json.loads(rv.data)
+        box['group'] = 1
+        rv = self.app.get('/get_by_bbox', query_string=box)
+        grouped = json.loads(rv.data)
+        self.assertEqual(grouped['total'], data['total'])
+        self.assertEqual(grouped['groups'], sfmovies.mdb.get_groups_by_indexes(data['indexes']))
+        self.assertEqual(grouped['total_groups'], len(grouped['groups']))
+        self.assertTrue(len(grouped['groups']) < len(data['locs']))
+        self.assertTrue(len(rv.data) < len(sfmovies.encode_json(data)))
+        box['limit'] = 2
+        rv = self.app.get('/get_by_bbox', query_string=box)
+        self.assertEqual(json.loads(rv.data)['groups'], grouped['groups'][:2])
+
+        # Radius searches page through the groups:
+        msg = dict(radius='3000.0', lat='37.7937', lng='-122.3999', group='true', page_size=10)
+        groups = sfmovies.mdb.get_groups_by_indexes(
+            sfmovies.mdb.get_indexes_by_loc(37.7937, -122.3999, 3000.0))
+        pages = []
+        cursor = 0
+        while cursor is not None:
+            msg['cursor'] = cursor
+            rv = self.app.get('/search_by_loc', query_string=msg)
+            data = json.loads(rv.data)
+            self.assertEqual(data['total'], len(groups))
+            pages += data['groups']
+            cursor = data['next_cursor']
+        self.assertEqual(pages, groups)
+        msg['format'] = 'ndjson'
+        msg['cursor'] = 0
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        lines = rv.data.decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], groups)
+
+
+    def test_batch(self):
+        key = 'About a Boy (2014)'
+        body = {'keys': [key, "Ocean's 11 (2001)", {'movie_key': key, 'locs': False}]}
+        rv = self.app.post('/batch', data=json.dumps(body), content_type='application/json')
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.headers.get('ETag'), None)
+        results = json.loads(rv.data)['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0], {'movie_key': key, 'found': True,
+                                      'info': sfmovies.mdb.get_movie_info(key),
+                                      'locs': sfmovies.mdb.get_locs_by_key(key)})
+        self.assertEqual(results[1], {'movie_key': "Ocean's 11 (2001)", 'found': False,
+                                      'info': [], 'locs': []})
+        self.assertEqual(results[2], {'movie_key': key, 'found': True,
+                                      'info': sfmovies.mdb.get_movie_info(key)})
+
+        # The default flags apply to every key:
+        body = {'keys': [key], 'info': False}
+        rv = self.app.post('/batch', data=json.dumps(body), content_type='application/json')
+        self.assertEqual(json.loads(rv.data)['results'][0].keys(),
+                         set(['movie_key', 'found', 'locs']))
+
+        # Test invalid bodies, and a batch which is too large:
+        for data in ['not json', json.dumps({'keys': 'About a Boy (2014)'}), json.dumps([key])]:
+            rv = self.app.post('/batch', data=data, content_type='application/json')
+            self.assertEqual(rv.status_code, 400)
+            self.assertEqual(json.loads(rv.data)['results'], [])
+        # The flags must be JSON booleans, so the string "false" is not true:
+        for body in [{'keys': [key], 'info': 'false'}, {'keys': [], 'locs': 0},
+                     {'keys': [{'movie_key': key, 'locs': 'false'}]},
+                     {'keys': [{'movie_key': key, 'info': None}]}]:
+            rv = self.app.post('/batch', data=json.dumps(body), content_type='application/json')
+            self.assertEqual(rv.status_code, 400)
+            self.assertEqual(json.loads(rv.data)['results'], [])
+        max_size = sfmovies.app.config['MAX_BATCH_SIZE']
+        rv = self.app.post('/batch', data=json.dumps({'keys': [key] * (max_size+1)}),
+                           content_type='application/json')
+        self.assertEqual(rv.status_code, 413)
+        rv = self.app.post('/batch', data=json.dumps({'keys': [key] * max_size}),
+                           content_type='application/json')
+        self.assertEqual(len(json.loads(rv.data)['results']), max_size)
+
+
+
+    def test_get_by_bbox(self):
+        box = dict(min_lat=37.77, max_lat=37.79, min_lng=-122.42, max_lng=-122.39)
+        rv = self.app.get('/get_by_bbox', query_string=box)
+        data = json.loads(rv.data)
+        indexes = sfmovies.mdb.get_indexes_by_bbox(37.77, 37.79, -122.42, -122.39)
+        self.assertTrue(len(indexes) > 0)
+        self.assertEqual(data['total'], len(indexes))
+        self.assertEqual(data['indexes'], indexes)
+        self.assertEqual(data['locs'], sfmovies.mdb.get_locs_by_indexes(indexes[:500]))
+        self.assertTrue(rv.headers.get('ETag'))
+
+        # Test a limit on the number of locations:
+        rv = self.app.get('/get_by_bbox', query_string=dict(box, limit=3))
+        data = json.loads(rv.data)
+        self.assertEqual(data['total'], len(indexes))
+        self.assertEqual(data['locs'], sfmovies.mdb.get_locs_by_indexes(indexes[:3]))
+
+        # Zoomed in, locations are returned; zoomed out, clusters are:
+        rv = self.app.get('/get_by_bbox', query_string=dict(box, zoom=16))
+        self.assertEqual(len(json.loads(rv.data)['locs']), len(indexes))
+        for args in [dict(box, zoom=12), dict(box, cluster=1)]:
+            rv = self.app.get('/get_by_bbox', query_string=args)
+            data = json.loads(rv.data)
+            self.assertEqual(data['total'], len(indexes))
+            self.assertTrue(0 < len(data['clusters']) < len(indexes))
+            self.assertEqual(sum(c['count'] for c in data['clusters']), len(indexes))
+
+        # A box which is a single point, or a very large zoom, has the smallest
+        # cells, rather than cells of no size:
+        loc = sfmovies.mdb.get_locs_by_indexes(indexes[:1])[0]
+        lat, lng = loc[3][0], loc[3][1]
+        point = dict(min_lat=lat, max_lat=lat, min_lng=lng, max_lng=lng)
+        for args in [dict(point, cluster=1), dict(box, zoom=2000, cluster=1)]:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                rv = self.app.get('/get_by_bbox', query_string=args)
+            data = json.loads(rv.data)
+            self.assertEqual(data['cell_size'], sfmovies.Min_Cluster_Cell_Size)
+            self.assertTrue(len(data['clusters']) > 0)
+        self.assertEqual(data['total'], len(indexes))
+
+        # Test a missing argument:
+        rv = self.app.get('/get_by_bbox', query_string=dict(min_lat=37.77, max_lat=37.79))
+        data = json.loads(rv.data)
+        self.assertEqual((data['total'], data['locs']), (0, []))
+
+
+    def test_get_nearest(self):
+        rv = self.app.get('/get_nearest', query_string=dict(lat=37.7937, lng=-122.3999, k=3))
+        data = json.loads(rv.data)
+        self.assertEqual((data['lat'], data['lng'], data['k']), (37.7937, -122.3999, 3))
+        self.assertEqual(data['locs'], sfmovies.mdb.nearest(37.7937, -122.3999, 3))
+        dists = [loc[4] for loc in data['locs']]
+        self.assertEqual(dists, sorted(dists))
+
+        # Test the default and maximum k:
+        rv = self.app.get('/get_nearest', query_string=dict(lat=37.7937, lng=-122.3999))
+        self.assertEqual(len(json.loads(rv.data)['locs']), sfmovies.Default_Nearest_K)
+        rv = self.app.get('/get_nearest', query_string=dict(lat=37.7937, lng=-122.3999, k=10000))
+        self.assertEqual(len(json.loads(rv.data)['locs']), sfmovies.Max_Nearest_K)
+
+        # Test a missing argument:
+        rv = self.app.get('/get_nearest', query_string=dict(lat=37.7937))
+        self.assertEqual(json.loads(rv.data)['locs'], [])
+
+
+    def test_facet_filters(self):
+        # The counts of the movies' facets are only given when asked for:
+        msg = dict(radius='3000.0', lat='37.7937', lng='-122.3999')
+        rv = self.app.get('/get_indexes_by_loc', query_string=msg)
+        self.assertFalse('facets' in json.loads(rv.data))
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        self.assertFalse('facets' in json.loads(rv.data))
+        msg['facets'] = '1'
+        rv = self.app.get('/get_indexes_by_loc', query_string=msg)
+        data = json.loads(rv.data)
+        self.assertEqual(data['facets'], sfmovies.mdb.get_facet_counts(data['indexes']))
+        self.assertEqual(sum(c for y, c in data['facets']['year']), len(data['indexes']))
+
+        # Test filtering on a range of years and a director:
+        filters = dict(min_year=1950, max_year=1969, director='Alfred Hitchcock')
+        msg.update(filters)
+        rv = self.app.get('/get_indexes_by_loc', query_string=msg)
+        data = json.loads(rv.data)
+        expected = sfmovies.mdb.get_indexes_by_loc(37.7937, -122.3999, 3000.0, filters)
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(data['indexes'], expected)
+        self.assertEqual(data['facets']['director'], [['Alfred Hitchcock', len(expected)]])
+        for year, count in data['facets']['year']:
+            self.assertTrue(1950 <= year <= 1969)
+
+        # Paged searches are filtered too:
+        rv = self.app.get('/search_by_loc', query_string=msg)
+        data = json.loads(rv.data)
+        self.assertEqual(data['total'], len(expected))
+        self.assertEqual(data['locs'], sfmovies.mdb.get_locs_by_indexes(expected))
+        self.assertEqual(data['facets'], sfmovies.mdb.get_facet_counts(expected))
+
+        # Test an invalid year:
+        msg['min_year'] = 'abc'
+        rv = self.app.get('/get_indexes_by_loc', query_string=msg)
+        self.assertEqual(json.loads(rv.data)['indexes'], [])
+
+
+    def test_search(self):
+        # Test on an empty query:
+        rv = self.app.get('/search', query_string=dict(q=''))
+        data = json.loads(rv.data)
+        self.assertEqual((data['keys'], data['locs']), ([], []))
+
+        # A director's name finds all of their movies, and their locations:
+        rv = self.app.get('/search', query_string=dict(q='Hitchcock'))
+        data = json.loads(rv.data)
+        self.assertEqual(data['q'], 'Hitchcock')
+        self.assertIn('Vertigo (1958)', data['keys'])
+        self.assertEqual(data['total_keys'], len(data['keys']))
+        self.assertEqual(data['locs'], sfmovies.mdb.get_locs_by_indexes(data['indexes']))
+        keys = set(loc[0] for loc in data['locs'])
+        self.assertTrue(keys.issubset(set(data['keys'])))
+
+        # Adding a word from the location descriptions narrows the locations:
+        rv = self.app.get('/search', query_string=dict(q='hitchcock coit'))
+        narrow = json.loads(rv.data)
+        self.assertTrue(0 < narrow['total_indexes'] < data['total_indexes'])
+        for loc in narrow['locs']:
+            self.assertIn('coit', (loc[1] + ' ' + loc[2]).lower())
+
+        # Test a prefix, with a limit:
+        rv = self.app.get('/search', query_string=dict(q='hitch*', limit=2))
+        data = json.loads(rv.data)
+        self.assertEqual(len(data['keys']), 2)
+        self.assertEqual(len(data['locs']), 2)
+        self.assertTrue(data['total_keys'] > 2)
+
+        # Test on a word that does not match:
+        rv = self.app.get('/search', query_string=dict(q='zzzz'))
+        data = json.loads(rv.data)
+        self.assertEqual((data['keys'], data['total_indexes']), ([], 0))
+
+
+def decode_columns(columns):
+    """
+    Output: the list of locations in a columnar response (see sfmovies.format_locs()).
+    """
+    locs = []
+    pos = 0
+    for i, key_id in enumerate(columns['key_ids']):
+        num = 4 if columns['has_segment'][i] else 2
+        locs.append([columns['keys'][key_id], columns['descs'][i], columns['funfacts'][i],
+                     columns['latlngs'][pos:pos+num]])
+        pos += num
+    return locs
+
+
+
+def encode_json_both(data):
+    """
+    Output: the data encoded by sfmovies.encode_json() with orjson (if it is
+            installed), and with json.
+    """
+    orjson = sfmovies.orjson
+    fast = sfmovies.encode_json(data)
+    try:
+        sfmovies.orjson = None
+        slow = sfmovies.encode_json(data)
+    finally:
+        sfmovies.orjson = orjson
+    return fast, slow
+
+
+
 if __name__ == '__main__':
     unittest.main()
 
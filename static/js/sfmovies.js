@@ -97,12 +97,21 @@ function handle_get_by_key(event)
 
 
 
-function handle_index_loc_resp(msg)
+function handle_search_by_loc_resp(msg)
 {
-    // This function is called when the client receives the message from
-    // the server containing location info.
-    // This function loops through the locations in the message and
-    // calls the function to add a marker on the map for each one.
+    // This function is called when the client receives a page of filming
+    // locations within the search radius from the server.
+    // It adds a marker on the map for each location, and then requests
+    // the next page of locations, if there is one.
+
+    if (msg.cursor == 0) {
+	// First page: clear the map and add a red circle showing the filter/search radius:
+	clear_map();
+	rad_meters = msg.radius * 0.3048; // Convert feet to meters, units for Leaflet.
+	circle = L.circle([msg.lat, msg.lng], rad_meters, {color:'red'});
+	Movie_Locs_Layer.addLayer(circle);
+    }
+
     locs = msg.locs;
     for (var i=0; i<locs.length; i++) {
 	movie_key = locs[i][0];
@@ -111,35 +120,12 @@ function handle_index_loc_resp(msg)
 	latlng = locs[i][3];
 	add_loc_marker(movie_key, latlng, desc, funfact);
     }
-}
-
 
-function handle_get_indexes_resp(msg)
-{
-    // This function is called when the client receives a response message from the
-    // server with a list of indexes into the database of filming locations.
-    // It then requests info for these locations from the server so they
-    // can be added to the map.
-
-    // Clear the map and add a red circle showing the filter/search radius:
-    clear_map();
-    lat = msg.lat;
-    lng = msg.lng;
-    radius = msg.radius;
-    indexes = msg.indexes;
-    rad_meters = radius * 0.3048; // Convert feet to meters, units for Leaflet.
-    circle = L.circle([lat, lng], rad_meters, {color:'red'});
-    Movie_Locs_Layer.addLayer(circle);
-
-    // For each filming location in this search radius (represented by an index),
-    // this loops and does a GET request to the server to get the appropriate
-    // location information.  It groups indexes in blocks of up to 10.
-    for (var i=0; i<indexes.length; i += 10) {
-	vals = indexes.slice(i, Math.min(i+10, indexes.length));
-	vals_str = JSON.stringify(vals)
-	$.get(Get_by_Indexes_URL,
-	  {'indexes': vals_str},
-	  handle_index_loc_resp);
+    if (msg.next_cursor != null) {
+	$.get(Search_by_Loc_URL,
+	      {'lat': msg.lat, 'lng': msg.lng, 'radius': msg.radius,
+	       'cursor': msg.next_cursor},
+	      handle_search_by_loc_resp);
     }
 }
 
@@ -156,9 +142,9 @@ function handle_get_by_loc(event)
     latlng = Loc_Marker.getLatLng();
     console.log('handle_get_by_loc()' + radius + latlng.lat);
 
-    $.get(Get_Indexes_by_Loc_URL,
+    $.get(Search_by_Loc_URL,
 	  {'lat': latlng.lat, 'lng': latlng.lng, 'radius': radius},
-	  handle_get_indexes_resp);
+	  handle_search_by_loc_resp);
 }
 
 
@@ -230,9 +216,13 @@ $(window).load(function()
     // Setup the map:
     map_setup();
 
-    // Configure the autocomplete field:
+    // Configure the autocomplete field, which asks the server for matching movies:
     $( "#movieName" ).autocomplete({
-	source: Movie_Keys
+	source: function(request, response) {
+	    $.get(Suggest_URL,
+		  {'q': request.term},
+		  function(msg) { response(msg.keys); });
+	}
     });
 });
 